@@ -0,0 +1,62 @@
+import os
+import threading
+import time
+
+import metrics
+from db import snapshot
+
+
+class CompensationSnapshot:
+    """
+    Worker side handle on the columnar compensation snapshot (db.snapshot)
+    in COMPENSATION_SNAPSHOT_PATH. The snapshot is mapped on first use and
+    remapped once a build (e.g. `flask build-compensation-snapshot` run from
+    cron) has swapped in a new manifest.
+    """
+    def __init__(self, app=None):
+        self.path = None
+        self._snapshot = None
+        self._mtime = None
+        self._lock = threading.Lock()
+        self.loads = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.path = app.config.get('COMPENSATION_SNAPSHOT_PATH') or \
+                os.path.join(app.instance_path, 'compensation_snapshot')
+        metrics.register('compensation_snapshot', self.stats)
+
+    def get(self):
+        """The current snapshot, or None if none has been built."""
+        try:
+            mtime = os.stat(os.path.join(self.path, snapshot.MANIFEST)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+        with self._lock:
+            if mtime != self._mtime:
+                self._snapshot = snapshot.Snapshot(self.path)
+                self._mtime = mtime
+                self.loads += 1
+            return self._snapshot
+
+    def build(self, full=False):
+        return snapshot.build(self.path, full=full)
+
+    def info(self, current=None):
+        current = current or self.get()
+        if current is None:
+            return None
+        built_at = current.manifest['built_at']
+        return dict(
+                built_at=built_at,
+                age_seconds=int(time.time()) - built_at,
+                rows={kind: current.rows(kind) for kind in snapshot.POST_MODELS})
+
+    def stats(self):
+        return dict(path=self.path, loads=self.loads, snapshot=self.info())
+
+
+compensation_snapshot = CompensationSnapshot()
@@ -3,10 +3,20 @@ import logging
 
 import flask
 from flask_cors import CORS
-from flask_session import Session as FlaskSession
 
 import blueprints
-from db.database import Session as DBSession
+import commands
+import sessions
+from page_visits import page_visit_buffer
+from cache import response_cache
+from compression import compressor
+from query_log import query_log
+from writer import writer
+from hashing import password_hasher
+from typeahead import typeahead
+from analytics import compensation_snapshot
+from db import database as db
+import metrics as app_metrics
 
 
 FORMAT = '%(asctime)s %(message)s'
@@ -24,9 +34,21 @@ def create_app(config='dev'):
 
     app.secret_key = app.config['SECRET_KEY']
 
+    # storage profile and connection pools
+    db.init_app(app)
+    app_metrics.register('db_pools', db.pool_stats)
+
     # setup flask plugins
     CORS(app, supports_credentials=True)
-    FlaskSession(app)
+    sessions.init_app(app)
+    page_visit_buffer.init_app(app)
+    response_cache.init_app(app)
+    compressor.init_app(app)
+    query_log.init_app(app)
+    writer.init_app(app)
+    password_hasher.init_app(app)
+    typeahead.init_app(app)
+    compensation_snapshot.init_app(app)
 
     # ensure the instance folder exists
     try:
@@ -36,32 +58,22 @@ def create_app(config='dev'):
 
     @app.before_request
     def session_create():
-        flask.g.session = DBSession
-
-        if 'db_commit' not in flask.g:
-            flask.g.db_commit = commit
+        # requests read through the read only pool, their writes are made
+        # by writer.write on the write engine
+        flask.g.session = db.ReadSession
 
     @app.teardown_appcontext
     def shutdown_session(response_or_exc):
-        flask.g.session.remove()
-
-    def commit(session, objs):
-        """
-        Simple decorator that wraps sqlalchemy object creation in a session context
-        and attempts a commit.
-        """
-        try:
-            session.add_all(objs)
-            session.commit()
-        except Exception as e:
-            logger.error(e)
-            session.rollback()
-            return False
-
-        return True
+        # cli commands push an app context without running before_request
+        if 'session' in flask.g:
+            flask.g.session.remove()
+            db.Session.remove()
 
     app.register_blueprint(blueprints.account)
     app.register_blueprint(blueprints.auth)
     app.register_blueprint(blueprints.orgs)
+    app.register_blueprint(blueprints.metrics)
+
+    commands.init_app(app)
 
     return app
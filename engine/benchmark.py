@@ -0,0 +1,375 @@
+"""
+Endpoint benchmarks.
+
+    python benchmark.py --scales 0.1 1 --requests 500 --output bench.json
+    python benchmark.py --scales 1 --baseline bench.json
+
+Databases are built with db.data_create (one per scale factor and seed, kept
+under db/bench/ and reused across runs). Each scale is run in a fresh process
+against a scratch copy of its database, so writes made by the benchmark don't
+leak into the next run and peak RSS is per scale. Requests go through the
+Flask test client, or a local threaded WSGI server with --wsgi.
+
+A response is an error when it is not a 200 or its json carries an error.
+For every endpoint the report has throughput, p50/p95/p99 latency, SQL
+statements per request and the process' peak RSS once the endpoint has run.
+Results are written as JSON; --baseline prints the change against an earlier
+result file.
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from random import Random
+
+
+BENCH_DIR = os.path.join(Path.cwd(), 'db', 'bench')
+BENCH_PASSWORD = 'account_i'
+SORT_ORDERS = ['UPVOTES', 'DOWNVOTES', 'TENURE', 'COMPENSATION']
+
+
+def _percentile(samples, percentile):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(percentile / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def bench_database(scale, seed, workers=None):
+    """Path of the generated database for a scale and seed, built if missing."""
+    from db.data_create import generate_dummy_data
+
+    os.makedirs(BENCH_DIR, exist_ok=True)
+    path = os.path.join(BENCH_DIR, f'sf{scale:g}_seed{seed}.db')
+    if not os.path.exists(path):
+        partial = f'{path}.partial'
+        if os.path.exists(partial):
+            os.remove(partial)
+        generate_dummy_data(scale=scale, seed=seed, workers=workers, database=partial)
+        os.replace(partial, path)
+    return path
+
+
+def _failed(status, body):
+    """Whether a response failed: a non 200 status, or a 200 json object
+    carrying an error, as the endpoints answer most failures."""
+    if status != 200:
+        return True
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return False
+    return isinstance(data, dict) and bool(data.get('error') or data.get('message'))
+
+
+def endpoints(orgs, post_ids, rng):
+    """(name, request factory) pairs. A factory returns the method, path and
+    json body of the next request. post_ids are the review and interview
+    ids to vote on, by vote_model_type."""
+    org_ids = [org_id for org_id, _ in orgs]
+    # substrings of real org names: a few letters of the random part
+    names = [name.split('_')[1] for _, name in orgs]
+
+    def get_names():
+        return 'GET', f'/orgs/get-names?limit=50&offset={rng.randint(0, 500)}', None
+
+    def search():
+        name = rng.choice(names)
+        start = rng.randint(0, max(0, len(name) - 3))
+        return 'GET', f'/orgs/search?org_name={name[start:start + rng.randint(3, 6)]}', None
+
+    def typeahead():
+        name = rng.choice(names)
+        return 'GET', f'/orgs/typeahead?q=org_{name[:rng.randint(1, 4)]}', None
+
+    def org():
+        return 'GET', f'/orgs/{rng.choice(org_ids)}', None
+
+    def reviews():
+        sort_order = rng.choice(SORT_ORDERS)
+        return 'GET', f'/orgs/{rng.choice(org_ids)}/reviews?sort_order={sort_order}', None
+
+    def interviews():
+        return 'GET', f'/orgs/{rng.choice(org_ids)}/interviews?sort_order=STAGES', None
+
+    def check_session():
+        return 'GET', '/auth/check-session', None
+
+    def vote():
+        vote_model_type = rng.choice(list(post_ids))
+        return 'PUT', '/account/vote', dict(
+                post_id=rng.choice(post_ids[vote_model_type]),
+                vote=rng.choice([1, -1]),
+                vote_model_type=vote_model_type)
+
+    return [
+        ('get_names', get_names),
+        ('search', search),
+        ('typeahead', typeahead),
+        ('org', org),
+        ('org_reviews', reviews),
+        ('org_interviews', interviews),
+        ('check_session', check_session),
+        ('vote', vote),
+    ]
+
+
+class TestClientRunner:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def login(self, username, password):
+        response = self.client.post('/auth/login', json=dict(username=username, password=password))
+        if not response.get_json().get('authenticated'):
+            raise RuntimeError(f'benchmark login failed: {response.get_data(as_text=True)}')
+
+    def run(self, requests, concurrency):
+        timings, errors = [], 0
+        for method, path, body in requests:
+            start = time.perf_counter()
+            response = self.client.open(path, method=method, json=body)
+            data = response.get_data()
+            timings.append(time.perf_counter() - start)
+            errors += _failed(response.status_code, data)
+        return timings, errors
+
+    def close(self):
+        pass
+
+
+class WSGIRunner:
+    """Requests over http to a threaded werkzeug server in this process."""
+    def __init__(self, app):
+        from werkzeug.serving import make_server, WSGIRequestHandler
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_request(self, *args, **kwargs):
+                pass
+
+        self.server = make_server('127.0.0.1', 0, app, threaded=True,
+                                  request_handler=QuietHandler)
+        self.port = self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.headers = {'Content-Type': 'application/json'}
+
+    def _request(self, method, path, body):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port)
+        try:
+            conn.request(method, path, body=json.dumps(body) if body else None,
+                         headers=self.headers)
+            response = conn.getresponse()
+            return response, response.read()
+        finally:
+            conn.close()
+
+    def login(self, username, password):
+        response, body = self._request('POST', '/auth/login',
+                                       dict(username=username, password=password))
+        if not json.loads(body).get('authenticated'):
+            raise RuntimeError(f'benchmark login failed: {body.decode()}')
+        cookie = response.getheader('Set-Cookie')
+        if cookie:
+            self.headers['Cookie'] = cookie.split(';', 1)[0]
+
+    def run(self, requests, concurrency):
+        def timed(request):
+            start = time.perf_counter()
+            response, body = self._request(*request)
+            return time.perf_counter() - start, _failed(response.status, body)
+
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(timed, requests))
+        return [t for t, _ in results], sum(error for _, error in results)
+
+    def close(self):
+        self.server.shutdown()
+
+
+def run_scale(database, options):
+    """Benchmark every endpoint against database. Runs in its own process as
+    the app binds its engine to RATRACE_DATABASE on import."""
+    os.environ['RATRACE_DATABASE'] = database
+
+    from sqlalchemy import event, select
+    import config
+    if options['session_backend']:
+        config.Config.SESSION_BACKEND = options['session_backend']
+
+    from app import create_app
+    from cache import response_cache
+    from compression import compressor
+    from db import database as db, migrations
+    from db.models import Organisation, Review, Interview
+
+    # databases may have been generated by an older version of the schema,
+    # upgrade before the app starts reading them in the background
+    db.configure()
+    migrations.upgrade_db()
+    app = create_app(options['config'])
+    # requests are made over plain http, where a secure session cookie is
+    # never sent back and every authenticated endpoint would answer early
+    app.config['SESSION_COOKIE_SECURE'] = False
+    if not options['cache']:
+        response_cache.enabled = False
+        compressor.cache.enabled = False
+
+    statements = [0]
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements[0] += 1
+
+    for engine in (db.engine, db.read_engine):
+        event.listen(engine, 'before_cursor_execute', count_statement)
+
+    with db.engine.connect() as conn:
+        orgs = conn.execute(select(Organisation.id, Organisation.name)).all()
+        post_ids = {'review': conn.execute(select(Review.id)).scalars().all(),
+                    'interview': conn.execute(select(Interview.id)).scalars().all()}
+
+    runner = WSGIRunner(app) if options['wsgi'] else TestClientRunner(app)
+    runner.login('account_1', BENCH_PASSWORD)
+
+    rng = Random(options['seed'])
+    results = {}
+    try:
+        for name, next_request in endpoints(orgs, post_ids, rng):
+            if options['endpoints'] and name not in options['endpoints']:
+                continue
+
+            runner.run([next_request() for _ in range(options['warmup'])], options['concurrency'])
+
+            requests = [next_request() for _ in range(options['requests'])]
+            statements[0] = 0
+            start = time.perf_counter()
+            timings, errors = runner.run(requests, options['concurrency'])
+            elapsed = time.perf_counter() - start
+
+            timings_ms = [t * 1000 for t in timings]
+            results[name] = dict(
+                    requests=len(requests),
+                    errors=errors,
+                    throughput_rps=round(len(requests) / elapsed, 1),
+                    mean_ms=round(statistics.fmean(timings_ms), 3),
+                    p50_ms=round(_percentile(timings_ms, 50), 3),
+                    p95_ms=round(_percentile(timings_ms, 95), 3),
+                    p99_ms=round(_percentile(timings_ms, 99), 3),
+                    sql_per_request=round(statements[0] / len(requests), 2),
+                    peak_rss_mb=_peak_rss_mb())
+            print(f"  {name:<16} {results[name]['throughput_rps']:>9} req/s  "
+                  f"p50 {results[name]['p50_ms']:>8}ms  p99 {results[name]['p99_ms']:>8}ms  "
+                  f"{results[name]['sql_per_request']:>6} sql/req  {errors} errors", flush=True)
+    finally:
+        runner.close()
+
+    return dict(orgs=len(orgs), endpoints=results)
+
+
+def _run_in_process(database, options):
+    # spawn so the child imports the app (and its engine) from scratch
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1) as pool:
+        return pool.apply(run_scale, (database, options))
+
+
+def compare(results, baseline):
+    """Print latency and query count changes against a baseline result."""
+    for scale, current in results['scales'].items():
+        previous = baseline.get('scales', {}).get(scale)
+        if not previous:
+            print(f"scale {scale}: not in baseline")
+            continue
+
+        print(f"scale {scale} against baseline:")
+        for name, stats in current['endpoints'].items():
+            before = previous['endpoints'].get(name)
+            if not before:
+                continue
+
+            changes = []
+            for key in ('p50_ms', 'p99_ms', 'throughput_rps'):
+                if before[key]:
+                    changes.append(f"{key} {(stats[key] - before[key]) / before[key]:+.1%}")
+            changes.append(f"sql/req {before['sql_per_request']} -> {stats['sql_per_request']}")
+            print(f"  {name:<16} " + ', '.join(changes))
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the API endpoints.')
+    parser.add_argument('--scales', type=float, nargs='+', default=[0.1],
+                        help='dummy data scale factors, 1 = 10000 organisations')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--endpoints', nargs='*', default=None,
+                        help='only run these endpoints (default: all)')
+    parser.add_argument('--wsgi', action='store_true',
+                        help='serve the app over http instead of the test client')
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='concurrent clients (with --wsgi)')
+    parser.add_argument('--no-cache', dest='cache', action='store_false',
+                        help='disable the response caches')
+    parser.add_argument('--config', default='production', choices=['dev', 'production'])
+    parser.add_argument('--session-backend', default=None,
+                        choices=['sqlite', 'cookie', 'filesystem'],
+                        help='override Config.SESSION_BACKEND')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='processes used to generate missing databases')
+    parser.add_argument('--output', type=str, default=None, help='write results to this file')
+    parser.add_argument('--baseline', type=str, default=None,
+                        help='results file to compare against')
+    args = parser.parse_args()
+
+    options = dict(seed=args.seed, requests=args.requests, warmup=args.warmup,
+                   endpoints=args.endpoints, wsgi=args.wsgi, cache=args.cache,
+                   concurrency=args.concurrency if args.wsgi else 1, config=args.config,
+                   session_backend=args.session_backend)
+    results = dict(
+            revision=_git_revision(),
+            created_at=int(time.time()),
+            python=platform.python_version(),
+            options=options,
+            scales={})
+
+    for scale in args.scales:
+        source = bench_database(scale, args.seed, args.workers)
+        with tempfile.TemporaryDirectory() as tmp:
+            database = shutil.copy(source, tmp)
+            print(f"scale {scale:g} ({source})", flush=True)
+            results['scales'][f'{scale:g}'] = dict(database=source,
+                                                   **_run_in_process(database, options))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
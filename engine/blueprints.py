@@ -1,32 +1,92 @@
-import gzip
+import io
+import time
 
-from flask import Blueprint, g, request, jsonify, json, make_response, session
-import pandas as pd
-from sqlalchemy import func, desc
+from flask import Blueprint, current_app, g, request, jsonify, session
+from sqlalchemy.orm import selectinload
 
 from db.models import (
-        Organisation, Account, Review, Vote,
-        Interview, ReviewVote, InterviewVote,
-        PostTypeModel, Position
+        Organisation, Account, AccountType, Industry, Review, Vote,
+        Interview,
+        PostTypeModel, Position, normalize_name
 )
 import db.schemas as schemas
+from db import (
+        search, popularity, compensation, votes, activity, post_counts, bulk_import, export,
+        snapshot, industry_compensation)
+from pagination import paginate, InvalidCursor
+from page_visits import page_visit_buffer
+from cache import response_cache
+from compression import compressor
+from writer import writer
+from typeahead import typeahead
+from analytics import compensation_snapshot
+from hashing import password_hasher, HashingBusy
+import metrics as app_metrics
+
+
+COMPACT_VOTES = 'compact'
+
+
+def post_list_query(PostModel, compact=False):
+    """Query for a list of reviews or interviews to be dumped with their
+    schema. The account, position and votes (for the upvotes/downvotes lists)
+    of the whole page are each fetched in one extra SELECT ... IN query
+    rather than lazily per post. Compact pages don't need the votes."""
+    VoteModel, _ = votes.POST_VOTES[PostModel]
+    options = [selectinload(PostModel.account), selectinload(PostModel.position)]
+    if not compact:
+        options.append(selectinload(PostModel.votes).load_only(VoteModel.account_id, VoteModel.vote))
+    return g.session.query(PostModel).options(*options)
+
+
+def post_schema(PostModel, posts, compact=False):
+    """Schema to dump a page of posts with. Posts carry full upvotes and
+    downvotes lists of voter ids by default; compact posts carry the vote
+    counts and my_vote, the logged in account's vote (0 if none), read for
+    the whole page in one query."""
+    if not compact:
+        return schemas.ReviewSchema() if PostModel is Review else schemas.InterviewSchema()
+
+    my_votes = {}
+    account_id = session.get('account_id')
+    if account_id and posts:
+        VoteModel, post_id_col = votes.POST_VOTES[PostModel]
+        my_votes = dict(g.session
+                .query(post_id_col, VoteModel.vote)
+                .filter(VoteModel.account_id == account_id,
+                        post_id_col.in_([post.id for post in posts])))
+
+    Schema = schemas.CompactReviewSchema if PostModel is Review else schemas.CompactInterviewSchema
+    return Schema(context=dict(my_votes=my_votes))
+
+
+def reuse_position(session, org_id, name):
+    """Id of the org's existing position whose normalized name matches
+    `name`, so free text positions don't create duplicates. Falls back to the
+    indexed Position.name_key for ones the typeahead index hasn't seen yet."""
+    position_id = typeahead.position_id(org_id, name)
+    if position_id is not None:
+        return position_id
+
+    return (session
+            .query(Position.id)
+            .filter(Position.org_id == org_id, Position.name_key == normalize_name(name))
+            .order_by(Position.id)
+            .limit(1)
+            .scalar())
 
 
-orgs = Blueprint('orgs', __name__, url_prefix='/orgs')
+def compact_viewer():
+    """Cache key part for org pages: compact pages hold the viewer's votes."""
+    if request.args.get('votes') == COMPACT_VOTES:
+        return session.get('account_id')
+    return None
 
-def min_max_scale(df, col):
-    """Normalize column values between [0, 1]"""
-    return (df[col] - df[col].min()) / (df[col].max() - df[col].min())
 
-def gzippify(data):
-    """Compress data and create gzip response"""
-    content = gzip.compress(json.dumps(data).encode('utf8'))
-    response = make_response(content)
-    response.headers['Content-length'] = len(content)
-    response.headers['Content-Encoding'] = 'gzip'
-    return response
+orgs = Blueprint('orgs', __name__, url_prefix='/orgs')
 
 @orgs.route('/get-names', methods=['GET'])
+@compressor.cacheable
 def get_names():
     limit = request.args.get('limit', type=int, default=50)
     offset = request.args.get('offset', type=int, default=0)
@@ -35,144 +95,197 @@ def get_names():
     if industry:
         filter_queries.append(Organisation.industry == industry)
 
+    # popularity is precomputed over all orgs (db.popularity) so this walks
+    # the (verified, [industry,] popularity) index in order
     find_orgs_q = (g.session
-                   .query(Organisation.id, Organisation.name,
-                        Organisation.page_visits, Organisation.size)
+                   .query(Organisation.id, Organisation.name)
                    .filter(*filter_queries)
+                   .order_by(Organisation.popularity.desc(), Organisation.id.desc())
                    .offset(offset)
                    .limit(limit))
 
-    # create weight for sorting orgs (w = min_max(size) * min_max(page_visits))
-    df = pd.DataFrame(data=find_orgs_q.all(), columns=['id', 'label', 'page_visits', 'size'])
-    df['weight'] = round(min_max_scale(df, 'size') * min_max_scale(df, 'page_visits'), 3)
-    df = df.sort_values('weight', ascending=False)
+    org_names = (dict(id=id, label=name) for id, name in find_orgs_q)
+    return compressor.json_list(org_names, streamed=limit >= compressor.stream_min_items)
+
 
-    org_names = df[['id', 'label']].to_dict('records')
-    return gzippify(org_names)
+@orgs.route('/typeahead', methods=['GET'])
+def typeahead_orgs():
+    """Most popular orgs with a name word starting with q, from the in-memory
+    index."""
+    limit = request.args.get('limit', type=int, default=10)
+    prefix = request.args.get('q', type=str, default='')
+    return jsonify([dict(id=id, label=name) for id, name in typeahead.orgs(prefix, limit)])
+
+
+@orgs.route('/<int:org_id>/positions/typeahead', methods=['GET'])
+def typeahead_positions(org_id):
+    """An org's most posted about positions with a name word starting with
+    q, from the in-memory index."""
+    limit = request.args.get('limit', type=int, default=10)
+    prefix = request.args.get('q', type=str, default='')
+    positions = typeahead.positions(org_id, prefix, limit)
+    return jsonify([dict(id=id, label=name) for id, name in positions])
 
 
 @orgs.route('/search', methods=['GET'])
 def search_orgs():
-    # TODO: setup similarity funcion to find positions like given org name
+    """Search organisations by name, headquarters and industry. Names
+    containing the query come first, then names sharing parts of it (typos),
+    then headquarters and industry matches. Each tier is ranked by relevance
+    then popularity."""
     limit = request.args.get('limit', type=int, default=50)
     offset = request.args.get('offset', type=int, default=0)
-    org_name = request.args.get('org_name', type=str, default='')
+    org_name = request.args.get('org_name', type=str, default='').strip().lower()
     industry = request.args.get('industry', type=str, default='')
-    queries = [Organisation.name.contains(org_name)]
+    queries = []
     if industry and industry != 'ALL':
         queries.append(Organisation.industry == industry)
 
-    find_orgs_q = (g.session
-            .query(Organisation)
-            .filter(*queries)
-            .offset(offset)
-            .limit(limit))
+    def find_orgs(matches=None):
+        # one query loads every position of the page, their post counts are
+        # stored columns so no posts are loaded
+        find_orgs_q = (g.session.query(Organisation)
+                .options(selectinload(Organisation.positions))
+                .filter(*queries))
+        order_by = [Organisation.popularity.desc(), Organisation.id.desc()]
+        if matches is not None:
+            find_orgs_q = find_orgs_q.join(matches, matches.c.rowid == Organisation.id)
+            order_by = [matches.c.tier, matches.c.rank] + order_by
+
+        return find_orgs_q.order_by(*order_by).offset(offset).limit(limit).all()
+
+    def find_matches(tiers):
+        # orgs are filtered after the fts5 candidates are cut, so a filtered
+        # search ranks more candidates until its page fills or none are left
+        candidates = max(offset + limit, search.MIN_CANDIDATES)
+        while True:
+            found = find_orgs(search.match_subquery(org_name, tiers, candidates))
+            if (len(found) >= limit or not queries
+                    or not search.has_more(g.session, org_name, tiers, candidates)):
+                return found
+            candidates *= search.CANDIDATE_GROWTH
+
+    if not org_name:
+        found = find_orgs()
+    elif len(org_name) < search.MIN_MATCH_LENGTH:
+        # too short for the trigram index, fall back to a name_key prefix range
+        key = normalize_name(org_name)
+        queries += [Organisation.name_key >= key, Organisation.name_key < key + '\uffff']
+        found = find_orgs()
+    else:
+        # a tier only matters when the ones before it can't fill the page,
+        # so the typo and headquarters/industry tiers (whose values are
+        # shared by many orgs) are usually never ranked
+        for tiers in range(1, search.TIERS + 1):
+            found = find_matches(tiers)
+            if len(found) >= limit:
+                break
 
-    schema = schemas.OrganisationSchema(exclude=('interviews', 'reviews'), many=True)
-    orgs = schema.dump(find_orgs_q)
-    return jsonify(orgs)
+    schema = schemas.OrganisationSchema(exclude=('interviews', 'reviews'))
+    orgs = (schema.dump(org) for org in found)
+    return compressor.json_list(orgs, streamed=limit >= compressor.stream_min_items)
 
 
 @orgs.route('/<int:org_id>', methods=['GET'])
 def get_org(org_id):
     """Get overview, reviews and interviews for organisation."""
+    org_exists = g.session.query(Organisation.id).filter(Organisation.id == org_id).scalar()
+    if not org_exists:
+        return jsonify(error="Organisation not found")
+
+    # page_visits are buffered and written in batches off the request thread
+    page_visit_buffer.hit(org_id)
+    return get_org_overview(org_id)
+
+
+@response_cache.cached(vary=compact_viewer)
+def get_org_overview(org_id):
     review_limit = request.args.get('review_limit', type=int, default=50)
     interview_limit = request.args.get('interview_limit', type=int, default=50)
+    compact = request.args.get('votes') == COMPACT_VOTES
     org = g.session.query(Organisation).filter(Organisation.id == org_id).scalar()
+    if org is None:
+        # not cached, so probing made up ids can't push real org pages out
+        response = jsonify(error="Organisation not found")
+        response.cache_control.no_store = True
+        return response
 
-    # increment page_visits for org when selected
-    org.page_visits += 1
-    g.db_commit(g.session, [org])
-
-    review_sorted_q = (g.session
-            .query(Review)
+    reviews = (post_list_query(Review, compact)
             .filter(Review.org_id == org_id)
             .order_by(Review.created_at.desc())
-            .limit(review_limit))
-    interview_sorted_q = (g.session
-            .query(Interview)
+            .limit(review_limit)
+            .all())
+    interviews = (post_list_query(Interview, compact)
             .filter(Interview.org_id == org_id)
             .order_by(Interview.created_at.desc())
-            .limit(interview_limit))
+            .limit(interview_limit)
+            .all())
 
     data = dict(
             org = schemas.OrganisationSchema(exclude=('interviews', 'reviews')).dump(org),
-            reviews = schemas.ReviewSchema().dump(review_sorted_q, many=True),
-            interviews = schemas.InterviewSchema().dump(interview_sorted_q, many=True),
+            reviews = post_schema(Review, reviews, compact).dump(reviews, many=True),
+            interviews = post_schema(Interview, interviews, compact).dump(interviews, many=True),
         )
     return jsonify(data)
 
 
 @orgs.route('/<int:org_id>/reviews', methods=['GET'])
+@response_cache.cached(vary=compact_viewer)
 def get_org_reviews(org_id):
     position_id = request.args.get('position_id', type=int, default=None)
     tag = request.args.get('tag', type=str, default=None)
     sort_order = request.args.get('sort_order', type=str, default=None)
     limit = request.args.get('limit', type=int, default=50)
     offset = request.args.get('offset', type=int, default=0)
+    after = request.args.get('after', type=str, default=None)
+    compact = request.args.get('votes') == COMPACT_VOTES
 
-    review = g.session.query(Review)
+    review = post_list_query(Review, compact)
     filter_queries = [(Review.org_id == org_id)]
     if position_id:
         filter_queries.append(Review.position_id == position_id)
     if tag:
         filter_queries.append(Review.tag == tag)
 
-    order_by = Review.created_at.desc()
+    sort_column = Review.created_at
+    descending = True
     if sort_order == 'TENURE':
-        order_by = Review.duration_years.desc()
+        sort_column = Review.duration_years
     if sort_order == 'COMPENSATION':
-        order_by = Review.compensation.desc()
-
-    if sort_order in {'DOWNVOTES', 'UPVOTES'}:
-        # upvotes downvotes is a bit special
-        # we need to find the vote score for each review in an org via (cte)
-        # join this cte vote score table to actual review objects
-        review_vote_score_q = (g.session
-            .query(
-                ReviewVote.review_id.label('review_id'),
-                func.sum(ReviewVote.vote).label('vote_count')
-            )
-            .join( Review, isouter=True)
-            .filter(Review.org_id == org_id)
-            .group_by(ReviewVote.review_id)).cte('review_vote_count')
-        review = (g.session
-            .query(Review)
-            .join(
-                review_vote_score_q,
-                review_vote_score_q.c.review_id == Review.id, isouter=True
-            ))
-        order_by = desc(func.coalesce(review_vote_score_q.c.vote_count, 0))
-        if sort_order == 'DOWNVOTES':
-            order_by = func.coalesce(review_vote_score_q.c.vote_count, 0)
-        else:
-            order_by = desc(func.coalesce(review_vote_score_q.c.vote_count, 0))
-
-
-    # for disabling load more reviews button
-    max_reviews_for_filter = review.filter(*filter_queries).count()
-    review_sorted_q = (review
-            .filter(*filter_queries)
-            .order_by(order_by)
-            .offset(offset)
-            .limit(limit))
+        sort_column = Review.compensation
+    if sort_order in {'UPVOTES', 'DOWNVOTES'}:
+        sort_column = Review.score
+        descending = sort_order == 'UPVOTES'
+
+    # cursor mode when `after` is given, offset mode for older clients
+    try:
+        reviews, max_reached, next_cursor = paginate(
+                review.filter(*filter_queries), sort_column, Review.id, limit,
+                descending=descending, after=after, offset=offset,
+                tag=sort_order)
+    except InvalidCursor:
+        return jsonify(error="Invalid cursor")
 
     data = dict(
-            posts = schemas.ReviewSchema().dump(review_sorted_q, many=True),
-            max_reached = max_reviews_for_filter <= offset + limit,
+            posts = post_schema(Review, reviews, compact).dump(reviews, many=True),
+            max_reached = max_reached,
+            next_cursor = next_cursor,
         )
     return jsonify(data)
 
 
 @orgs.route('/<int:org_id>/interviews', methods=['GET'])
+@response_cache.cached(vary=compact_viewer)
 def get_org_interviews(org_id):
     position_id = request.args.get('position_id', type=int, default=None)
     tag = request.args.get('tag', type=str, default=None)
     sort_order = request.args.get('sort_order', type=str, default=None)
     limit = request.args.get('limit', type=int, default=50)
     offset = request.args.get('offset', type=int, default=0)
+    after = request.args.get('after', type=str, default=None)
+    compact = request.args.get('votes') == COMPACT_VOTES
 
-    interview = g.session.query(Interview)
+    interview = post_list_query(Interview, compact)
 
     filter_queries = [(Interview.org_id == org_id)]
     if position_id:
@@ -180,52 +293,140 @@ def get_org_interviews(org_id):
     if tag:
         filter_queries.append(Interview.tag == tag)
 
-    order_by = Interview.created_at.desc()
+    sort_column = Interview.created_at
+    descending = True
     if sort_order == 'STAGES':
-        order_by = Interview.stages.desc()
+        sort_column = Interview.stages
     if sort_order == 'COMPENSATION':
-        order_by = Interview.compensation.desc()
-
-    if sort_order in {'DOWNVOTES', 'UPVOTES'}:
-        # upvotes downvotes is a bit special
-        # we need to find the vote score for each review in an org via (cte)
-        # join this cte vote score table to actual review objects
-        inter_vote_score_q = (g.session
-            .query(
-                InterviewVote.interview_id.label('interview_id'),
-                func.sum(InterviewVote.vote).label('vote_count')
-            )
-            .join( Interview, isouter=True)
-            .filter(Interview.org_id == org_id)
-            .group_by(InterviewVote.interview_id)).cte('interview_vote_count')
-        interview = g.session.query(Interview).join(inter_vote_score_q, inter_vote_score_q.c.interview_id == Interview.id, isouter=True)
-
-        if sort_order == 'DOWNVOTES':
-            order_by = func.coalesce(inter_vote_score_q.c.vote_count, 0)
-        else:
-            order_by = desc(func.coalesce(inter_vote_score_q.c.vote_count, 0))
-
-    # for disabling load more reviews button
-    max_interviews_for_filter = interview.filter(*filter_queries).count()
-    interview_sorted_q = (interview
-            .filter(*filter_queries)
-            .order_by(order_by)
-            .offset(offset)
-            .limit(limit))
+        sort_column = Interview.compensation
+    if sort_order in {'UPVOTES', 'DOWNVOTES'}:
+        sort_column = Interview.score
+        descending = sort_order == 'UPVOTES'
+
+    # cursor mode when `after` is given, offset mode for older clients
+    try:
+        interviews, max_reached, next_cursor = paginate(
+                interview.filter(*filter_queries), sort_column, Interview.id, limit,
+                descending=descending, after=after, offset=offset,
+                tag=sort_order)
+    except InvalidCursor:
+        return jsonify(error="Invalid cursor")
 
     data = dict(
-            posts = schemas.InterviewSchema().dump(interview_sorted_q, many=True),
-            max_reached = max_interviews_for_filter <= offset + limit
+            posts = post_schema(Interview, interviews, compact).dump(interviews, many=True),
+            max_reached = max_reached,
+            next_cursor = next_cursor,
         )
     return jsonify(data)
 
 
 @orgs.route('/<int:org_id>/compensation_summary', methods=['GET'])
+@response_cache.cached
 def get_org_comp_info(org_id):
-    # TODO: build a nice query that aggregates comp info for us for a given
-    # company and position
-    org = g.session.query(Organisation).filter(Organisation.id == org_id).all()
-    return str(org.interviews)
+    """Compensation count, mean, percentiles and histogram for an org's
+    reviews and interviews, overall and per position, split by currency.
+    Served from the stored compensation buckets rather than the posts."""
+    position_id = request.args.get('position_id', type=int, default=None)
+    summary = compensation.org_summary(g.session, org_id, position_id)
+
+    position_ids = {pos_id for s in summary.values() for pos_id in s['positions']}
+    position_names = dict(g.session
+            .query(Position.id, Position.name)
+            .filter(Position.id.in_(position_ids)))
+
+    data = dict(org_id=org_id)
+    for post_type, s in summary.items():
+        data[f'{post_type.value}s'] = dict(
+                currencies=s['currencies'],
+                positions=[dict(id=pos_id, name=position_names.get(pos_id),
+                                currencies=currencies)
+                           for pos_id, currencies in sorted(s['positions'].items())])
+    return jsonify(data)
+
+
+@orgs.route('/compensation/analytics', methods=['GET'])
+def get_compensation_analytics():
+    """Compensation count, mean and percentiles of reviews or interviews
+    (`kind`) grouped by one or more `by` keys (industry, currency, tag,
+    position, org, tenure), from the columnar snapshot. Optionally filtered
+    by industry, currency, tag, org_id and position."""
+    kind = request.args.get('kind', type=str, default='reviews')
+    by = request.args.getlist('by') or ['industry', 'currency']
+    min_count = request.args.get('min_count', type=int, default=1)
+    filters = dict(
+            industry=request.args.get('industry', type=str, default=None),
+            currency=request.args.get('currency', type=str, default=None),
+            tag=request.args.get('tag', type=str, default=None),
+            org_id=request.args.get('org_id', type=int, default=None),
+            position=request.args.get('position', type=str, default=None))
+
+    current = compensation_snapshot.get()
+    if current is None:
+        return jsonify(error="Snapshot not built")
+    if kind not in snapshot.POST_MODELS:
+        return jsonify(error="Unknown kind")
+    try:
+        groups = current.group_by(kind, by, min_count=min_count, **filters)
+    except ValueError as e:
+        return jsonify(error=str(e))
+
+    return jsonify(snapshot=compensation_snapshot.info(current), groups=groups)
+
+
+@orgs.route('/industry/<industry>/compensation', methods=['GET'])
+def get_industry_compensation(industry):
+    """Compensation count, mean, percentiles and histogram of reviews and
+    interviews across every org of an industry, per currency, overall and
+    per tenure band. Served from the precomputed industry aggregates, with
+    when they were refreshed and how stale they are."""
+    if industry not in Industry.__members__:
+        return jsonify(error="Unknown industry")
+    refresh = industry_compensation.refresh_info(
+            g.session, current_app.config['INDUSTRY_COMPENSATION_MAX_AGE'])
+    if refresh is None:
+        return jsonify(error="Industry compensation not refreshed")
+
+    summary = industry_compensation.industry_summary(g.session, industry)
+    data = dict(industry=industry, refresh=refresh)
+    for post_type, currencies in summary.items():
+        data[f'{post_type.value}s'] = dict(currencies=currencies)
+    return jsonify(data)
+
+
+@orgs.route('/industry/<industry>/positions/compensation', methods=['GET'])
+def get_industry_position_compensation(industry):
+    """A position (`position`, matched on its normalized name) compared
+    across the orgs of an industry: the industry wide summary per tenure
+    band and the `limit` orgs with the highest tenure adjusted pay, each
+    with at least min_count posts. Served from the precomputed aggregates
+    with their refresh time and staleness."""
+    position = request.args.get('position', type=str, default='').strip()
+    min_count = request.args.get('min_count', type=int, default=1)
+    limit = request.args.get('limit', type=int, default=50)
+    if industry not in Industry.__members__:
+        return jsonify(error="Unknown industry")
+    if not position:
+        return jsonify(error="Missing position")
+    refresh = industry_compensation.refresh_info(
+            g.session, current_app.config['INDUSTRY_COMPENSATION_MAX_AGE'])
+    if refresh is None:
+        return jsonify(error="Industry compensation not refreshed")
+
+    comparison = industry_compensation.position_comparison(
+            g.session, industry, position, min_count, limit)
+    org_ids = {org['org_id'] for currencies in comparison.values()
+               for scope in currencies.values() for org in scope['orgs']}
+    org_names = dict(g.session
+            .query(Organisation.id, Organisation.name)
+            .filter(Organisation.id.in_(org_ids)))
+
+    data = dict(industry=industry, position=position, refresh=refresh)
+    for post_type, currencies in comparison.items():
+        for scope in currencies.values():
+            for org in scope['orgs']:
+                org['name'] = org_names.get(org['org_id'])
+        data[f'{post_type.value}s'] = dict(currencies=currencies)
+    return jsonify(data)
 
 
 @orgs.route('/create-company', methods=['POST'])
@@ -244,24 +445,114 @@ def create_company():
         return jsonify(error="Missing required values")
 
     existing_company = (g.session
-                .query(Organisation)
-                .filter(func.lower(Organisation.name) == func.lower(name))
-                .scalar())
+                .query(Organisation.id)
+                .filter(Organisation.name_key == normalize_name(name))
+                .first())
     if existing_company:
         return jsonify(error="Company name exists")
 
     schema = schemas.OrganisationSchema()
     org_obj = schema.load(r)
     org = Organisation(**org_obj)
-    org_created = g.db_commit(g.session, [org])
+
+    def create_org(session):
+        session.add(org)
+        session.flush()
+
+        # place the new org in the popularity ranking without a full refresh
+        popularity.update_popularity(session, [org.id])
+        # the bulk update expired org.popularity, load it while org is still
+        # in the session (a queued write detaches org once committed)
+        session.refresh(org)
+
+    org_created = writer.write(create_org)
+    if org_created:
+        typeahead.add_org(org.id, org.name, org.popularity)
 
     return jsonify(org_created=org_created, error=error_message)
 
 
+@orgs.route('/import', methods=['POST'])
+def import_data():
+    """Bulk import orgs, reviews or interviews (`kind`) from a CSV or NDJSON
+    (`format`) request body, streamed in chunks. Admin accounts only; posts
+    are posted by the importing account. Returns the import report and the
+    first IMPORT_MAX_REJECTS rejected records."""
+    kind = request.args.get('kind', type=str, default='')
+    fmt = request.args.get('format', type=str, default='ndjson')
+    account_id = session.get('account_id')
+    if not account_id:
+        return jsonify(error="Not logged in")
+    account_type = g.session.query(Account.type).filter(Account.id == account_id).scalar()
+    if account_type != AccountType.ADMIN:
+        return jsonify(error="Not allowed")
+    if kind not in bulk_import.KINDS or fmt not in bulk_import.FORMATS:
+        return jsonify(error="Unknown kind or format")
+
+    max_rejects = current_app.config['IMPORT_MAX_REJECTS']
+    rejects = []
+    def reject(number, record, errors):
+        if len(rejects) < max_rejects:
+            rejects.append(dict(record=number, data=record, errors=errors))
+
+    importer = bulk_import.BulkImport(
+            kind, account_id=account_id,
+            chunk_size=current_app.config['IMPORT_CHUNK_SIZE'], reject=reject)
+    stream = io.TextIOWrapper(request.stream, encoding='utf8', newline='')
+    report = importer.run(bulk_import.read_records(stream, fmt))
+
+    for org_id in importer.org_ids:
+        response_cache.invalidate(org_id)
+    typeahead.refresh()
+    return jsonify(report=report, rejects=rejects)
+
+
+EXPORT_MIMETYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+@orgs.route('/export', methods=['GET'])
+def export_posts():
+    """Stream every review or interview (`kind`) with its org and position
+    as NDJSON or CSV (`format`), compressed per Accept-Encoding. Optionally
+    only an org's (org_id), an industry's, or those created in [since,
+    until). Admin accounts only."""
+    kind = request.args.get('kind', type=str, default='')
+    fmt = request.args.get('format', type=str, default='ndjson')
+    industry = request.args.get('industry', type=str, default=None)
+    filters = dict(
+            org_id=request.args.get('org_id', type=int, default=None),
+            since=request.args.get('since', type=int, default=None),
+            until=request.args.get('until', type=int, default=None))
+    account_id = session.get('account_id')
+    if not account_id:
+        return jsonify(error="Not logged in")
+    account_type = g.session.query(Account.type).filter(Account.id == account_id).scalar()
+    if account_type != AccountType.ADMIN:
+        return jsonify(error="Not allowed")
+    if kind not in export.POST_MODELS or fmt not in export.FORMATS:
+        return jsonify(error="Unknown kind or format")
+    if industry and industry not in Industry.__members__:
+        return jsonify(error="Unknown industry")
+
+    chunks = export.export_chunks(kind, fmt, industry=industry, **filters)
+    response = compressor.stream(chunks, mimetype=EXPORT_MIMETYPES[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename={kind}.{fmt}'
+    return response
+
+
 auth = Blueprint('auth', __name__, url_prefix='/auth')
 
+def hashing_busy(**data):
+    """503 asking the client to retry once the password hashing queue has
+    room again."""
+    response = jsonify(error="Too many requests, try again shortly", **data)
+    response.status_code = 503
+    response.headers['Retry-After'] = str(password_hasher.retry_after)
+    return response
+
+
 @auth.route('/login', methods=['POST'])
 def login():
+    start = time.perf_counter()
     r = request.get_json()
     username = r.get('username', '').lower()
     password = r.get('password', '')
@@ -274,10 +565,30 @@ def login():
             .query(Account)
             .filter(Account.username == username)
             .scalar())
-    if not account or not account.check_password(password):
-        return jsonify(authenticated=False, error="Incorrect log in details")
+    try:
+        if not account or not password_hasher.check(account.password, password):
+            return jsonify(authenticated=False, error="Incorrect log in details")
+    except HashingBusy:
+        return hashing_busy(authenticated=False)
+
+    # upgrade hashes made with an older method now that we have the password
+    rehashed = False
+    if password_hasher.needs_rehash(account.password):
+        try:
+            new_hash = password_hasher.hash(password)
+        except HashingBusy:
+            new_hash = None
+        if new_hash:
+            account_id = account.id
+            def rehash(session):
+                (session
+                    .query(Account)
+                    .filter(Account.id == account_id)
+                    .update({Account.password: new_hash}, synchronize_session=False))
+            rehashed = writer.write(rehash)
 
     session['account_id'] = account.id
+    password_hasher.record_login(time.perf_counter() - start, rehashed)
 
     schema = schemas.AccountSchema(only=(['id', 'username', 'anonymous', 'dark_mode']))
     return jsonify(authenticated=True, account=schema.dump(account))
@@ -295,8 +606,6 @@ def check_session():
                 .filter(Account.id == account_id)
                 .scalar())
         data = schema.dump(account)
-        session.clear()
-        session['account_id'] = account_id
 
     return jsonify(authenticated=bool(account_id), account=data)
 
@@ -328,9 +637,12 @@ def signup():
 
     # create user and attempt to commit user
     new_account = Account(username=username)
-    new_account.add_password(password)
+    try:
+        new_account.password = password_hasher.hash(password)
+    except HashingBusy:
+        return hashing_busy()
 
-    account_created = g.db_commit(g.session, [new_account])
+    account_created = writer.write(lambda session: session.add(new_account))
     if not account_created:
         return jsonify(error="Failed to create account")
 
@@ -354,13 +666,17 @@ def account_update():
     if not account_id:
         return jsonify(error="Not logged in")
 
-    account = g.session.query(Account).filter(Account.id == account_id).scalar()
-    if anonymous is not None:
-        account.anonymous = anonymous
-    if dark_mode is not None:
-        account.dark_mode = dark_mode
+    def update_account(session):
+        account = session.query(Account).filter(Account.id == account_id).scalar()
+        if anonymous is not None:
+            account.anonymous = anonymous
+        if dark_mode is not None:
+            account.dark_mode = dark_mode
 
-    g.db_commit(g.session, [account])
+    writer.write(update_account)
+    if anonymous is not None:
+        # the account is shown (or hidden) on posts across every org
+        response_cache.clear()
 
     return jsonify(error=error_message)
 
@@ -369,14 +685,19 @@ def get_account_reviews():
     r = request.get_json()
     limit = r.get('limit', 10)
     account_id = r.get('account_id')
-    review_sorted_q = (g.session
-            .query(Review)
-            .filter(Review.account_id == account_id)
-            .order_by(Review.created_at.desc())
-            .limit(limit))
-
-    schema = schemas.ReviewSchema()
-    data = dict(reviews = schema.dump(review_sorted_q, many=True))
+    after = r.get('after')
+    compact = r.get('votes') == COMPACT_VOTES
+    try:
+        reviews, max_reached, next_cursor = paginate(
+                post_list_query(Review, compact).filter(Review.account_id == account_id),
+                Review.created_at, Review.id, limit, after=after, tag='account')
+    except InvalidCursor:
+        return jsonify(error="Invalid cursor")
+
+    schema = post_schema(Review, reviews, compact)
+    data = dict(reviews = schema.dump(reviews, many=True),
+                max_reached = max_reached,
+                next_cursor = next_cursor)
     return jsonify(data=data)
 
 
@@ -385,17 +706,66 @@ def get_account_interviews():
     r = request.get_json()
     limit = r.get('limit', 10)
     account_id = r.get('account_id')
-    interview_sorted_q = (g.session
-            .query(Interview)
-            .filter(Interview.account_id == account_id)
-            .order_by(Interview.created_at.desc())
-            .limit(limit))
-
-    schema = schemas.InterviewSchema()
-    data = dict(interviews = schema.dump(interview_sorted_q, many=True))
+    after = r.get('after')
+    compact = r.get('votes') == COMPACT_VOTES
+    try:
+        interviews, max_reached, next_cursor = paginate(
+                post_list_query(Interview, compact).filter(Interview.account_id == account_id),
+                Interview.created_at, Interview.id, limit, after=after, tag='account')
+    except InvalidCursor:
+        return jsonify(error="Invalid cursor")
+
+    schema = post_schema(Interview, interviews, compact)
+    data = dict(interviews = schema.dump(interviews, many=True),
+                max_reached = max_reached,
+                next_cursor = next_cursor)
     return jsonify(data=data)
 
 
+@account.route('/activity', methods=['GET'])
+def get_account_activity():
+    """Summary counts and the newest first history of an account's reviews
+    and interviews, a page at a time. Defaults to the logged in account."""
+    account_id = request.args.get('account_id', type=int, default=session.get('account_id'))
+    limit = max(1, min(request.args.get('limit', type=int, default=20), 100))
+    after = request.args.get('after', type=str, default=None)
+    compact = request.args.get('votes') == COMPACT_VOTES
+    if not account_id:
+        return jsonify(error="Account not given")
+
+    account = g.session.query(Account).filter(Account.id == account_id).scalar()
+    if not account:
+        return jsonify(error="Account not found")
+
+    try:
+        page, max_reached, next_cursor = activity.history_page(
+                g.session, account_id, limit, after=after)
+    except InvalidCursor:
+        return jsonify(error="Invalid cursor")
+
+    # load and dump each post type's part of the page in one go, then put
+    # the posts back in history order
+    dumped = {}
+    for post_type, (_, PostModel) in activity.POST_KINDS.items():
+        post_ids = [post_id for t, post_id in page if t is post_type]
+        if not post_ids:
+            continue
+        posts = post_list_query(PostModel, compact).filter(PostModel.id.in_(post_ids)).all()
+        for post, data in zip(posts, post_schema(PostModel, posts, compact).dump(posts, many=True)):
+            dumped[(post_type, post.id)] = data
+
+    schema = schemas.AccountSchema(only=('id', 'username', 'anonymous', 'created_at'))
+    data = dict(
+            account = schema.dump(account),
+            summary = activity.summary(g.session, account_id),
+            history = [dict(type=post_type.value, post=dumped[(post_type, post_id)])
+                       for post_type, post_id in page],
+            max_reached = max_reached,
+            next_cursor = next_cursor,
+        )
+    return jsonify(data)
+
+
 @account.route('/post-review', methods=['POST'])
 def post_review():
     r = request.get_json()
@@ -414,22 +784,36 @@ def post_review():
     if not post:
         return jsonify(post_created=False, error="Post not given")
 
-    objs = []
     schema = schemas.ReviewSchema()
-    if not position_id:
-        new_position = Position(name=position, org_id=org_id)
-        g.session.add(new_position)
-        g.session.flush()
-
-        r['position_id'] = new_position.id
 
     # we've used position by this point, remove so schema can load successfully
     r.pop('position', None)
-    review = schema.load(r)
-    objs.append(Review(**review))
-    review_created = g.db_commit(g.session, objs)
+    review = Review(**schema.load(r))
+
+    new_position = Position(name=position, org_id=org_id)
+    def create_review(session):
+        if not position_id:
+            review.position_id = reuse_position(session, org_id, position)
+        if not review.position_id:
+            session.add(new_position)
+            session.flush()
+
+            review.position_id = new_position.id
+
+        session.add(review)
+        session.flush()
+
+        # keep the org's post counts and compensation histogram in the same
+        # transaction
+        post_counts.record(session, review)
+        compensation.record(session, PostTypeModel.REVIEW, review)
+
+    review_created = writer.write(create_review)
     if not review_created:
         return jsonify(post_created=False, error="Failed to create post")
+    response_cache.invalidate(review.org_id)
+    if new_position.id is not None:
+        typeahead.add_position(org_id, new_position.id, position)
 
     return jsonify(post_created=review_created, error=error_message)
 
@@ -452,22 +836,36 @@ def post_interview():
     if not post:
         return jsonify(post_created=False, error="Post not given")
 
-    objs = []
     schema = schemas.InterviewSchema()
-    if not position_id:
-        new_position = Position(name=position, org_id=org_id)
-        g.session.add(new_position)
-        g.session.flush()
-
-        r['position_id'] = new_position.id
 
     # we've used position by this point, remove so schema can load successfully
     r.pop('position', None)
-    interview = schema.load(r)
-    objs.append(Interview(**interview))
-    interview_created = g.db_commit(g.session, objs)
+    interview = Interview(**schema.load(r))
+
+    new_position = Position(name=position, org_id=org_id)
+    def create_interview(session):
+        if not position_id:
+            interview.position_id = reuse_position(session, org_id, position)
+        if not interview.position_id:
+            session.add(new_position)
+            session.flush()
+
+            interview.position_id = new_position.id
+
+        session.add(interview)
+        session.flush()
+
+        # keep the org's post counts and compensation histogram in the same
+        # transaction
+        post_counts.record(session, interview)
+        compensation.record(session, PostTypeModel.INTERVIEW, interview)
+
+    interview_created = writer.write(create_interview)
     if not interview_created:
         return jsonify(post_created=False, error="Failed to create post")
+    response_cache.invalidate(interview.org_id)
+    if new_position.id is not None:
+        typeahead.add_position(org_id, new_position.id, position)
 
     return jsonify(post_created=interview_created, error=error_message)
 
@@ -491,9 +889,21 @@ def delete_post():
         PModel = Interview
 
     filters =[PModel.id == post_id, PModel.account_id == account_id]
-    post = g.session.query(PModel).filter(*filters).scalar()
-    g.session.delete(post)
-    g.session.commit()
+    org_id = g.session.query(PModel.org_id).filter(*filters).scalar()
+    if not org_id:
+        return jsonify(post_deleted=False, error="Post not found")
+
+    post_type = PostTypeModel.INTERVIEW if PModel is Interview else PostTypeModel.REVIEW
+    def delete(session):
+        post = session.query(PModel).filter(*filters).scalar()
+        post_counts.record(session, post, delta=-1)
+        compensation.record(session, post_type, post, delta=-1)
+        session.delete(post)
+
+    post_deleted = writer.write(delete)
+    if not post_deleted:
+        return jsonify(post_deleted=False, error="Failed to delete post")
+    response_cache.invalidate(org_id)
 
     return jsonify(post_deleted=True, error=error_message)
 
@@ -518,26 +928,44 @@ def report_post():
 
     filters =[PModel.id == post_id]
     post = g.session.query(PModel).filter(*filters).scalar()
-    if post and post.reported:
+    if not post:
+        return jsonify(post_reported=False, error="Post not found")
+    if post.reported:
         return jsonify(post_reported=True, error=error_message)
 
-    post.reported = True
-    post_reported = g.db_commit(g.session, [post])
+    def report(session):
+        (session
+            .query(PModel)
+            .filter(*filters)
+            .update({PModel.reported: True}, synchronize_session=False))
+
+    post_reported = writer.write(report)
+    if post_reported:
+        response_cache.invalidate(post.org_id)
 
     return jsonify(post_reported=post_reported, error=error_message)
 
 
+MAX_BATCH_VOTES = 100
+
+
+def vote_post_model(vote_model_type):
+    if vote_model_type.lower() == PostTypeModel.INTERVIEW.value:
+        return Interview
+    return Review
+
+
 @account.route('/vote', methods=['PUT'])
 def post_vote():
     """Handles creating new upvotes and downvotes for ReviewVote and
     InterviewVote objects. Existing votes are updated if a user changes it from
-    a positive to a negative vote."""
+    a positive to a negative vote. A vote is a single upsert on the unique
+    (account, post) index, so the already_upvoted/already_downvoted flags
+    older clients send are ignored."""
     r = request.get_json()
     post_id = r.get('post_id', None)
     raw_vote = r.get('vote', None)
-    already_upvoted = r.get('already_upvoted', False)
-    already_downvoted = r.get('already_downvoted', False)
-    vote_model_type = r.get('vote_model_type', PostTypeModel.REVIEW)
+    vote_model_type = r.get('vote_model_type', PostTypeModel.REVIEW.value)
 
     account_id = session.get('account_id')
 
@@ -548,31 +976,79 @@ def post_vote():
         error_message = "Invalid vote"
         return jsonify(vote_created=False, error="Invalid vote")
 
-    # figure out which model we are dealing with and update filters from there
-    VoteModel = ReviewVote
-    filters = [(VoteModel.review_id == post_id)]
-    id_key = 'review_id'
+    PostModel = vote_post_model(vote_model_type)
     vote = Vote.DOWNVOTE.value if raw_vote < 0 else Vote.UPVOTE.value
-    if vote_model_type.lower() == PostTypeModel.INTERVIEW.value:
-        VoteModel = InterviewVote
-        filters = [(VoteModel.interview_id == post_id)]
-        id_key = 'interview_id'
-
-    vote_created = False
-    filters.append(VoteModel.account_id == account_id)
-    if already_upvoted or already_downvoted:
-        # find existing vote and update it
-        vote_obj = g.session.query(VoteModel).filter(*filters).scalar()
-        vote_obj.vote = vote
-        vote_created = g.db_commit(g.session, [vote_obj])
-    else:
-        # no previous votes for this review, create a new vote object
-        params = {'account_id': account_id, 'vote': vote}
-        params[id_key] = post_id
-        vote_obj = VoteModel(**params)
-        vote_created = g.db_commit(g.session, [vote_obj])
+
+    # the post's stored vote counts are recounted in the same transaction
+    def cast(session):
+        votes.cast_votes(session, PostModel, account_id, {post_id: vote})
+
+    vote_created = writer.write(cast)
 
     if not vote_created:
         error_message = "Failed to create vote"
+    else:
+        org_id = g.session.query(PostModel.org_id).filter(PostModel.id == post_id).scalar()
+        response_cache.invalidate(org_id)
 
     return jsonify(vote_created=vote_created, error=error_message)
+
+
+@account.route('/votes', methods=['PUT'])
+def post_votes():
+    """Cast up to MAX_BATCH_VOTES votes, each shaped like a /vote request, in
+    one transaction. Either every vote is recorded or none are."""
+    r = request.get_json()
+    batch = r.get('votes', None)
+
+    account_id = session.get('account_id')
+    if not account_id:
+        return jsonify(votes_created=False, error="Not authenticated")
+    if not batch or not isinstance(batch, list):
+        return jsonify(votes_created=False, error="No votes given")
+    if len(batch) > MAX_BATCH_VOTES:
+        return jsonify(votes_created=False, error=f"At most {MAX_BATCH_VOTES} votes per request")
+
+    # the last vote on a post wins, as if they had been sent one by one
+    batches = {Review: {}, Interview: {}}
+    for v in batch:
+        post_id = v.get('post_id', None)
+        raw_vote = v.get('vote', None)
+        if not post_id or not raw_vote:
+            return jsonify(votes_created=False, error="Invalid vote")
+
+        PostModel = vote_post_model(v.get('vote_model_type', PostTypeModel.REVIEW.value))
+        batches[PostModel][post_id] = Vote.DOWNVOTE.value if raw_vote < 0 else Vote.UPVOTE.value
+
+    def cast(session):
+        for PostModel, batch_votes in batches.items():
+            votes.cast_votes(session, PostModel, account_id, batch_votes)
+
+    votes_created = writer.write(cast)
+    if not votes_created:
+        return jsonify(votes_created=False, error="Failed to create votes")
+
+    for PostModel, batch_votes in batches.items():
+        if batch_votes:
+            org_ids = (g.session
+                    .query(PostModel.org_id)
+                    .filter(PostModel.id.in_(list(batch_votes)))
+                    .distinct())
+            for org_id, in org_ids:
+                response_cache.invalidate(org_id)
+
+    return jsonify(votes_created=True, error=None)
+
+
+metrics = Blueprint('metrics', __name__, url_prefix='/metrics')
+
+@metrics.route('', methods=['GET'])
+def get_metrics():
+    """Internal counters and pool stats. Admin accounts only."""
+    account_id = session.get('account_id')
+    if not account_id:
+        return jsonify(error="Not logged in")
+    account_type = g.session.query(Account.type).filter(Account.id == account_id).scalar()
+    if account_type != AccountType.ADMIN:
+        return jsonify(error="Not allowed")
+    return jsonify(app_metrics.snapshot())
@@ -0,0 +1,132 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import request, Response
+
+import metrics
+
+
+class ResponseCache:
+    """
+    Bounded in-process LRU cache of serialized responses. Org page entries are
+    keyed by endpoint, org and the normalized query args, expire after `ttl`
+    seconds and are dropped for an org as soon as one of the account write
+    endpoints changes it. Each worker process has its own cache, so other
+    workers only see a write once their entry expires.
+    """
+    def __init__(self, app=None, name='response_cache', config_prefix='RESPONSE_CACHE'):
+        self.name = name
+        self.config_prefix = config_prefix
+        self.enabled = True
+        self.max_entries = 1024
+        self.ttl = 60
+        self._entries = OrderedDict()
+        self._org_keys = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        prefix = self.config_prefix
+        self.enabled = app.config.get(f'{prefix}_ENABLED', self.enabled)
+        self.max_entries = app.config.get(f'{prefix}_MAX_ENTRIES', self.max_entries)
+        self.ttl = app.config.get(f'{prefix}_TTL', self.ttl)
+        metrics.register(self.name, self.stats)
+
+    def cached(self, view=None, vary=None):
+        """Cache a view taking an org_id url argument. `vary` is an optional
+        callable whose result is added to the key, for responses that depend
+        on more than the url (e.g. the logged in account)."""
+        if view is None:
+            return lambda view: self.cached(view, vary=vary)
+
+        @wraps(view)
+        def wrapper(org_id, **kwargs):
+            if not self.enabled:
+                return view(org_id, **kwargs)
+
+            args = tuple(sorted(request.args.items(multi=True)))
+            key = (request.endpoint, org_id, args, vary() if vary else None)
+            entry = self.get(key)
+            if entry is not None:
+                body, status, mimetype = entry
+                return Response(body, status=status, mimetype=mimetype)
+
+            response = view(org_id, **kwargs)
+            # views mark responses that mustn't be kept, e.g. for missing orgs
+            if (response.status_code == 200 and not response.is_streamed
+                    and not response.cache_control.no_store):
+                self.set(key, org_id, (response.get_data(), response.status_code,
+                                       response.mimetype))
+            return response
+        return wrapper
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, org_id, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            self._org_keys.setdefault(org_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, org_id):
+        """Drop every cached response for an org."""
+        with self._lock:
+            for key in self._org_keys.pop(org_id, ()):
+                self._entries.pop(key, None)
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._org_keys.clear()
+
+    def stats(self):
+        with self._lock:
+            entries = len(self._entries)
+        return dict(
+                enabled=self.enabled,
+                entries=entries,
+                max_entries=self.max_entries,
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                invalidations=self.invalidations)
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        org_id = key[1]
+        keys = self._org_keys.get(org_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._org_keys[org_id]
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,168 @@
+import gzip
+import json
+import sys
+import time
+
+import click
+from flask.cli import with_appcontext
+
+from db import (
+        migrations, search, popularity, compensation, bulk_import, export,
+        industry_compensation)
+from db.models import Industry
+from analytics import compensation_snapshot
+
+
+@click.command('upgrade-db')
+@with_appcontext
+def upgrade_db_command():
+    """Create missing tables, columns and indexes."""
+    migrations.upgrade_db()
+    click.echo('database upgraded')
+
+
+@click.command('backfill-vote-counts')
+@with_appcontext
+def backfill_vote_counts_command():
+    """Recompute stored review/interview vote counts from the vote tables."""
+    migrations.upgrade_db()
+    migrations.backfill_vote_counts()
+    click.echo('vote counts backfilled')
+
+
+@click.command('backfill-post-counts')
+@with_appcontext
+def backfill_post_counts_command():
+    """Recompute stored organisation/position post counts from the posts."""
+    migrations.upgrade_db()
+    migrations.backfill_post_counts()
+    click.echo('post counts backfilled')
+
+
+@click.command('rebuild-search-index')
+@with_appcontext
+def rebuild_search_index_command():
+    """Refill the organisation search index from the organisation table."""
+    migrations.upgrade_db()
+    search.rebuild_search()
+    click.echo('search index rebuilt')
+
+
+@click.command('refresh-popularity')
+@with_appcontext
+def refresh_popularity_command():
+    """Recompute organisation popularity over the whole table. Meant to be
+    run on a schedule (e.g. cron) as page visits accumulate."""
+    migrations.upgrade_db()
+    popularity.refresh_popularity()
+    click.echo('popularity refreshed')
+
+
+@click.command('rebuild-compensation-summary')
+@with_appcontext
+def rebuild_compensation_summary_command():
+    """Recompute the compensation histograms from the posts."""
+    migrations.upgrade_db()
+    compensation.rebuild()
+    click.echo('compensation summary rebuilt')
+
+
+@click.command('build-compensation-snapshot')
+@click.option('--full', is_flag=True, help='rebuild every column instead of appending new posts')
+@with_appcontext
+def build_compensation_snapshot_command(full):
+    """Write the posts added since the last build to the columnar
+    compensation snapshot. Meant to be run on a schedule (e.g. cron)."""
+    migrations.upgrade_db()
+    manifest = compensation_snapshot.build(full=full)
+    rows = ', '.join(f"{posts['rows']} {kind}" for kind, posts in manifest['posts'].items())
+    click.echo(f"compensation snapshot built: {rows} in {manifest['build_seconds']}s")
+
+
+@click.command('refresh-industry-compensation')
+@with_appcontext
+def refresh_industry_compensation_command():
+    """Recompute the industry and position compensation aggregates from the
+    posts. Meant to be run on a schedule (e.g. cron)."""
+    migrations.upgrade_db()
+    refreshed = industry_compensation.refresh()
+    click.echo(f"industry compensation refreshed: {refreshed['industry_rows']} industry and "
+               f"{refreshed['position_rows']} position buckets in {refreshed['seconds']}s")
+
+
+@click.command('import-data')
+@click.argument('kind', type=click.Choice(bulk_import.KINDS))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(bulk_import.FORMATS), default=None,
+              help='csv or ndjson, by default from the file extension')
+@click.option('--account-id', type=int, default=None,
+              help='account imported reviews and interviews are posted by')
+@click.option('--chunk-size', type=int, default=1000, help='records per transaction')
+@click.option('--rejects', 'rejects_path', type=click.Path(dir_okay=False), default=None,
+              help='ndjson file of rejected records, by default PATH.rejects.ndjson')
+@with_appcontext
+def import_data_command(kind, path, fmt, account_id, chunk_size, rejects_path):
+    """Import organisations, reviews or interviews from a CSV or NDJSON
+    file, streamed in chunks."""
+    if kind in bulk_import.POST_KINDS and not account_id:
+        raise click.UsageError('--account-id is required to import posts')
+    migrations.upgrade_db()
+
+    fmt = fmt or bulk_import.format_of(path)
+    rejects_path = rejects_path or f'{path}.rejects.ndjson'
+    with open(path, newline='', encoding='utf8') as stream, \
+            open(rejects_path, 'w', encoding='utf8') as rejects:
+        def reject(number, record, errors):
+            rejects.write(json.dumps(dict(record=number, data=record, errors=errors)) + '\n')
+
+        def progress(report):
+            click.echo(f"{report['read']} read, {report['inserted']} inserted, "
+                       f"{report['rejected']} rejected, {report['rows_per_second']:,} rows/s")
+
+        importer = bulk_import.BulkImport(
+                kind, account_id=account_id, chunk_size=chunk_size, reject=reject)
+        report = importer.run(bulk_import.read_records(stream, fmt), progress=progress)
+
+    click.echo(json.dumps(report, indent=2))
+    if report['rejected']:
+        click.echo(f'rejected records written to {rejects_path}')
+
+
+@click.command('export-data')
+@click.argument('kind', type=click.Choice(list(export.POST_MODELS)))
+@click.option('--format', 'fmt', type=click.Choice(export.FORMATS), default='ndjson')
+@click.option('--output', default='-',
+              help='file to write, gzip compressed if it ends in .gz (default stdout)')
+@click.option('--org-id', type=int, default=None)
+@click.option('--industry', type=click.Choice(list(Industry.__members__)), default=None)
+@click.option('--since', type=int, default=None, help='created at or after (unix time)')
+@click.option('--until', type=int, default=None, help='created before (unix time)')
+@with_appcontext
+def export_data_command(kind, fmt, output, org_id, industry, since, until):
+    """Stream reviews or interviews with their org and position to NDJSON
+    or CSV."""
+    start = time.perf_counter()
+    written = 0
+    chunks = export.export_chunks(
+            kind, fmt, org_id=org_id, industry=industry, since=since, until=until)
+    opener = gzip.open if output.endswith('.gz') else click.open_file
+    with opener(output, 'wb') as out:
+        for chunk in chunks:
+            out.write(chunk)
+            written += len(chunk)
+
+    elapsed = time.perf_counter() - start
+    click.echo(f'{written:,} bytes in {elapsed:.1f}s', file=sys.stderr)
+
+
+def init_app(app):
+    app.cli.add_command(upgrade_db_command)
+    app.cli.add_command(backfill_vote_counts_command)
+    app.cli.add_command(backfill_post_counts_command)
+    app.cli.add_command(rebuild_search_index_command)
+    app.cli.add_command(refresh_popularity_command)
+    app.cli.add_command(rebuild_compensation_summary_command)
+    app.cli.add_command(import_data_command)
+    app.cli.add_command(export_data_command)
+    app.cli.add_command(build_compensation_snapshot_command)
+    app.cli.add_command(refresh_industry_compensation_command)
@@ -0,0 +1,172 @@
+import zlib
+from functools import wraps
+
+from flask import Response, current_app, jsonify, request, stream_with_context
+
+from cache import ResponseCache
+
+
+# zlib window bits for each supported content encoding
+ENCODINGS = {'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}
+COMPRESSIBLE_TYPES = {'application/json', 'text/html', 'text/plain'}
+STREAM_CHUNK_SIZE = 16 * 1024
+
+
+def negotiate(accept_encoding):
+    """Pick the client's preferred supported encoding from an Accept-Encoding
+    header, or None for identity."""
+    qualities = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        qualities[coding] = q
+
+    best, best_q = None, 0.0
+    for encoding in ENCODINGS:
+        q = qualities.get(encoding, qualities.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(data, encoding, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, ENCODINGS[encoding])
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_chunks(chunks, encoding, level):
+    """Incrementally compress an iterable of byte chunks."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, ENCODINGS[encoding])
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def json_list_chunks(items, chunk_size=STREAM_CHUNK_SIZE):
+    """Serialize an iterable of json serializable items as a json list, in
+    chunks of roughly chunk_size bytes."""
+    buffer = [b'[']
+    size = 1
+    for i, item in enumerate(items):
+        encoded = ((',' if i else '')
+                   + current_app.json.dumps(item, separators=(',', ':'))).encode('utf8')
+        buffer.append(encoded)
+        size += len(encoded)
+        if size >= chunk_size:
+            yield b''.join(buffer)
+            buffer, size = [], 0
+    buffer.append(b']')
+    yield b''.join(buffer)
+
+
+class Compressor:
+    """
+    Response encoding for every blueprint. Encoding is negotiated from
+    Accept-Encoding; bodies under `min_size` bytes are sent as they are.
+    Large lists can be streamed through an incremental compressor and views
+    marked `cacheable` keep their encoded bytes for COMPRESS_CACHE_TTL seconds.
+    """
+    def __init__(self, app=None):
+        self.level = 6
+        self.min_size = 500
+        self.stream_min_items = 200
+        self.cache = ResponseCache(name='compressed_cache', config_prefix='COMPRESS_CACHE')
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.level = app.config.get('COMPRESS_LEVEL', self.level)
+        self.min_size = app.config.get('COMPRESS_MIN_SIZE', self.min_size)
+        self.stream_min_items = app.config.get('COMPRESS_STREAM_MIN_ITEMS', self.stream_min_items)
+        self.cache.init_app(app)
+        app.after_request(self.after_request)
+
+    def json_list(self, items, streamed=False):
+        """json list response. When streamed, items are serialized and
+        compressed chunk by chunk as they are iterated."""
+        if not streamed:
+            return jsonify(list(items))
+
+        return self.stream(json_list_chunks(items), mimetype='application/json')
+
+    def stream(self, chunks, mimetype):
+        """Streamed response of an iterable of byte chunks, compressed chunk
+        by chunk in the negotiated encoding."""
+        encoding = negotiate(request.headers.get('Accept-Encoding', ''))
+        if encoding:
+            chunks = compress_chunks(chunks, encoding, self.level)
+
+        response = Response(stream_with_context(chunks), mimetype=mimetype)
+        response.vary.add('Accept-Encoding')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        return response
+
+    def cacheable(self, view):
+        """Keep the encoded body of a view's responses, per query args and
+        negotiated encoding, so repeat requests skip the view and compressor."""
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            encoding = negotiate(request.headers.get('Accept-Encoding', ''))
+            query = tuple(sorted(request.args.items(multi=True)))
+            key = (request.endpoint, None, (query, tuple(sorted(kwargs.items())), encoding))
+
+            entry = self.cache.get(key) if self.cache.enabled else None
+            if entry is None:
+                response = view(*args, **kwargs)
+                if response.status_code != 200:
+                    return response
+
+                body = b''.join(response.response) if response.is_streamed \
+                        else response.get_data()
+                content_encoding = response.headers.get('Content-Encoding')
+                if encoding and not content_encoding and len(body) >= self.min_size:
+                    body = compress(body, encoding, self.level)
+                    content_encoding = encoding
+                entry = (body, response.mimetype, content_encoding)
+                if self.cache.enabled:
+                    self.cache.set(key, None, entry)
+
+            body, mimetype, content_encoding = entry
+            response = Response(body, mimetype=mimetype)
+            response.vary.add('Accept-Encoding')
+            if content_encoding:
+                response.headers['Content-Encoding'] = content_encoding
+            return response
+        return wrapper
+
+    def after_request(self, response):
+        if (response.status_code != 200
+                or response.direct_passthrough
+                or response.is_streamed
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_TYPES):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        if response.content_length is not None and response.content_length < self.min_size:
+            return response
+
+        encoding = negotiate(request.headers.get('Accept-Encoding', ''))
+        if not encoding:
+            return response
+
+        response.set_data(compress(response.get_data(), encoding, self.level))
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+
+compressor = Compressor()
@@ -4,6 +4,13 @@ import secrets
 one_day = (60 * 60) * 24
 class Config(object):
     DATABASE='./db/flaskr.sqlite'
+    # sqlite: server side sessions in SESSION_SQLITE_PATH (default
+    # instance/sessions.sqlite) behind an in-process cache, cookie: signed
+    # stateless cookie, filesystem: flask_session with SESSION_TYPE
+    SESSION_BACKEND = 'sqlite'
+    SESSION_SQLITE_PATH = None
+    SESSION_CACHE_SIZE = 10000
+    SESSION_CACHE_TTL = 30
     SESSION_TYPE = 'filesystem'
     SESSION_COOKIE_SECURE = True
     SESSION_USE_SIGNER = True
@@ -12,6 +19,71 @@ class Config(object):
     APPLICATION_ROOT = '/'
     SESSION_PERMANENT = True
     CORS_SUPPORTS_CREDENTIALS = True
+    # sqlite file of the app, default RATRACE_DATABASE or db/ratrace.db
+    SQLITE_DATABASE = None
+    # applied to every sqlite connection; journal_mode only by the writer
+    SQLITE_PRAGMAS = dict(
+        journal_mode='WAL',
+        synchronous='NORMAL',
+        cache_size=-64000,
+        mmap_size=268435456,
+        busy_timeout=5000,
+        temp_store='MEMORY',
+    )
+    # one write connection queues writers instead of failing on the lock
+    SQLITE_WRITE_POOL_SIZE = 1
+    SQLITE_READ_POOL_SIZE = 8
+    # page visits are written in batches every N seconds or M visits
+    PAGE_VISIT_FLUSH_INTERVAL = 5
+    PAGE_VISIT_FLUSH_THRESHOLD = 500
+    # in-process cache of org page responses, dropped per org on writes
+    RESPONSE_CACHE_ENABLED = True
+    RESPONSE_CACHE_MAX_ENTRIES = 1024
+    RESPONSE_CACHE_TTL = 60
+    # responses are compressed per Accept-Encoding, lists of at least
+    # COMPRESS_STREAM_MIN_ITEMS are streamed through the compressor
+    COMPRESS_LEVEL = 6
+    COMPRESS_MIN_SIZE = 500
+    COMPRESS_STREAM_MIN_ITEMS = 200
+    # encoded bodies of cacheable responses such as /orgs/get-names
+    COMPRESS_CACHE_ENABLED = True
+    COMPRESS_CACHE_MAX_ENTRIES = 256
+    COMPRESS_CACHE_TTL = 60
+    # per-request statement counts and timings (Server-Timing header), the
+    # slow query log and N+1 warnings for shapes repeated more than N times
+    SQL_INSTRUMENTATION_ENABLED = True
+    SQL_SLOW_QUERY_MS = 100
+    SQL_SLOW_QUERY_LOG = None
+    SQL_REPEAT_THRESHOLD = 10
+    # commit writes from a single thread in groups of up to N writes, each
+    # group waiting at most MAX_DELAY_MS for more writes after the first
+    WRITER_ENABLED = False
+    WRITER_MAX_BATCH = 64
+    WRITER_MAX_DELAY_MS = 5
+    WRITER_TIMEOUT = 10
+    # werkzeug hash method for new passwords; other hashes are upgraded on
+    # login. Hashing runs on N threads with at most MAX_PENDING waiting,
+    # beyond that login/signup answer 503 with Retry-After
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256'
+    PASSWORD_HASH_WORKERS = 2
+    PASSWORD_HASH_MAX_PENDING = 16
+    PASSWORD_HASH_RETRY_AFTER = 1
+    # in-memory org/position name index for typeahead, built at startup and
+    # rebuilt every REFRESH_INTERVAL seconds
+    TYPEAHEAD_ENABLED = True
+    TYPEAHEAD_REFRESH_INTERVAL = 300
+    TYPEAHEAD_MAX_LIMIT = 50
+    # /orgs/import writes records in transactions of N records and returns
+    # at most MAX_REJECTS of the rejected records
+    IMPORT_CHUNK_SIZE = 1000
+    IMPORT_MAX_REJECTS = 100
+    # columnar compensation snapshot for /orgs/compensation/analytics,
+    # default instance/compensation_snapshot
+    COMPENSATION_SNAPSHOT_PATH = None
+    # /orgs/industry/... are served from aggregates recomputed by
+    # `flask refresh-industry-compensation` (e.g. cron), responses report
+    # them stale once older than MAX_AGE seconds
+    INDUSTRY_COMPENSATION_MAX_AGE = one_day
 
 class DevConfig(Config):
     DEBUG = True
@@ -0,0 +1,87 @@
+from sqlalchemy import func, literal, select, tuple_, union_all
+
+from pagination import encode_cursor, decode_cursor, InvalidCursor
+from .models import Review, Interview, PostTypeModel, Vote
+from .votes import POST_VOTES
+
+
+# history is ordered by (created_at, kind, id) descending, kind breaks ties
+# between a review and an interview posted in the same second
+POST_KINDS = {PostTypeModel.REVIEW: (0, Review), PostTypeModel.INTERVIEW: (1, Interview)}
+CURSOR_TAG = 'activity'
+
+
+def summary(session, account_id):
+    """Counts of an account's posts, the votes they received and the votes
+    it cast, from one aggregate query per table."""
+    result = {}
+    for post_type, (_, PostModel) in POST_KINDS.items():
+        posts, upvotes, downvotes = session.execute(
+                select(func.count(PostModel.id),
+                       func.coalesce(func.sum(PostModel.upvote_count), 0),
+                       func.coalesce(func.sum(PostModel.downvote_count), 0))
+                .where(PostModel.account_id == account_id)).one()
+
+        VoteModel, _ = POST_VOTES[PostModel]
+        cast = dict(session.execute(
+                select(VoteModel.vote, func.count(VoteModel.id))
+                .where(VoteModel.account_id == account_id)
+                .group_by(VoteModel.vote)).all())
+
+        result[post_type.value] = dict(
+                posts=posts,
+                upvotes_received=upvotes,
+                downvotes_received=downvotes,
+                upvotes_cast=cast.get(Vote.UPVOTE.value, 0),
+                downvotes_cast=cast.get(Vote.DOWNVOTE.value, 0))
+    return result
+
+
+def _branch(kind, PostModel, account_id, after, limit):
+    """One post type's side of the history UNION ALL: its first `limit` rows
+    after the cursor, so each side walks its (account_id, created_at) index
+    and stops instead of handing the account's whole history to the sort."""
+    query = (select(literal(kind).label('kind'),
+                    PostModel.id.label('id'),
+                    PostModel.created_at.label('created_at'))
+             .where(PostModel.account_id == account_id))
+    if after is not None:
+        created_at, after_kind, post_id = after
+        if kind < after_kind:
+            query = query.where(PostModel.created_at <= created_at)
+        elif kind == after_kind:
+            query = query.where(tuple_(PostModel.created_at, PostModel.id) < (created_at, post_id))
+        else:
+            query = query.where(PostModel.created_at < created_at)
+    query = query.order_by(PostModel.created_at.desc(), PostModel.id.desc()).limit(limit)
+    return select(query.subquery())
+
+
+def history_page(session, account_id, limit, after=None):
+    """
+    A page of an account's reviews and interviews merged newest first.
+    Returns ([(post_type, post_id)], max_reached, next_cursor); raises
+    InvalidCursor for a cursor not made by this function.
+    """
+    if after:
+        values = decode_cursor(after)
+        if len(values) != 4 or values[0] != CURSOR_TAG:
+            raise InvalidCursor(after)
+        after = values[1:]
+
+    merged = union_all(*[_branch(kind, PostModel, account_id, after, limit + 1)
+                         for kind, PostModel in POST_KINDS.values()]).subquery()
+    rows = session.execute(
+            select(merged.c.kind, merged.c.id, merged.c.created_at)
+            .order_by(merged.c.created_at.desc(), merged.c.kind.desc(), merged.c.id.desc())
+            .limit(limit + 1)).all()
+
+    max_reached = len(rows) <= limit
+    rows = rows[:limit]
+    next_cursor = None
+    if rows and not max_reached:
+        kind, post_id, created_at = rows[-1]
+        next_cursor = encode_cursor([CURSOR_TAG, created_at, kind, post_id])
+
+    post_types = {kind: post_type for post_type, (kind, _) in POST_KINDS.items()}
+    return [(post_types[kind], post_id) for kind, post_id, _ in rows], max_reached, next_cursor
@@ -0,0 +1,327 @@
+"""
+Bulk import of organisations, reviews and interviews from CSV or NDJSON.
+
+Records are streamed in chunks of `chunk_size`. Each record is validated
+with the model's marshmallow schema, then each chunk is resolved and written
+in its own transaction with batched Core statements:
+
+  orgs        deduplicated on the indexed Organisation.name_key, against the
+              database and earlier records of the same import
+  reviews,    `org_id` or `org_name` (matched on name_key) and `position_id`
+  interviews  or `position`, a position name matched on the org's indexed
+              Position.name_key. Missing positions are created for the whole
+              chunk in one statement.
+
+Stored post counts, compensation buckets and popularity are updated in the
+same transaction. A chunk that fails to write is retried a record at a time
+so one bad record can't reject its neighbours. Rejected records are passed
+to `reject(number, record, errors)`, e.g. to write a rejects file.
+"""
+import csv
+import json
+import time
+
+from marshmallow import ValidationError
+from sqlalchemy import insert, select
+
+from . import database as db
+from . import compensation, popularity, post_counts
+from . import schemas
+from .models import (
+        Organisation, Position, Review, Interview, PostTypeModel, normalize_name)
+
+
+FORMATS = ('csv', 'ndjson')
+POST_KINDS = {'reviews': (Review, schemas.ReviewSchema, PostTypeModel.REVIEW),
+              'interviews': (Interview, schemas.InterviewSchema, PostTypeModel.INTERVIEW)}
+KINDS = ('orgs',) + tuple(POST_KINDS)
+# columns filled in by the import rather than read from the records
+RESOLVED = {'id', 'name_key', 'account_id', 'org_id', 'position_id'}
+MISSING = 'Missing data for required field.'
+# names post records may give instead of org_id and position_id
+REFERENCES = ('org_name', 'position')
+NOT_A_NAME = 'Not a valid name.'
+
+
+def format_of(path):
+    return 'csv' if str(path).lower().endswith('.csv') else 'ndjson'
+
+
+def read_records(stream, fmt):
+    """(record number, record) for each record of a text stream. A line that
+    isn't a json object is yielded as (number, None, error)."""
+    if fmt == 'csv':
+        for number, row in enumerate(csv.DictReader(stream), 1):
+            # empty cells are missing values, cells past the header are dropped
+            yield number, {k: v for k, v in row.items() if k is not None and v != ''}, None
+        return
+
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield number, None, str(e)
+            continue
+        if not isinstance(record, dict):
+            yield number, None, 'Not an object'
+            continue
+        yield number, record, None
+
+
+def _required(Model):
+    return {column.name for column in Model.__table__.columns
+            if not column.nullable and column.default is None
+            and column.server_default is None and column.name not in RESOLVED}
+
+
+def _defaults(Model):
+    return {column.name: column.default.arg for column in Model.__table__.columns
+            if column.default is not None and column.default.is_scalar}
+
+
+def _insert(conn, Model, rows, returning=()):
+    """Batched INSERTs of rows, one executemany per distinct set of keys."""
+    by_keys = {}
+    for row in rows:
+        by_keys.setdefault(tuple(sorted(row)), []).append(row)
+
+    returned = []
+    for batch in by_keys.values():
+        statement = insert(Model)
+        if returning:
+            returned += conn.execute(statement.returning(*returning), batch).all()
+        else:
+            conn.execute(statement, batch)
+    return returned
+
+
+class BulkImport:
+    def __init__(self, kind, account_id=None, chunk_size=1000, reject=None, engine=None):
+        if kind not in KINDS:
+            raise ValueError(f'Unknown import kind {kind}')
+        if kind in POST_KINDS and not account_id:
+            raise ValueError('Posts need the account_id they are posted by')
+
+        self.kind = kind
+        self.account_id = account_id
+        self.chunk_size = chunk_size
+        self.reject_callback = reject
+        self.engine = engine or db.engine
+        if kind == 'orgs':
+            self.Model, self.schema = Organisation, schemas.OrganisationSchema()
+        else:
+            self.Model, Schema, self.post_type = POST_KINDS[kind]
+            self.schema = Schema()
+        self.required = _required(self.Model)
+        self.defaults = _defaults(self.Model)
+        # name keys of the orgs this import has written
+        self.seen = set()
+        self.org_ids = set()
+        self.read = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.positions_created = 0
+        self.chunks = 0
+        self.seconds = 0.0
+
+    def run(self, records, progress=None):
+        """Import (number, record, error) tuples from read_records. Calls
+        progress(report) after each chunk. Returns the report."""
+        start = time.perf_counter()
+        chunk = []
+        for number, record, error in records:
+            self.read += 1
+            if error:
+                self.reject(number, record, dict(_schema=[error]))
+                continue
+            try:
+                chunk.append((number, record, self.load(record)))
+            except ValidationError as e:
+                self.reject(number, record, e.messages)
+                continue
+
+            if len(chunk) >= self.chunk_size:
+                self.write_chunk(chunk)
+                chunk = []
+                self.seconds = time.perf_counter() - start
+                if progress:
+                    progress(self.report())
+
+        if chunk:
+            self.write_chunk(chunk)
+        self.seconds = time.perf_counter() - start
+        return self.report()
+
+    def report(self):
+        return dict(
+                kind=self.kind,
+                read=self.read,
+                inserted=self.inserted,
+                duplicates=self.duplicates,
+                rejected=self.rejected,
+                positions_created=self.positions_created,
+                chunks=self.chunks,
+                seconds=round(self.seconds, 3),
+                rows_per_second=round(self.read / self.seconds) if self.seconds else 0)
+
+    def reject(self, number, record, errors):
+        self.rejected += 1
+        if self.reject_callback:
+            self.reject_callback(number, record, errors)
+
+    def load(self, record):
+        """Validated row for a record; post rows keep their org_name and
+        position for write_chunk to resolve."""
+        record = dict(record)
+        refs = {}
+        errors = {}
+        if self.kind != 'orgs':
+            refs = {key: record.pop(key) for key in REFERENCES if key in record}
+            errors = {key: [NOT_A_NAME] for key, value in refs.items()
+                      if not isinstance(value, str) or not value.strip()}
+
+        try:
+            loaded = self.schema.load(record)
+        except ValidationError as e:
+            raise ValidationError(dict(e.messages, **errors))
+        row = dict(self.defaults, **loaded, **refs)
+        # ids are the database's own
+        row.pop('id', None)
+        errors.update({name: [MISSING] for name in self.required if row.get(name) is None})
+        if self.kind != 'orgs':
+            if not row.get('org_id') and not row.get('org_name'):
+                errors['org_id'] = [MISSING]
+            if not row.get('position_id') and not row.get('position'):
+                errors['position_id'] = [MISSING]
+        if errors:
+            raise ValidationError(errors)
+        return row
+
+    def write_chunk(self, chunk):
+        self.chunks += 1
+        written = dict(inserted=0, duplicates=0, positions_created=0,
+                       keys=set(), org_ids=set(), rejects=[])
+        try:
+            with self.engine.begin() as conn:
+                write = self._write_orgs if self.kind == 'orgs' else self._write_posts
+                write(conn, chunk, written)
+        except Exception as e:
+            # any failure, not only the database's, rejects records rather
+            # than ending the import with earlier chunks committed
+            if len(chunk) == 1:
+                number, record, _ = chunk[0]
+                self.reject(number, record, dict(_schema=[str(getattr(e, 'orig', None) or e)]))
+                return
+            # find the bad records by writing the chunk a record at a time
+            for item in chunk:
+                self.write_chunk([item])
+            return
+
+        self.commit(written)
+
+    def commit(self, written):
+        """Counters and rejects of a committed chunk."""
+        self.inserted += written['inserted']
+        self.duplicates += written['duplicates']
+        self.positions_created += written['positions_created']
+        self.seen |= written['keys']
+        self.org_ids |= written['org_ids']
+        for number, record, errors in written['rejects']:
+            self.reject(number, record, errors)
+
+    def _write_orgs(self, conn, chunk, written):
+        keys = {normalize_name(row['name']) for _, _, row in chunk}
+        existing = set(conn.execute(
+                select(Organisation.name_key).where(Organisation.name_key.in_(keys))).scalars())
+        existing |= self.seen
+
+        rows = []
+        for number, record, row in chunk:
+            key = normalize_name(row['name'])
+            if key in existing:
+                written['duplicates'] += 1
+                written['rejects'].append((number, record, dict(name=['Company name exists'])))
+                continue
+            existing.add(key)
+            rows.append(row)
+
+        created = _insert(conn, Organisation, rows, returning=(Organisation.id, Organisation.name_key))
+        org_ids = [id for id, _ in created]
+        popularity.update_popularity(conn, org_ids)
+        written['inserted'] = len(rows)
+        written['keys'] = {key for _, key in created}
+        written['org_ids'] = set(org_ids)
+
+    def _write_posts(self, conn, chunk, written):
+        names = {normalize_name(row['org_name']) for _, _, row in chunk if row.get('org_name')}
+        org_ids = {row['org_id'] for _, _, row in chunk if row.get('org_id')}
+        org_by_name = dict(conn.execute(
+                select(Organisation.name_key, Organisation.id)
+                .where(Organisation.name_key.in_(names))).all())
+        known_orgs = set(conn.execute(
+                select(Organisation.id).where(Organisation.id.in_(org_ids))).scalars())
+        known_orgs |= set(org_by_name.values())
+
+        resolved = []
+        for number, record, row in chunk:
+            org_id = row.get('org_id') or org_by_name.get(normalize_name(row.get('org_name', '')))
+            if org_id not in known_orgs:
+                written['rejects'].append((number, record, dict(org_id=['Organisation not found'])))
+                continue
+            row = dict(row, org_id=org_id, account_id=self.account_id)
+            row.pop('org_name', None)
+            resolved.append((number, record, row))
+
+        written['positions_created'] = self._resolve_positions(conn, resolved)
+        rows = []
+        for number, record, row in resolved:
+            if row.get('position_id') is None:
+                written['rejects'].append((number, record, dict(position_id=['Position not found'])))
+                continue
+            rows.append(row)
+
+        _insert(conn, self.Model, rows)
+        written['inserted'] = len(rows)
+        written['org_ids'] = {row['org_id'] for row in rows}
+        post_counts.recount(conn, Organisation, written['org_ids'])
+        post_counts.recount(conn, Position, {row['position_id'] for row in rows})
+        compensation.record_many(conn, self.post_type, rows)
+
+    def _resolve_positions(self, conn, resolved):
+        """Set position_id on the rows from their position names, creating
+        the missing positions in one statement, and clear position ids that
+        don't belong to the row's org. Returns the number created."""
+        given_ids = {row['position_id'] for _, _, row in resolved if row.get('position_id')}
+        position_orgs = dict(conn.execute(
+                select(Position.id, Position.org_id).where(Position.id.in_(given_ids))).all())
+
+        by_name = {}
+        named = [row for _, _, row in resolved if not row.get('position_id')]
+        if named:
+            for id, org_id, name_key in conn.execute(
+                    select(Position.id, Position.org_id, Position.name_key)
+                    .where(Position.org_id.in_({row['org_id'] for row in named}),
+                           Position.name_key.in_({normalize_name(row['position']) for row in named}))
+                    .order_by(Position.id)):
+                by_name.setdefault((org_id, name_key), id)
+
+        missing = {}
+        for row in named:
+            key = (row['org_id'], normalize_name(row['position']))
+            if key not in by_name:
+                missing.setdefault(key, dict(name=row['position'].strip(), org_id=row['org_id']))
+        for id, org_id, name_key in _insert(conn, Position, list(missing.values()),
+                                            returning=(Position.id, Position.org_id, Position.name_key)):
+            by_name[(org_id, name_key)] = id
+
+        for _, _, row in resolved:
+            if row.get('position_id'):
+                if position_orgs.get(row['position_id']) != row['org_id']:
+                    row['position_id'] = None
+            else:
+                row['position_id'] = by_name[(row['org_id'], normalize_name(row.pop('position')))]
+            row.pop('position', None)
+        return len(missing)
@@ -0,0 +1,175 @@
+import math
+from collections import Counter, defaultdict
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from . import database as db
+from .models import CompensationBucket, Review, Interview, PostTypeModel
+
+
+# Compensation is bucketed on a log scale: bucket b holds values in
+# [GROWTH ** (b - 1), GROWTH ** b), so percentiles read from the histogram are
+# within 5% of the real value whatever the currency's magnitude, and an org
+# only ever has a few dozen buckets per position and currency.
+GROWTH = 1.05
+PERCENTILES = (10, 25, 50, 75, 90)
+POST_MODELS = {PostTypeModel.REVIEW: Review, PostTypeModel.INTERVIEW: Interview}
+
+
+def bucket_of(value):
+    return int(math.floor(math.log(value) / math.log(GROWTH))) + 1
+
+
+def bucket_bounds(bucket):
+    return GROWTH ** (bucket - 1), GROWTH ** bucket
+
+
+def record(session, post_type, post, delta=1):
+    """Add (delta=1) or remove (delta=-1) a post's compensation from its
+    bucket, within the caller's transaction. Posts without a positive
+    compensation are not counted."""
+    if not post.compensation or post.compensation <= 0:
+        return
+
+    key = dict(
+            post_type=post_type,
+            org_id=post.org_id,
+            position_id=post.position_id,
+            currency=post.currency,
+            bucket=bucket_of(post.compensation))
+    upsert = sqlite_insert(CompensationBucket).values(
+            count=delta, total=delta * post.compensation, **key)
+    upsert = upsert.on_conflict_do_update(
+            index_elements=list(key),
+            set_=dict(count=CompensationBucket.count + upsert.excluded.count,
+                      total=CompensationBucket.total + upsert.excluded.total))
+    session.execute(upsert)
+
+
+def record_many(conn, post_type, posts):
+    """Add many posts, dicts with org_id, position_id, currency and
+    compensation, to their buckets with one batched upsert, within the
+    caller's transaction."""
+    buckets = Counter()
+    totals = Counter()
+    for post in posts:
+        compensation = post.get('compensation')
+        if not compensation or compensation <= 0:
+            continue
+        key = (post['org_id'], post['position_id'], post['currency'], bucket_of(compensation))
+        buckets[key] += 1
+        totals[key] += compensation
+    if not buckets:
+        return
+
+    upsert = sqlite_insert(CompensationBucket)
+    upsert = upsert.on_conflict_do_update(
+            index_elements=['post_type', 'org_id', 'position_id', 'currency', 'bucket'],
+            set_=dict(count=CompensationBucket.count + upsert.excluded.count,
+                      total=CompensationBucket.total + upsert.excluded.total))
+    rows = []
+    for key, count in buckets.items():
+        org_id, position_id, currency, bucket = key
+        rows.append(dict(post_type=post_type, org_id=org_id, position_id=position_id,
+                         currency=currency, bucket=bucket, count=count, total=totals[key]))
+    conn.execute(upsert, rows)
+
+
+def rebuild(engine=None, batch_size=10000):
+    """Recompute every bucket from the review and interview tables."""
+    engine = engine or db.engine
+    with engine.begin() as conn:
+        conn.execute(delete(CompensationBucket))
+        for post_type, PModel in POST_MODELS.items():
+            buckets = Counter()
+            totals = Counter()
+            posts = conn.execute(
+                    select(PModel.org_id, PModel.position_id,
+                           PModel.currency, PModel.compensation)
+                    .where(PModel.compensation > 0)
+                    .execution_options(yield_per=batch_size))
+            for org_id, position_id, currency, compensation in posts:
+                key = (org_id, position_id, currency, bucket_of(compensation))
+                buckets[key] += 1
+                totals[key] += compensation
+
+            rows = []
+            for key, count in buckets.items():
+                org_id, position_id, currency, bucket = key
+                rows.append(dict(post_type=post_type, org_id=org_id,
+                                 position_id=position_id, currency=currency,
+                                 bucket=bucket, count=count, total=totals[key]))
+            for i in range(0, len(rows), batch_size):
+                conn.execute(insert(CompensationBucket), rows[i:i + batch_size])
+
+
+def _percentile(histogram, count, percentile):
+    """Estimate a percentile by interpolating inside the bucket it lands in."""
+    target = count * percentile / 100
+    seen = 0
+    for bucket, bucket_count in histogram:
+        if seen + bucket_count >= target:
+            low, high = bucket_bounds(bucket)
+            return low + (high - low) * (target - seen) / bucket_count
+        seen += bucket_count
+    return bucket_bounds(histogram[-1][0])[1]
+
+
+def summarise(buckets):
+    """Summary of (bucket, count, total) rows for a single currency."""
+    histogram = sorted((bucket, count) for bucket, count, _ in buckets if count > 0)
+    count = sum(c for _, c in histogram)
+    if not count:
+        return None
+
+    summary = dict(
+            count=count,
+            mean=round(sum(total for _, c, total in buckets if c > 0) / count, 2),
+            histogram=[dict(lower=round(bucket_bounds(b)[0]),
+                            upper=round(bucket_bounds(b)[1]),
+                            count=c) for b, c in histogram])
+    for p in PERCENTILES:
+        summary[f'p{p}'] = round(_percentile(histogram, count, p))
+    return summary
+
+
+def org_summary(session, org_id, position_id=None):
+    """
+    Compensation summaries for an org, per post type, overall and per
+    position, each split by currency. Reads only the org's buckets.
+    """
+    filters = [CompensationBucket.org_id == org_id]
+    if position_id:
+        filters.append(CompensationBucket.position_id == position_id)
+
+    rows = session.execute(
+            select(CompensationBucket.post_type, CompensationBucket.position_id,
+                   CompensationBucket.currency, CompensationBucket.bucket,
+                   CompensationBucket.count, CompensationBucket.total)
+            .where(*filters))
+
+    def histogram():
+        return defaultdict(lambda: [0, 0])
+
+    overall = defaultdict(lambda: defaultdict(histogram))
+    per_position = defaultdict(lambda: defaultdict(lambda: defaultdict(histogram)))
+    for post_type, pos_id, currency, bucket, count, total in rows:
+        for scope in (overall[post_type][currency],
+                      per_position[post_type][pos_id][currency]):
+            scope[bucket][0] += count
+            scope[bucket][1] += total
+
+    def by_currency(scopes):
+        summaries = {}
+        for currency, scope in scopes.items():
+            summary = summarise([(b, c, t) for b, (c, t) in scope.items()])
+            if summary:
+                summaries[currency.name] = summary
+        return summaries
+
+    return {post_type: dict(
+                currencies=by_currency(overall[post_type]),
+                positions={pos_id: by_currency(scopes)
+                           for pos_id, scopes in per_position[post_type].items()})
+            for post_type in POST_MODELS}
@@ -1,82 +1,248 @@
-from db.models import *
-from db.database import *
+"""
+Dummy data generator for development and load testing.
+
+    python -m db.data_create --scale 1 --seed 42 --workers 4
 
-from random import randint, choice
+Scale 1 is 10,000 organisations (and accounts), 200,000 positions, 230,000
+reviews, 230,000 interviews and 1,000,000 votes. Organisations are generated
+in shards by a pool of worker processes; the parent streams each shard into
+SQLite with batched executemany inserts, so memory stays flat whatever the
+scale. The same scale and seed always produce the same data.
+"""
+import argparse
+import multiprocessing
+import os
 import string
+import time
+from random import Random
+
+from sqlalchemy import create_engine, event
+from werkzeug.security import generate_password_hash
+
+from db.models import *
+from db.database import db_path, init_db
+from db.popularity import refresh_popularity
+from db import compensation, industry_compensation
+
 
+ORGS_PER_SCALE = 10000
+POSITIONS_PER_ORG = 20
+POSTS_PER_ORG = 23
+VOTES_PER_ORG = 50
+ORGS_PER_SHARD = 250
+SYNTHETIC_PASSWORD = 'account_i'
+# created_at values are spread over the two years before this (2023-01-01)
+BASE_TIME = 1672531200
+TIME_SPREAD = 2 * 365 * 24 * 60 * 60
 
-def randomword(length):
+TABLES = [Organisation, Account, Position, Review, Interview, ReviewVote, InterviewVote]
+
+
+def randomword(rng, length):
     letters = string.ascii_lowercase
-    return ''.join(choice(letters) for _ in range(length))
-
-def generate_dummy_data():
-    init_db()
-
-    industries = list(Industry)
-    with DBSessionContext(engine) as db:
-        MAX = 10000
-        MAX_REVIEWS = 24
-        objs = []
-        print("creating companies and accounts\n")
-        for i in range(1, MAX):
-            objs.append(Organisation(
-                id=i,
-                name=f'org_{randomword(randint(3, 15))}_{i}',
-                size=randint(1, 5000),
-                headquarters="London, UK",
-                industry=industries[randint(0, 21)],
-                page_visits=randint(0, 5000),
-                url=f'www.org_{i}_website.com',
-                verified=True
-                ))
-
-            account = Account(username=f'account_{i}')
-            account.add_password('account_i')
-            objs.append(account)
-
-            start_range = (i - 1) * 20
-            end_range = ((i - 1) * 20) + 20
-            for j in range(start_range, end_range):
-                objs.append(Position(
-                    name=f'position_{j}',
-                    org_id=i
-                ))
-
-            for z in range(1, MAX_REVIEWS):
-                objs.append(Review(
-                    position_id=randint(start_range, end_range),
-                    compensation=randint(25000, 150000),
-                    currency=Currency.GBP,
-                    duration_years=z / 5,
-                    post=f'This is review number: {z}.',
-                    location='NY, USA',
-                    account_id=randint(1, MAX - 1),
-                    org_id=i,
-                    tag=ReviewTag.GOOD if randint(0, 1) == 1 else ReviewTag.BAD
-                    ))
-
-                objs.append(Interview(
-                    position_id=randint(start_range, end_range),
-                    post=f'This is interview number: {z}.',
-                    location='San Francisco, CA, USA',
-                    compensation=randint(25000, 150000),
-                    currency=Currency.GBP,
-                    account_id=randint(1, MAX - 1),
-                    org_id=i,
-                    tag=ReviewTag.GOOD if randint(0, 1) == 1 else ReviewTag.BAD
-                    ))
-
-        print("creating reviews and interviews votes\n")
-        for i in range(1, 500000):
-            objs.append(ReviewVote(
-                account_id=randint(1, MAX - 1),
-                review_id=randint(1, MAX * MAX_REVIEWS),
-                vote=Vote.DOWNVOTE.value if randint(0, 1) == 1 else Vote.UPVOTE.value))
-            objs.append(InterviewVote(
-                account_id=randint(1, MAX - 1),
-                interview_id=randint(1, MAX * MAX_REVIEWS),
-                vote=Vote.DOWNVOTE.value if randint(0, 1) == 1 else Vote.UPVOTE.value))
-
-        print(f"committing {len(objs)} rows\n")
-        db.session.add_all(objs)
-        db.session.commit()
+    return ''.join(rng.choice(letters) for _ in range(length))
+
+
+def _votes(rng, total_accounts, post_ids, count, post_key):
+    """Up to count votes on post_ids, at most one per account and post."""
+    votes = {}
+    for _ in range(count):
+        key = (rng.randint(1, total_accounts), rng.choice(post_ids))
+        votes[key] = Vote.DOWNVOTE.value if rng.randint(0, 1) == 1 else Vote.UPVOTE.value
+    return [{'account_id': account_id, post_key: post_id, 'vote': vote,
+             'created_at': BASE_TIME - rng.randint(0, TIME_SPREAD)}
+            for (account_id, post_id), vote in votes.items()]
+
+
+def _count_votes(posts, votes, post_key):
+    """Fill in the stored vote counts of posts from their votes."""
+    by_id = {post['id']: post for post in posts}
+    for vote in votes:
+        post = by_id[vote[post_key]]
+        if vote['vote'] == Vote.UPVOTE.value:
+            post['upvote_count'] += 1
+        else:
+            post['downvote_count'] += 1
+        post['score'] += vote['vote']
+
+
+def _count_posts(org, positions, reviews, interviews):
+    """Fill in the stored post counts of an org and its positions."""
+    by_id = {position['id']: position for position in positions}
+    for counter, posts in (('review_count', reviews), ('interview_count', interviews)):
+        org[counter] = len(posts)
+        for position in positions:
+            position[counter] = 0
+        for post in posts:
+            by_id[post['position_id']][counter] += 1
+
+
+def generate_shard(args):
+    """Rows for organisations [first_org, last_org], keyed by table name.
+    Ids are derived from the org id so shards never overlap."""
+    first_org, last_org, total_orgs, seed, password_hash = args
+    rng = Random(f'{seed}:{first_org}')
+    industries = [industry.name for industry in Industry]
+    rows = {Model.__tablename__: [] for Model in TABLES}
+
+    for i in range(first_org, last_org + 1):
+        rows['organisation'].append({
+            'id': i,
+            'name': f'org_{randomword(rng, rng.randint(3, 15))}_{i}',
+            'size': rng.randint(1, 5000),
+            'headquarters': 'London, UK',
+            'industry': rng.choice(industries),
+            'page_visits': rng.randint(0, 5000),
+            'url': f'www.org_{i}_website.com',
+            'verified': True,
+            'created_at': BASE_TIME - rng.randint(0, TIME_SPREAD),
+        })
+        rows['account'].append({
+            'id': i,
+            'username': f'account_{i}',
+            'password': password_hash,
+            'created_at': BASE_TIME - rng.randint(0, TIME_SPREAD),
+        })
+
+        first_position = (i - 1) * POSITIONS_PER_ORG + 1
+        position_ids = list(range(first_position, first_position + POSITIONS_PER_ORG))
+        positions = []
+        for position_id in position_ids:
+            positions.append({
+                'id': position_id,
+                'name': f'position_{position_id}',
+                'org_id': i,
+                'created_at': BASE_TIME - rng.randint(0, TIME_SPREAD),
+            })
+
+        reviews, interviews = [], []
+        for z in range(1, POSTS_PER_ORG + 1):
+            post_id = (i - 1) * POSTS_PER_ORG + z
+            reviews.append({
+                'id': post_id,
+                'position_id': rng.choice(position_ids),
+                'compensation': rng.randint(25000, 150000),
+                'currency': Currency.GBP.name,
+                'duration_years': z / 5,
+                'post': f'This is review number: {z}.',
+                'location': 'NY, USA',
+                'account_id': rng.randint(1, total_orgs),
+                'org_id': i,
+                'tag': (ReviewTag.GOOD if rng.randint(0, 1) == 1 else ReviewTag.BAD).name,
+                'created_at': BASE_TIME - rng.randint(0, TIME_SPREAD),
+                'upvote_count': 0, 'downvote_count': 0, 'score': 0,
+            })
+            interviews.append({
+                'id': post_id,
+                'position_id': rng.choice(position_ids),
+                'post': f'This is interview number: {z}.',
+                'location': 'San Francisco, CA, USA',
+                'compensation': rng.randint(25000, 150000),
+                'currency': Currency.GBP.name,
+                'stages': rng.randint(1, 6),
+                'account_id': rng.randint(1, total_orgs),
+                'org_id': i,
+                'tag': (ReviewTag.GOOD if rng.randint(0, 1) == 1 else ReviewTag.BAD).name,
+                'created_at': BASE_TIME - rng.randint(0, TIME_SPREAD),
+                'upvote_count': 0, 'downvote_count': 0, 'score': 0,
+            })
+
+        review_votes = _votes(rng, total_orgs, [r['id'] for r in reviews],
+                              VOTES_PER_ORG, 'review_id')
+        interview_votes = _votes(rng, total_orgs, [r['id'] for r in interviews],
+                                 VOTES_PER_ORG, 'interview_id')
+        _count_votes(reviews, review_votes, 'review_id')
+        _count_votes(interviews, interview_votes, 'interview_id')
+        _count_posts(rows['organisation'][-1], positions, reviews, interviews)
+
+        rows['position'] += positions
+
+        rows['review'] += reviews
+        rows['interview'] += interviews
+        rows['review_vote'] += review_votes
+        rows['interview_vote'] += interview_votes
+
+    # updated_at would otherwise default to the load time
+    for table_rows in rows.values():
+        for row in table_rows:
+            row['updated_at'] = row['created_at']
+    return rows
+
+
+def _shards(total_orgs, seed, password_hash):
+    for first_org in range(1, total_orgs + 1, ORGS_PER_SHARD):
+        last_org = min(first_org + ORGS_PER_SHARD - 1, total_orgs)
+        yield (first_org, last_org, total_orgs, seed, password_hash)
+
+
+def _bulk_engine(database):
+    engine = create_engine(f'sqlite:///{database}')
+
+    @event.listens_for(engine, 'connect')
+    def bulk_load_pragmas(dbapi_connection, connection_record):
+        # a failed load is simply regenerated, so trade durability for speed
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA synchronous = OFF')
+        cursor.execute('PRAGMA cache_size = -200000')
+        cursor.close()
+
+    return engine
+
+
+def generate_dummy_data(scale=1.0, seed=42, workers=None, database=None, batch_size=5000):
+    database = database or db_path
+    total_orgs = max(1, int(ORGS_PER_SCALE * scale))
+    workers = workers or os.cpu_count() or 1
+
+    engine = _bulk_engine(database)
+    init_db(engine)
+
+    # every synthetic account shares a password, so hash it once
+    password_hash = generate_password_hash(SYNTHETIC_PASSWORD)
+    tables = [Model.__table__ for Model in TABLES]
+
+    print(f"generating {total_orgs} orgs with {workers} workers into {database}\n")
+    start = time.perf_counter()
+    inserted = 0
+    with multiprocessing.Pool(workers) as pool:
+        # imap keeps at most a few shards ahead of the writer
+        shards = pool.imap(generate_shard, _shards(total_orgs, seed, password_hash))
+        for rows in shards:
+            with engine.begin() as conn:
+                for table in tables:
+                    table_rows = rows[table.name]
+                    for i in range(0, len(table_rows), batch_size):
+                        conn.execute(table.insert(), table_rows[i:i + batch_size])
+                    inserted += len(table_rows)
+
+            elapsed = time.perf_counter() - start
+            last_org = rows['organisation'][-1]['id']
+            print(f"{last_org}/{total_orgs} orgs, {inserted} rows, "
+                  f"{inserted / elapsed:,.0f} rows/s")
+
+    print("building compensation histograms\n")
+    compensation.rebuild(engine)
+
+    print("computing industry compensation aggregates\n")
+    industry_compensation.refresh(engine, read_engine=engine)
+
+    print("computing organisation popularity\n")
+    refresh_popularity(engine)
+
+    elapsed = time.perf_counter() - start
+    print(f"done: {inserted} rows in {elapsed:.1f}s ({inserted / elapsed:,.0f} rows/s)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate dummy data.')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help=f'1 = {ORGS_PER_SCALE} organisations')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--database', type=str, default=None,
+                        help=f'sqlite file to fill (default {db_path})')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    generate_dummy_data(scale=args.scale, seed=args.seed, workers=args.workers,
+                        database=args.database, batch_size=args.batch_size)
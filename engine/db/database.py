@@ -1,29 +1,188 @@
 import os
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
 from pathlib import Path
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.engine.base import Engine
 from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
+from config import Config
 
-# initialize db
-db_path: str = os.path.join(Path.cwd(), 'db', r'ratrace.db')
-engine: Engine = create_engine(f'sqlite:///{db_path}', echo=False)
+
+# default database, RATRACE_DATABASE points the app at another sqlite file
+# (e.g. one built by db.data_create for benchmarking), Config.SQLITE_DATABASE
+# overrides both
+db_path: str = os.environ.get('RATRACE_DATABASE',
+                              os.path.join(Path.cwd(), 'db', r'ratrace.db'))
+
+# pragmas that change the database file rather than the connection
+FILE_PRAGMAS = {'journal_mode'}
+
+# writes go through `engine` (Session and WriterSession), reads through the
+# read only `read_engine` (ReadSession), both created by init_app or
+# configure once the config is known. With WAL readers never wait for the
+# writer, and a single write connection queues writers in the pool rather
+# than failing with "database is locked".
+engine: Engine = None
+read_engine: Engine = None
 Session = scoped_session(sessionmaker(
                                     autocommit=False,
-                                    autoflush=False,
-                                    bind=engine))
+                                    autoflush=False))
+ReadSession = scoped_session(sessionmaker(
+                                    autocommit=False,
+                                    autoflush=False))
+# sessions of the group commit writer thread (see writer.py); objects stay
+# loaded after commit so requests can read what their write created
+WriterSession = sessionmaker(
+                            autocommit=False,
+                            autoflush=False,
+                            expire_on_commit=False)
+_pool_checkouts = Counter()
+
+
+def _create_engine(path, pragmas, read_only, pool_size):
+    url = f'sqlite:///file:{path}?mode=ro&uri=true' if read_only else f'sqlite:///{path}'
+    new_engine = create_engine(url, echo=False, pool_size=pool_size, max_overflow=0)
+    name = 'read' if read_only else 'write'
+
+    @event.listens_for(new_engine, 'connect')
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in pragmas.items():
+            if read_only and pragma in FILE_PRAGMAS:
+                continue
+            cursor.execute(f'PRAGMA {pragma} = {value}')
+        cursor.close()
+        if not read_only:
+            # pysqlite only emits BEGIN before DML, so a SAVEPOINT opened
+            # first would be the outermost transaction and RELEASE would
+            # commit it. Turn that off and begin transactions ourselves.
+            dbapi_connection.isolation_level = None
+
+    if not read_only:
+        @event.listens_for(new_engine, 'begin')
+        def begin_immediate(conn):
+            # take the write lock up front rather than on the first write
+            conn.exec_driver_sql('BEGIN IMMEDIATE')
+
+    @event.listens_for(new_engine, 'checkout')
+    def count_checkout(dbapi_connection, connection_record, connection_proxy):
+        _pool_checkouts[name] += 1
+
+    instrument(new_engine)
+    return new_engine
+
+
+def configure(database=None, pragmas=None, write_pool_size=None, read_pool_size=None):
+    """(Re)create the write and read engines on the database file with the
+    given connection pragmas and pool sizes, Config's by default, and bind
+    the sessions to them. Must run before any session is in use; scripts
+    working without an app call it themselves."""
+    global engine, read_engine
+    database = database or db_path
+    pragmas = Config.SQLITE_PRAGMAS if pragmas is None else pragmas
+    for old_engine in (engine, read_engine):
+        if old_engine is not None:
+            old_engine.dispose()
+
+    engine = _create_engine(database, pragmas, read_only=False,
+                            pool_size=write_pool_size or Config.SQLITE_WRITE_POOL_SIZE)
+    read_engine = _create_engine(database, pragmas, read_only=True,
+                                 pool_size=read_pool_size or Config.SQLITE_READ_POOL_SIZE)
+    Session.configure(bind=engine)
+    ReadSession.configure(bind=read_engine)
+    WriterSession.configure(bind=engine)
+
+
+def init_app(app):
+    """Create the engines from the app's loaded config."""
+    configure(
+            database=app.config.get('SQLITE_DATABASE'),
+            pragmas=app.config['SQLITE_PRAGMAS'],
+            write_pool_size=app.config['SQLITE_WRITE_POOL_SIZE'],
+            read_pool_size=app.config['SQLITE_READ_POOL_SIZE'])
+
+
+def pool_stats():
+    stats = {}
+    for name, pool_engine in (('write', engine), ('read', read_engine)):
+        pool = pool_engine.pool
+        stats[name] = dict(
+                size=pool.size(),
+                checked_out=pool.checkedout(),
+                checked_in=pool.checkedin(),
+                overflow=pool.overflow(),
+                checkouts=_pool_checkouts[name])
+    return stats
+
+
+class QueryStats:
+    """Statements executed while collecting, e.g. during one request."""
+    def __init__(self, slow_threshold=None):
+        self.slow_threshold = slow_threshold
+        self.count = 0
+        self.total_time = 0.0
+        self.slowest = (0.0, None)
+        self.slow = []
+        self.shapes = Counter()
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.total_time += duration
+        self.shapes[statement_shape(statement)] += 1
+        if duration > self.slowest[0]:
+            self.slowest = (duration, statement)
+        if self.slow_threshold is not None and duration >= self.slow_threshold:
+            self.slow.append((duration, statement))
+
+    def repeated(self, threshold):
+        """Statement shapes run more than threshold times, most repeated first."""
+        return [(shape, count) for shape, count in self.shapes.most_common()
+                if count > threshold]
+
+
+# the QueryStats statements are recorded into for the current context, if any
+query_stats: ContextVar = ContextVar('query_stats', default=None)
+_IN_LIST = re.compile(r'\(\?(?:, \?)*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def statement_shape(statement):
+    """Statement with whitespace and expanded IN lists collapsed, so the same
+    query issued for different rows has the same shape."""
+    return _IN_LIST.sub('(?)', _WHITESPACE.sub(' ', statement).strip())
+
+
+def instrument(engine):
+    """Time every statement run on engine into the active QueryStats."""
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        if query_stats.get() is not None:
+            conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def record_time(conn, cursor, statement, parameters, context, executemany):
+        stats = query_stats.get()
+        start_times = conn.info.get('query_start_time')
+        if stats is not None and start_times:
+            stats.record(statement, time.perf_counter() - start_times.pop())
+
 
 Base = declarative_base()
 Base.query = Session.query_property()
 
-def init_db():
+def init_db(bind=None):
     # import all modules here that might define models so that
     # they will be registered properly on the metadata.  Otherwise
     # you will have to import them first before calling init_db()
-    from . import models
-    Base.metadata.create_all(bind=engine)
+    from . import models, search
+    bind = bind or engine
+    Base.metadata.create_all(bind=bind)
+    search.init_search(bind)
 
 class DBSessionContext:
     def __init__(self, engine):
@@ -0,0 +1,86 @@
+import csv
+import io
+import json
+
+from sqlalchemy import Enum, String, select, type_coerce
+
+from . import database as db
+from .models import Organisation, Position, Review, Interview
+
+
+# Posts are read through a server side cursor, yield_per rows at a time, and
+# each row is encoded as soon as it is read, so memory use stays flat however
+# large the export. There is no ORDER BY, which would make sqlite sort the
+# whole export first; rows come in the order of the index used (by id, or by
+# org then id when filtering by org or industry). Enums are read as the names they
+# are stored as rather than converted to python enums and back. Account ids
+# are left out.
+FORMATS = ('ndjson', 'csv')
+POST_MODELS = {'reviews': Review, 'interviews': Interview}
+EXTRA_COLUMNS = {Review: ('duration_years',), Interview: ('stages',)}
+CHUNK_SIZE = 64 * 1024
+
+
+def export_query(PostModel, org_id=None, industry=None, since=None, until=None):
+    """Posts joined to their position and organisation, optionally only an
+    org's, an industry's or those created in [since, until)."""
+    columns = [
+        PostModel.id, PostModel.org_id, Organisation.name.label('org_name'),
+        Organisation.industry, PostModel.position_id, Position.name.label('position'),
+        PostModel.post, PostModel.location, PostModel.compensation, PostModel.currency,
+        *[getattr(PostModel, name) for name in EXTRA_COLUMNS[PostModel]],
+        PostModel.tag, PostModel.upvote_count, PostModel.downvote_count, PostModel.score,
+        PostModel.created_at]
+    columns = [type_coerce(column, String).label(column.key)
+               if isinstance(column.type, Enum) else column for column in columns]
+    query = (select(*columns)
+             .join(Organisation, Organisation.id == PostModel.org_id)
+             .join(Position, Position.id == PostModel.position_id))
+
+    if org_id is not None:
+        query = query.where(PostModel.org_id == org_id)
+    if industry:
+        query = query.where(Organisation.industry == industry)
+    if since is not None:
+        query = query.where(PostModel.created_at >= since)
+    if until is not None:
+        query = query.where(PostModel.created_at < until)
+    return query
+
+
+def ndjson_lines(result):
+    keys = list(result.keys())
+    for row in result:
+        yield json.dumps(dict(zip(keys, row))) + '\n'
+
+
+def csv_lines(result):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(result.keys())
+    for row in result:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def export_chunks(kind, fmt='ndjson', engine=None, yield_per=1000, chunk_size=CHUNK_SIZE, **filters):
+    """Encoded export of the reviews or interviews (`kind`) matching filters
+    (see export_query), as utf8 byte chunks of about chunk_size bytes."""
+    engine = engine or db.read_engine
+    query = export_query(POST_MODELS[kind], **filters)
+    lines = ndjson_lines if fmt == 'ndjson' else csv_lines
+
+    with engine.connect() as conn:
+        result = conn.execution_options(yield_per=yield_per).execute(query)
+        buffer, size = [], 0
+        for line in lines(result):
+            encoded = line.encode('utf8')
+            buffer.append(encoded)
+            size += len(encoded)
+            if size >= chunk_size:
+                yield b''.join(buffer)
+                buffer, size = [], 0
+        if buffer:
+            yield b''.join(buffer)
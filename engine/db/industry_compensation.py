@@ -0,0 +1,252 @@
+"""
+Industry wide compensation benchmarks, served from aggregate tables that
+`refresh` recomputes from the posts (on a schedule, with
+`flask refresh-industry-compensation`) so requests never scan the posts:
+
+  industry_compensation_bucket  industry, post type, currency, tenure band
+  position_compensation_bucket  the same per normalized position name and org
+
+Buckets are the log scale buckets of db.compensation. Reviews are split into
+the tenure bands of their duration_years (snapshot.TENURE_BANDS), interviews
+have no tenure and are all in the NO_TENURE band. The aggregate_refresh row
+named NAME records when they were refreshed and the last posts included.
+"""
+import bisect
+import time
+from collections import Counter, defaultdict
+
+from sqlalchemy import delete, func, insert, null, select
+
+from . import database as db
+from .compensation import bucket_of, summarise
+from .models import (
+        Organisation, Position, Review, Interview, PostTypeModel, IndustryCompensationBucket,
+        PositionCompensationBucket, AggregateRefresh, normalize_name)
+from .snapshot import TENURE_BANDS, TENURE_LABELS
+
+
+NAME = 'industry_compensation'
+NO_TENURE = -1
+POST_MODELS = {PostTypeModel.REVIEW: Review, PostTypeModel.INTERVIEW: Interview}
+LAST_IDS = {PostTypeModel.REVIEW: 'last_review_id', PostTypeModel.INTERVIEW: 'last_interview_id'}
+
+
+def tenure_of(years):
+    return bisect.bisect_right(TENURE_BANDS, years or 0)
+
+
+def tenure_label(tenure):
+    return None if tenure == NO_TENURE else TENURE_LABELS[tenure]
+
+
+def _count_posts(conn, post_type, PostModel, last_id, counts, totals, batch_size):
+    """Add the posts with ids up to last_id to the position buckets."""
+    years = PostModel.duration_years if PostModel is Review else null()
+    posts = conn.execute(
+            select(Organisation.industry, PostModel.position_id, Position.name,
+                   PostModel.org_id, PostModel.currency, PostModel.compensation, years)
+            .join(Organisation, Organisation.id == PostModel.org_id)
+            .join(Position, Position.id == PostModel.position_id)
+            .where(PostModel.compensation > 0, PostModel.id <= last_id)
+            .execution_options(yield_per=batch_size))
+
+    position_keys = {}
+    for industry, position_id, name, org_id, currency, compensation, years in posts:
+        position_key = position_keys.get(position_id)
+        if position_key is None:
+            position_key = position_keys[position_id] = normalize_name(name)
+        tenure = NO_TENURE if PostModel is Interview else tenure_of(years)
+        key = (industry, position_key, org_id, post_type, currency, tenure,
+               bucket_of(compensation))
+        counts[key] += 1
+        totals[key] += compensation
+
+
+def refresh(engine=None, read_engine=None, batch_size=10000):
+    """
+    Recompute both aggregate tables from the posts. The posts are read on
+    the read engine up to the newest post ids at the start, so the write
+    lock is only held to swap the new rows and the refresh record in, in one
+    transaction. Returns the refresh record as a dict.
+    """
+    engine = engine or db.engine
+    read_engine = read_engine or db.read_engine
+    start = time.perf_counter()
+
+    counts = Counter()
+    totals = Counter()
+    with read_engine.connect() as conn:
+        last_ids = {post_type: conn.execute(select(func.coalesce(func.max(PostModel.id), 0))).scalar()
+                    for post_type, PostModel in POST_MODELS.items()}
+        for post_type, PostModel in POST_MODELS.items():
+            _count_posts(conn, post_type, PostModel, last_ids[post_type], counts, totals, batch_size)
+
+    position_rows = []
+    industry_counts = Counter()
+    industry_totals = Counter()
+    for key, count in counts.items():
+        industry, position_key, org_id, post_type, currency, tenure, bucket = key
+        position_rows.append(dict(
+                industry=industry, position_key=position_key, org_id=org_id,
+                post_type=post_type, currency=currency, tenure=tenure, bucket=bucket,
+                count=count, total=totals[key]))
+        industry_key = (industry, post_type, currency, tenure, bucket)
+        industry_counts[industry_key] += count
+        industry_totals[industry_key] += totals[key]
+    industry_rows = []
+    for key, count in industry_counts.items():
+        industry, post_type, currency, tenure, bucket = key
+        industry_rows.append(dict(
+                industry=industry, post_type=post_type, currency=currency,
+                tenure=tenure, bucket=bucket, count=count, total=industry_totals[key]))
+
+    record = dict(name=NAME, refreshed_at=int(time.time()),
+                  **{LAST_IDS[post_type]: last_id for post_type, last_id in last_ids.items()})
+    with engine.begin() as conn:
+        for Model, rows in ((IndustryCompensationBucket, industry_rows),
+                            (PositionCompensationBucket, position_rows)):
+            conn.execute(delete(Model))
+            for i in range(0, len(rows), batch_size):
+                conn.execute(insert(Model), rows[i:i + batch_size])
+        record['seconds'] = round(time.perf_counter() - start, 3)
+        conn.execute(delete(AggregateRefresh).where(AggregateRefresh.name == NAME))
+        conn.execute(insert(AggregateRefresh).values(**record))
+    return dict(record, industry_rows=len(industry_rows), position_rows=len(position_rows))
+
+
+def refresh_info(session, max_age=None):
+    """When the aggregates were refreshed and how stale they are: their age,
+    whether it is over max_age seconds and the number of posts made since
+    (counted on the post primary keys). None if they never were."""
+    record = session.get(AggregateRefresh, NAME)
+    if record is None:
+        return None
+
+    age = int(time.time()) - record.refreshed_at
+    new_posts = {f'{post_type.value}s': session.execute(
+                        select(func.count(PostModel.id))
+                        .where(PostModel.id > getattr(record, LAST_IDS[post_type]))).scalar()
+                 for post_type, PostModel in POST_MODELS.items()}
+    return dict(
+            refreshed_at=record.refreshed_at,
+            refresh_seconds=record.seconds,
+            age_seconds=age,
+            stale=max_age is not None and age > max_age,
+            posts_since_refresh=new_posts)
+
+
+def _histogram():
+    return defaultdict(lambda: [0, 0])
+
+
+def _distribution(histogram, with_histogram=True):
+    summary = summarise([(bucket, count, total) for bucket, (count, total) in histogram.items()])
+    if summary and not with_histogram:
+        del summary['histogram']
+    return summary
+
+
+def _by_tenure(bands, with_histogram=True):
+    """Overall summary of a currency's tenure bands plus one per band.
+    Interviews, all in NO_TENURE, only get the overall summary."""
+    overall = _histogram()
+    for histogram in bands.values():
+        for bucket, (count, total) in histogram.items():
+            overall[bucket][0] += count
+            overall[bucket][1] += total
+
+    summary = _distribution(overall, with_histogram)
+    if summary and NO_TENURE not in bands and len(bands) == 1:
+        # a single band is the overall distribution
+        tenure, = bands
+        summary['tenure'] = [dict(summary, tenure=tenure_label(tenure))]
+    elif summary and NO_TENURE not in bands:
+        summary['tenure'] = [dict(tenure=tenure_label(tenure),
+                                  **_distribution(bands[tenure], with_histogram))
+                             for tenure in sorted(bands)]
+    return summary
+
+
+def industry_summary(session, industry):
+    """Compensation summaries of an industry per post type and currency,
+    overall and per tenure band, read from its industry buckets."""
+    rows = session.execute(
+            select(IndustryCompensationBucket.post_type, IndustryCompensationBucket.currency,
+                   IndustryCompensationBucket.tenure, IndustryCompensationBucket.bucket,
+                   IndustryCompensationBucket.count, IndustryCompensationBucket.total)
+            .where(IndustryCompensationBucket.industry == industry))
+
+    scopes = defaultdict(lambda: defaultdict(lambda: defaultdict(_histogram)))
+    for post_type, currency, tenure, bucket, count, total in rows:
+        scopes[post_type][currency][tenure][bucket] = [count, total]
+
+    return {post_type: {currency.name: _by_tenure(bands)
+                        for currency, bands in scopes[post_type].items()}
+            for post_type in POST_MODELS}
+
+
+def _medians(summary):
+    """Median of each tenure band of a _by_tenure summary, keyed by label."""
+    if 'tenure' not in summary:
+        return {None: summary['p50']}
+    return {band['tenure']: band['p50'] for band in summary['tenure']}
+
+
+def _tenure_index(org, baseline):
+    """Mean of an org's median over the industry median in each tenure
+    band, weighted by the org's posts in the band: 1.1 is paying 10% over
+    the industry for the same tenure, whatever the org's tenure mix."""
+    bands = org.get('tenure') or [dict(org, tenure=None)]
+    weighted = 0.0
+    weight = 0
+    for band in bands:
+        median = baseline.get(band['tenure'])
+        if median:
+            weighted += band['count'] * band['p50'] / median
+            weight += band['count']
+    return round(weighted / weight, 3) if weight else None
+
+
+def position_comparison(session, industry, position, min_count=1, limit=50):
+    """
+    A position, matched on its normalized name, compared across the orgs of
+    an industry per post type and currency: the industry wide summary of the
+    position overall and per tenure band, and the `limit` orgs with the
+    highest tenure adjusted index against the industry (_tenure_index).
+    Orgs with fewer than min_count posts are left out.
+    """
+    rows = session.execute(
+            select(PositionCompensationBucket.org_id, PositionCompensationBucket.post_type,
+                   PositionCompensationBucket.currency, PositionCompensationBucket.tenure,
+                   PositionCompensationBucket.bucket, PositionCompensationBucket.count,
+                   PositionCompensationBucket.total)
+            .where(PositionCompensationBucket.industry == industry,
+                   PositionCompensationBucket.position_key == normalize_name(position)))
+
+    baseline = defaultdict(lambda: defaultdict(lambda: defaultdict(_histogram)))
+    per_org = defaultdict(lambda: defaultdict(
+            lambda: defaultdict(lambda: defaultdict(_histogram))))
+    for org_id, post_type, currency, tenure, bucket, count, total in rows:
+        for histogram in (baseline[post_type][currency][tenure],
+                          per_org[post_type][currency][org_id][tenure]):
+            histogram[bucket][0] += count
+            histogram[bucket][1] += total
+
+    result = {}
+    for post_type in POST_MODELS:
+        currencies = {}
+        for currency, bands in baseline[post_type].items():
+            industry_summary = _by_tenure(bands, with_histogram=False)
+            medians = _medians(industry_summary)
+            orgs = []
+            for org_id, org_bands in per_org[post_type][currency].items():
+                if sum(count for histogram in org_bands.values()
+                       for count, _ in histogram.values()) < min_count:
+                    continue
+                summary = _by_tenure(org_bands, with_histogram=False)
+                orgs.append(dict(org_id=org_id, tenure_index=_tenure_index(summary, medians),
+                                 **summary))
+            orgs.sort(key=lambda org: (org['tenure_index'] or 0, org['count']), reverse=True)
+            currencies[currency.name] = dict(industry=industry_summary, orgs=orgs[:limit])
+        result[post_type] = currencies
+    return result
@@ -0,0 +1,105 @@
+from sqlalchemy import bindparam, inspect, select, update
+from sqlalchemy.schema import CreateColumn
+
+from . import database as db
+from . import votes, post_counts
+from .models import (
+        Organisation, Position, Review, Interview, ReviewVote, InterviewVote, normalize_name)
+
+
+# tables whose rows must be deduplicated before their unique indexes can be
+# built on an older database
+DEDUPLICATE = {ReviewVote.__tablename__: Review, InterviewVote.__tablename__: Interview}
+
+
+def _recount_orgs(conn):
+    post_counts.recount(conn, Organisation)
+
+
+def _recount_positions(conn):
+    post_counts.recount(conn, Position)
+
+
+def _fill_name_keys(conn, Model, batch_size=10000):
+    table = Model.__table__
+    set_key = (update(table)
+               .where(table.c.id == bindparam('row_id'))
+               .values(name_key=bindparam('key')))
+    rows = [dict(row_id=id, key=normalize_name(name))
+            for id, name in conn.execute(select(table.c.id, table.c.name))]
+    for i in range(0, len(rows), batch_size):
+        conn.execute(set_key, rows[i:i + batch_size])
+
+
+def _fill_org_name_keys(conn):
+    _fill_name_keys(conn, Organisation)
+
+
+def _fill_position_name_keys(conn):
+    _fill_name_keys(conn, Position)
+
+
+# columns derived from other data, filled in when they are added to an older
+# database, keyed by (table, column)
+BACKFILL = {
+    (Organisation.__tablename__, 'review_count'): _recount_orgs,
+    (Organisation.__tablename__, 'interview_count'): _recount_orgs,
+    (Organisation.__tablename__, 'name_key'): _fill_org_name_keys,
+    (Position.__tablename__, 'review_count'): _recount_positions,
+    (Position.__tablename__, 'interview_count'): _recount_positions,
+    (Position.__tablename__, 'name_key'): _fill_position_name_keys,
+}
+
+
+def upgrade_db(engine=None):
+    """Bring an existing database up to date with the current models. Missing
+    tables are created, missing columns are added (they must be nullable or
+    carry a server default) and missing indexes are built. Duplicate votes
+    are removed before the unique vote indexes are built, and derived columns
+    (BACKFILL) added to an existing table are filled in."""
+    engine = engine or db.engine
+    db.init_db(engine)
+
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        backfills = set()
+        for table in db.Base.metadata.sorted_tables:
+            existing_columns = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+
+                column_ddl = CreateColumn(column).compile(dialect=conn.dialect)
+                conn.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {column_ddl}')
+                if (table.name, column.name) in BACKFILL:
+                    backfills.add(BACKFILL[(table.name, column.name)])
+
+            existing_indexes = {i['name'] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in existing_indexes:
+                    continue
+
+                if index.unique and table.name in DEDUPLICATE:
+                    votes.dedupe_votes(conn, DEDUPLICATE[table.name])
+                index.create(conn)
+
+        for backfill in backfills:
+            backfill(conn)
+
+
+def backfill_vote_counts(engine=None):
+    """Recompute the materialized vote counts for every review and interview
+    from the vote tables."""
+    engine = engine or db.engine
+    with engine.begin() as conn:
+        votes.recount(conn, Review)
+        votes.recount(conn, Interview)
+
+
+def backfill_post_counts(engine=None):
+    """Recompute the stored review/interview counts of every organisation
+    and position from the post tables."""
+    engine = engine or db.engine
+    with engine.begin() as conn:
+        post_counts.recount(conn, Organisation)
+        post_counts.recount(conn, Position)
@@ -2,7 +2,7 @@ import enum
 
 from sqlalchemy import (
         Column, Integer, Float, String, Enum, Index, ForeignKey, text, Boolean)
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, configure_mappers
 from sqlalchemy.ext.hybrid import hybrid_property, hybrid_method
 from werkzeug.security import generate_password_hash, check_password_hash
 
@@ -65,6 +65,16 @@ class AccountType(enum.Enum):
 
 EPOCH_QUERY = "(select strftime('%s', 'now'))"
 
+
+def normalize_name(name):
+    """Key names are matched on: case folded with runs of whitespace
+    collapsed, so 'Software  Engineer ' matches 'software engineer'."""
+    return ' '.join(str(name).casefold().split())
+
+
+def name_key_default(context):
+    return normalize_name(context.get_current_parameters()['name'])
+
 class Account(db.Base):
     __tablename__ = 'account'
 
@@ -76,7 +86,7 @@ class Account(db.Base):
     type = Column(Enum(AccountType), default=AccountType.USER, nullable=False)
     anonymous = Column(Boolean, default=False)
     dark_mode = Column(Boolean, default=False)
-    password = Column(String(64), nullable=False)
+    password = Column(String(128), nullable=False)
     reviews = relationship('Review', backref='account', lazy=True)
     interviews = relationship('Interview', backref='account', lazy=True)
     interview_votes = relationship('InterviewVote', backref='account', lazy=True, cascade="all, delete-orphan")
@@ -94,8 +104,8 @@ class Account(db.Base):
         return check_password_hash(str(self.password), password)
 
     @hybrid_method
-    def add_password(self, password):
-        self.password = generate_password_hash(password, method='sha256')
+    def add_password(self, password, method='pbkdf2:sha256'):
+        self.password = generate_password_hash(password, method=method)
 
 
 account_username_idx = Index('account_username_idx', Account.username)
@@ -106,6 +116,8 @@ class Organisation(db.Base):
 
     id = Column(Integer, primary_key=True, nullable=False)
     name = Column(String(32), nullable=False)
+    # normalize_name(name), set on insert; duplicate names are checked on it
+    name_key = Column(String(32), default=name_key_default)
     url = Column(String)
     size = Column(Integer, default=1, nullable=False)
     headquarters = Column(String(32), nullable=False)
@@ -117,20 +129,30 @@ class Organisation(db.Base):
     positions = relationship('Position', backref='organisation', lazy=True, cascade="all, delete-orphan")
     page_visits = Column(Integer, default=1)
     verified = Column(Boolean, default=False, nullable=False)
+    # min_max(size) * min_max(page_visits) over all orgs, see db.popularity
+    popularity = Column(Float, default=0, server_default=text('0'), nullable=False)
+    # kept up to date as posts are created and deleted, see db.post_counts
+    review_count = Column(Integer, default=0, server_default=text('0'), nullable=False)
+    interview_count = Column(Integer, default=0, server_default=text('0'), nullable=False)
 
     def __repr__(self):
         return (f"<Organisation({self.id})>")
 
     @hybrid_property
     def total_reviews(self):
-        return len(self.reviews)
+        return self.review_count
 
     @hybrid_property
     def total_interviews(self):
-        return len(self.interviews)
+        return self.interview_count
 
 organisation_size_idx = Index('organisation_size_idx', Organisation.size)
+organisation_name_key_idx = Index('organisation_name_key_idx', Organisation.name_key)
 organisation_industry_idx = Index('organisation_industry_idx', Organisation.industry)
+organisation_popularity_idx = Index('organisation_popularity_idx',
+        Organisation.verified, Organisation.popularity)
+organisation_industry_popularity_idx = Index('organisation_industry_popularity_idx',
+        Organisation.verified, Organisation.industry, Organisation.popularity)
 
 
 class Position(db.Base):
@@ -138,24 +160,30 @@ class Position(db.Base):
 
     id = Column(Integer, primary_key=True, nullable=False)
     name = Column(String(32), nullable=False)
+    # normalize_name(name), set on insert; posts reuse positions matched on it
+    name_key = Column(String(32), default=name_key_default)
     created_at = Column(Integer, default=text(EPOCH_QUERY), nullable=False)
     updated_at = Column(Integer, default=text(EPOCH_QUERY), onupdate=text(EPOCH_QUERY))
     org_id = Column(Integer, ForeignKey('organisation.id'), nullable=False)
     reviews = relationship('Review', backref='position', lazy=True)
     interviews = relationship('Interview', backref='position', lazy=True)
+    # kept up to date as posts are created and deleted, see db.post_counts
+    review_count = Column(Integer, default=0, server_default=text('0'), nullable=False)
+    interview_count = Column(Integer, default=0, server_default=text('0'), nullable=False)
 
     def __repr__(self):
         return (f"<Position({self.id})>")
 
     @hybrid_property
     def total_reviews(self):
-        return len(self.reviews)
+        return self.review_count
 
     @hybrid_property
     def total_interviews(self):
-        return len(self.interviews)
+        return self.interview_count
 
 position_org_idx = Index('position_org_idx', Position.org_id)
+position_org_name_key_idx = Index('position_org_name_key_idx', Position.org_id, Position.name_key)
 
 
 class Review(db.Base):
@@ -175,6 +203,10 @@ class Review(db.Base):
     votes = relationship('ReviewVote', backref='review', lazy=True, cascade="all, delete-orphan")
     tag = Column(Enum(ReviewTag), default=ReviewTag.AVERAGE)
     reported = Column(Boolean, default=False)
+    # materialized vote counts, kept in step with review_vote by /account/vote
+    upvote_count = Column(Integer, default=0, server_default=text('0'), nullable=False)
+    downvote_count = Column(Integer, default=0, server_default=text('0'), nullable=False)
+    score = Column(Integer, default=0, server_default=text('0'), nullable=False)
 
     def __repr__(self):
         return (f"<Review({self.id})>")
@@ -188,9 +220,12 @@ class Review(db.Base):
         return [i.account_id for i in self.votes if i.vote == Vote.DOWNVOTE.value]
 
 review_account_idx = Index('review_account_idx', Review.account_id)
+review_account_created_idx = Index('review_account_created_idx', Review.account_id, Review.created_at)
 review_org_idx = Index('review_org_idx', Review.org_id)
 review_compensation_idx = Index('review_compensation_idx', Review.compensation)
 review_position_idx = Index('review_position_idx', Review.position_id)
+review_org_score_idx = Index('review_org_score_idx', Review.org_id, Review.score)
+review_org_created_idx = Index('review_org_created_idx', Review.org_id, Review.created_at)
 
 
 class Interview(db.Base):
@@ -210,6 +245,10 @@ class Interview(db.Base):
     votes = relationship('InterviewVote', backref='interview', lazy=True, cascade="all, delete-orphan")
     tag = Column(Enum(ReviewTag), default=ReviewTag.AVERAGE)
     reported = Column(Boolean, default=False)
+    # materialized vote counts, kept in step with interview_vote by /account/vote
+    upvote_count = Column(Integer, default=0, server_default=text('0'), nullable=False)
+    downvote_count = Column(Integer, default=0, server_default=text('0'), nullable=False)
+    score = Column(Integer, default=0, server_default=text('0'), nullable=False)
 
     def __repr__(self):
         return (f"<Interview({self.id})>")
@@ -223,9 +262,13 @@ class Interview(db.Base):
         return [i.account_id for i in self.votes if i.vote == Vote.DOWNVOTE.value]
 
 interview_account_idx = Index('interview_account_idx', Interview.account_id)
+interview_account_created_idx = Index('interview_account_created_idx',
+        Interview.account_id, Interview.created_at)
 interview_org_idx = Index('interview_org_idx', Interview.org_id)
 interview_compensation_idx = Index('interview_compensation_idx', Interview.compensation)
 interview_position_idx = Index('interview_position_idx', Interview.position_id)
+interview_org_score_idx = Index('interview_org_score_idx', Interview.org_id, Interview.score)
+interview_org_created_idx = Index('interview_org_created_idx', Interview.org_id, Interview.created_at)
 
 
 class InterviewVote(db.Base):
@@ -243,6 +286,9 @@ class InterviewVote(db.Base):
 
 interview_vote_account_idx = Index('interview_vote_account_idx', InterviewVote.account_id)
 interview_vote_interview_idx = Index('interview_vote_interview_idx', InterviewVote.interview_id)
+# one vote per account and post, see db.votes
+interview_vote_account_interview_idx = Index('interview_vote_account_interview_idx',
+        InterviewVote.account_id, InterviewVote.interview_id, unique=True)
 
 
 class ReviewVote(db.Base):
@@ -260,3 +306,99 @@ class ReviewVote(db.Base):
 
 review_vote_account_idx = Index('review_vote_account_idx', ReviewVote.account_id)
 review_vote_review_idx = Index('review_vote_review_idx', ReviewVote.review_id)
+review_vote_account_review_idx = Index('review_vote_account_review_idx',
+        ReviewVote.account_id, ReviewVote.review_id, unique=True)
+
+
+class CompensationBucket(db.Base):
+    """Histogram bucket of posted compensation, maintained as posts are created
+    and deleted so summaries never scan the posts. See db.compensation."""
+    __tablename__ = 'compensation_bucket'
+
+    id = Column(Integer, primary_key=True, nullable=False)
+    post_type = Column(Enum(PostTypeModel), nullable=False)
+    org_id = Column(Integer, ForeignKey('organisation.id'), nullable=False)
+    position_id = Column(Integer, ForeignKey('position.id'), nullable=False)
+    currency = Column(Enum(Currency), nullable=False)
+    bucket = Column(Integer, nullable=False)
+    count = Column(Integer, default=0, nullable=False)
+    total = Column(Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return (f"<CompensationBucket({self.id})>")
+
+compensation_bucket_key_idx = Index('compensation_bucket_key_idx',
+        CompensationBucket.org_id, CompensationBucket.post_type,
+        CompensationBucket.position_id, CompensationBucket.currency,
+        CompensationBucket.bucket, unique=True)
+
+
+class IndustryCompensationBucket(db.Base):
+    """Histogram bucket of the compensation posted across an industry's orgs
+    per tenure band. Recomputed from the posts on a schedule rather than
+    maintained per post. See db.industry_compensation."""
+    __tablename__ = 'industry_compensation_bucket'
+
+    id = Column(Integer, primary_key=True, nullable=False)
+    industry = Column(Enum(Industry), nullable=False)
+    post_type = Column(Enum(PostTypeModel), nullable=False)
+    currency = Column(Enum(Currency), nullable=False)
+    tenure = Column(Integer, nullable=False)
+    bucket = Column(Integer, nullable=False)
+    count = Column(Integer, default=0, nullable=False)
+    total = Column(Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return (f"<IndustryCompensationBucket({self.id})>")
+
+industry_compensation_bucket_key_idx = Index('industry_compensation_bucket_key_idx',
+        IndustryCompensationBucket.industry, IndustryCompensationBucket.post_type,
+        IndustryCompensationBucket.currency, IndustryCompensationBucket.tenure,
+        IndustryCompensationBucket.bucket, unique=True)
+
+
+class PositionCompensationBucket(db.Base):
+    """Histogram bucket of the compensation posted about a position, by its
+    normalized name, at one org of an industry per tenure band. Recomputed
+    with IndustryCompensationBucket."""
+    __tablename__ = 'position_compensation_bucket'
+
+    id = Column(Integer, primary_key=True, nullable=False)
+    industry = Column(Enum(Industry), nullable=False)
+    position_key = Column(String, nullable=False)
+    org_id = Column(Integer, ForeignKey('organisation.id'), nullable=False)
+    post_type = Column(Enum(PostTypeModel), nullable=False)
+    currency = Column(Enum(Currency), nullable=False)
+    tenure = Column(Integer, nullable=False)
+    bucket = Column(Integer, nullable=False)
+    count = Column(Integer, default=0, nullable=False)
+    total = Column(Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return (f"<PositionCompensationBucket({self.id})>")
+
+position_compensation_bucket_key_idx = Index('position_compensation_bucket_key_idx',
+        PositionCompensationBucket.industry, PositionCompensationBucket.position_key,
+        PositionCompensationBucket.org_id, PositionCompensationBucket.post_type,
+        PositionCompensationBucket.currency, PositionCompensationBucket.tenure,
+        PositionCompensationBucket.bucket, unique=True)
+
+
+class AggregateRefresh(db.Base):
+    """When a precomputed aggregate was last refreshed and the last post ids
+    it includes, for reporting its staleness."""
+    __tablename__ = 'aggregate_refresh'
+
+    name = Column(String, primary_key=True, nullable=False)
+    refreshed_at = Column(Integer, nullable=False)
+    seconds = Column(Float, default=0, nullable=False)
+    last_review_id = Column(Integer, default=0, nullable=False)
+    last_interview_id = Column(Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return (f"<AggregateRefresh({self.name})>")
+
+
+# set up the backref attributes (Review.account, Review.position, ...) now so
+# they can be used in loader options before any query has been run
+configure_mappers()
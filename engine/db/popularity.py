@@ -0,0 +1,49 @@
+from sqlalchemy import case, func, select, update
+
+from . import database as db
+from .models import Organisation
+
+
+# popularity = min_max(size) * min_max(page_visits), scaled over every
+# organisation so the ordering is the same on every page of /orgs/get-names
+
+
+def _bounds(conn):
+    page_visits = func.coalesce(Organisation.page_visits, 0)
+    return conn.execute(select(
+            func.min(Organisation.size), func.max(Organisation.size),
+            func.min(page_visits), func.max(page_visits))).one()
+
+
+def _scaled(column, low, high):
+    if low is None or high is None or high <= low:
+        return 0.0
+    return case(
+            (column >= high, 1.0),
+            (column <= low, 0.0),
+            else_=(column - low) * 1.0 / (high - low))
+
+
+def _popularity(conn):
+    min_size, max_size, min_visits, max_visits = _bounds(conn)
+    page_visits = func.coalesce(Organisation.page_visits, 0)
+    return (_scaled(Organisation.size, min_size, max_size)
+            * _scaled(page_visits, min_visits, max_visits))
+
+
+def refresh_popularity(engine=None):
+    """Recompute popularity for every organisation."""
+    engine = engine or db.engine
+    with engine.begin() as conn:
+        conn.execute(update(Organisation).values(popularity=_popularity(conn)))
+
+
+def update_popularity(conn, org_ids):
+    """Recompute popularity for a few organisations against the current
+    table wide bounds, within the caller's transaction."""
+    if not org_ids:
+        return
+
+    conn.execute(update(Organisation)
+                 .where(Organisation.id.in_(org_ids))
+                 .values(popularity=_popularity(conn)))
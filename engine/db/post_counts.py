@@ -0,0 +1,35 @@
+from sqlalchemy import func, select, update
+
+from .models import Organisation, Position, Review, Interview
+
+
+# stored post counter column on Organisation and Position for each post model
+POST_COUNTS = {Review: 'review_count', Interview: 'interview_count'}
+# post column holding the id of each counted model
+PARENT_IDS = {Organisation: 'org_id', Position: 'position_id'}
+
+
+def record(session, post, delta=1):
+    """Add (delta=1) or remove (delta=-1) a post from its organisation's and
+    position's stored counts, within the caller's transaction."""
+    counter = POST_COUNTS[type(post)]
+    for Model, parent_id in PARENT_IDS.items():
+        session.execute(update(Model)
+                        .where(Model.id == getattr(post, parent_id))
+                        .values({counter: getattr(Model, counter) + delta}))
+
+
+def recount(conn, Model, ids=None):
+    """Recompute the stored post counts of the Organisation or Position rows
+    with ids (every row if None) from the post tables."""
+    values = {}
+    for PostModel, counter in POST_COUNTS.items():
+        parent_id = getattr(PostModel, PARENT_IDS[Model])
+        values[counter] = (select(func.count(PostModel.id))
+                           .where(parent_id == Model.id)
+                           .scalar_subquery())
+
+    statement = update(Model).values(**values)
+    if ids is not None:
+        statement = statement.where(Model.id.in_(ids))
+    conn.execute(statement)
@@ -60,6 +60,25 @@ class InterviewSchema(Schema):
     tag = fields.Enum(ReviewTag)
     reported = fields.Bool()
 
+class CompactVotesMixin:
+    """Vote counts and the viewer's own vote in place of the full lists of
+    voter ids. The viewer's votes are passed in as context['my_votes'], a
+    dict of post id to vote."""
+    upvote_count = fields.Int(dump_only=True)
+    downvote_count = fields.Int(dump_only=True)
+    my_vote = fields.Method('get_my_vote', dump_only=True)
+
+    def get_my_vote(self, obj):
+        return self.context.get('my_votes', {}).get(obj.id, 0)
+
+class CompactReviewSchema(CompactVotesMixin, ReviewSchema):
+    class Meta:
+        exclude = ('upvotes', 'downvotes')
+
+class CompactInterviewSchema(CompactVotesMixin, InterviewSchema):
+    class Meta:
+        exclude = ('upvotes', 'downvotes')
+
 class AccountSchema(Schema):
     id = fields.Int(dump_only=True)
     username = fields.Str(dump_only=True)
@@ -78,8 +97,8 @@ class PositionSchema(Schema):
     org_id = fields.Int()
     created_at = fields.Int()
     updated_at = fields.Int(load_only=True)
-    total_reviews = fields.Int()
-    total_interviews = fields.Int()
+    total_reviews = fields.Int(dump_only=True)
+    total_interviews = fields.Int(dump_only=True)
 
 class OrganisationSchema(Schema):
     id = fields.Int()
@@ -93,7 +112,7 @@ class OrganisationSchema(Schema):
     reviews = fields.Nested(ReviewSchema, many=True, dump_only=True, exclude=['updated_at'])
     interviews = fields.Nested(InterviewSchema, many=True, dump_only=True, exclude=['updated_at'])
     positions = fields.Nested(PositionSchema, many=True, dump_only=True, exclude=['updated_at'])
-    total_reviews = fields.Int()
-    total_interviews = fields.Int()
+    total_reviews = fields.Int(dump_only=True)
+    total_interviews = fields.Int(dump_only=True)
     page_visits = fields.Str(load_only=True)
     verified = fields.Bool()
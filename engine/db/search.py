@@ -0,0 +1,158 @@
+from sqlalchemy import (
+        Column, Integer, Float, MetaData, Table, func, literal, literal_column,
+        select, union_all)
+
+from . import database as db
+
+
+# Organisation search uses two fts5 tables with the trigram tokenizer, so any
+# substring of 3+ characters is matched from an index. Names live in their
+# own table: headquarters and industry values repeat across many
+# organisations and would otherwise make every name lookup walk their long
+# doclists. Both tables are kept in step with the organisation table by
+# triggers, so create_company, the data generator and anything else writing
+# organisations keeps the index current without having to know about it.
+NAME_TABLE = 'organisation_name_search'
+PLACE_TABLE = 'organisation_place_search'
+MIN_MATCH_LENGTH = 3
+FUZZY_GRAM_LENGTH = 4
+# fewest candidates ranked per tier, and how fast the number grows while a
+# filtered search (e.g. by industry) can't fill its page from them
+MIN_CANDIDATES = 100
+TIERS = 3
+CANDIDATE_GROWTH = 8
+# words shared by so many names that their grams only slow fuzzy matching down
+STOP_WORDS = {'company', 'corp', 'corporation', 'group', 'holdings', 'inc',
+              'limited', 'llc', 'llp', 'ltd', 'plc', 'the'}
+
+metadata = MetaData()
+name_search = Table(NAME_TABLE, metadata, Column('rowid', Integer), Column('rank', Float))
+place_search = Table(PLACE_TABLE, metadata, Column('rowid', Integer), Column('rank', Float))
+
+SEARCH_COLUMNS = {
+    NAME_TABLE: ('name', 'new.name'),
+    PLACE_TABLE: ('headquarters, industry', "new.headquarters, replace(new.industry, '_', ' ')"),
+}
+
+
+def _table_ddl(table, columns, values):
+    return [
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS {table}
+            USING fts5({columns}, tokenize='trigram')""",
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_insert
+            AFTER INSERT ON organisation BEGIN
+                INSERT INTO {table}(rowid, {columns}) VALUES (new.id, {values});
+            END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_delete
+            AFTER DELETE ON organisation BEGIN
+                DELETE FROM {table} WHERE rowid = old.id;
+            END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_update
+            AFTER UPDATE OF {columns} ON organisation BEGIN
+                DELETE FROM {table} WHERE rowid = old.id;
+                INSERT INTO {table}(rowid, {columns}) VALUES (new.id, {values});
+            END""",
+    ]
+
+
+def _fill(conn, table):
+    columns, values = SEARCH_COLUMNS[table]
+    values = values.replace('new.', '')
+    conn.exec_driver_sql(
+            f"INSERT INTO {table}(rowid, {columns}) SELECT id, {values} FROM organisation")
+
+
+def init_search(engine=None):
+    """Create the search tables and their triggers if they are missing. Newly
+    created tables are filled from the existing organisations."""
+    engine = engine or db.engine
+    with engine.begin() as conn:
+        for table, (columns, values) in SEARCH_COLUMNS.items():
+            exists = conn.exec_driver_sql(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                    (table,)).scalar()
+            for statement in _table_ddl(table, columns, values):
+                conn.exec_driver_sql(statement)
+            if not exists:
+                _fill(conn, table)
+
+
+def rebuild_search(engine=None):
+    engine = engine or db.engine
+    with engine.begin() as conn:
+        for table in SEARCH_COLUMNS:
+            conn.exec_driver_sql(f"DELETE FROM {table}")
+            _fill(conn, table)
+
+
+def _phrase(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+def exact_match(text):
+    """fts5 query matching rows that contain text as a substring."""
+    return _phrase(text)
+
+
+def fuzzy_match(text):
+    """
+    fts5 query matching rows that share any 4 character substring with the
+    words of text. A typo only breaks the grams that overlap it, so the rest
+    still match and bm25 ranks rows sharing more of the query first.
+    """
+    grams = {word[i:i + FUZZY_GRAM_LENGTH]
+             for word in text.split() if word not in STOP_WORDS
+             for i in range(len(word) - FUZZY_GRAM_LENGTH + 1)}
+    return ' OR '.join([_phrase(text)] + sorted(_phrase(g) for g in grams))
+
+
+def _tiers(text, tiers):
+    """(table, fts5 query, tier) of the first `tiers` search tiers."""
+    return [(name_search, exact_match(text), 0),
+            (name_search, fuzzy_match(text), 1),
+            (place_search, exact_match(text), 2)][:tiers]
+
+
+def _matches(table, match):
+    return literal_column(table.name).match(match)
+
+
+def match_subquery(text, tiers=TIERS, limit=MIN_CANDIDATES):
+    """
+    (rowid, tier, rank) of organisations matching text in the first `tiers`
+    tiers. Tier 0 are names containing text, tier 1 names sharing parts of
+    it (typos) and tier 2 headquarters or industry containing it. Order by
+    tier, rank then popularity for the most relevant first.
+
+    Each tier is cut to its best ranked candidates inside the fts5 query,
+    which fts5 answers without touching the organisation table: a tier can
+    repeat up to `limit` rows of the tiers before it, so tier n keeps its
+    best (n + 1) * limit. A `limit` of offset + page size fills the page
+    when no other filter applies.
+    """
+    tiers = [select(select(table.c.rowid, literal(tier).label('tier'), table.c.rank)
+                    .where(_matches(table, match))
+                    .order_by(table.c.rank)
+                    .limit((tier + 1) * limit)
+                    .subquery())
+             for table, match, tier in _tiers(text, tiers)]
+
+    matched = union_all(*tiers).subquery()
+    # a bare column next to min() is read from the row holding the minimum
+    # in sqlite, so rank is the one of the organisation's best tier
+    return (select(matched.c.rowid,
+                   func.min(matched.c.tier).label('tier'),
+                   matched.c.rank)
+            .group_by(matched.c.rowid)
+            .subquery('search_match'))
+
+
+def has_more(session, text, tiers, limit):
+    """Whether match_subquery(text, tiers, limit) left out matches of any
+    tier. Counted without ranking, so it is cheaper than the search."""
+    for table, match, tier in _tiers(text, tiers):
+        cap = (tier + 1) * limit
+        capped = select(table.c.rowid).where(_matches(table, match)).limit(cap + 1).subquery()
+        if session.execute(select(func.count()).select_from(capped)).scalar() > cap:
+            return True
+    return False
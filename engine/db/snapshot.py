@@ -0,0 +1,267 @@
+"""
+Columnar snapshot of review and interview compensation for vectorized
+analytics.
+
+Each column of each post type is a raw little endian array file, with a
+manifest.json holding the row counts, dtypes, the last post id included and
+the code tables of the enum and position name columns. Readers map the files
+read only (np.memmap), so every worker shares the same pages through the OS
+cache, and only ever look at the first `rows` rows of a file.
+
+An incremental build appends the posts with an id above the last snapshot's
+to the files and then swaps in a new manifest, so readers never see a half
+written snapshot. A full build writes a new generation of files; readers of
+the old generation keep their mappings until they reload. Posts edited or
+deleted since they were snapshotted are only picked up by a full build.
+"""
+import glob
+import json
+import os
+import time
+
+import numpy as np
+from sqlalchemy import Enum, String, select, type_coerce
+
+from . import database as db
+from .models import (
+        Organisation, Position, Review, Interview, Currency, Industry, ReviewTag,
+        normalize_name)
+
+
+VERSION = 1
+MANIFEST = 'manifest.json'
+POST_MODELS = {'reviews': Review, 'interviews': Interview}
+ENUMS = {'industry': Industry, 'currency': Currency, 'tag': ReviewTag}
+# code of a missing enum value
+MISSING = 255
+COLUMNS = {
+    'id': 'int64',
+    'org_id': 'int32',
+    'position': 'int32',
+    'industry': 'uint8',
+    'currency': 'uint8',
+    'tag': 'uint8',
+    'compensation': 'int64',
+    'created_at': 'int64',
+}
+EXTRA_COLUMNS = {'reviews': {'duration_years': 'float32'}, 'interviews': {'stages': 'int16'}}
+# tenure bands of duration_years: [0, 1), [1, 2), [2, 5), [5, 10), [10, ...)
+TENURE_BANDS = (1, 2, 5, 10)
+TENURE_LABELS = ('<1', '1-2', '2-5', '5-10', '10+')
+PERCENTILES = (10, 25, 50, 75, 90)
+
+
+def columns_of(kind):
+    return dict(COLUMNS, **EXTRA_COLUMNS[kind])
+
+
+def _file(path, generation, kind, column):
+    return os.path.join(path, f'{kind}.{column}.{generation}.bin')
+
+
+def read_manifest(path):
+    try:
+        with open(os.path.join(path, MANIFEST)) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    return manifest if manifest.get('version') == VERSION else None
+
+
+def _write_manifest(path, manifest):
+    tmp = os.path.join(path, f'{MANIFEST}.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, os.path.join(path, MANIFEST))
+
+
+def _snapshot_query(PostModel, kind, after_id):
+    columns = [PostModel.id, PostModel.org_id, Position.name.label('position'),
+               Organisation.industry, PostModel.currency, PostModel.tag,
+               PostModel.compensation, PostModel.created_at,
+               *[getattr(PostModel, name) for name in EXTRA_COLUMNS[kind]]]
+    # enums are read as the names they are stored as
+    columns = [type_coerce(column, String).label(column.key)
+               if isinstance(column.type, Enum) else column for column in columns]
+    return (select(*columns)
+            .join(Organisation, Organisation.id == PostModel.org_id)
+            .join(Position, Position.id == PostModel.position_id)
+            .where(PostModel.id > after_id)
+            .order_by(PostModel.id))
+
+
+def build(path, engine=None, full=False, batch_size=100000):
+    """Bring the snapshot in `path` up to date: append the posts added since
+    the last build, or rebuild every column when `full` or there is no
+    usable snapshot. Returns the new manifest."""
+    engine = engine or db.read_engine
+    os.makedirs(path, exist_ok=True)
+    start = time.perf_counter()
+
+    manifest = None if full else read_manifest(path)
+    if manifest is None:
+        previous = read_manifest(path)
+        manifest = dict(
+                version=VERSION,
+                generation=previous['generation'] + 1 if previous else 1,
+                codes={name: [member.name for member in enum] for name, enum in ENUMS.items()},
+                positions=[],
+                posts={kind: dict(rows=0, last_id=0, columns=columns_of(kind))
+                       for kind in POST_MODELS})
+    generation = manifest['generation']
+    codes = {name: {label: code for code, label in enumerate(labels)}
+             for name, labels in manifest['codes'].items()}
+    positions = {name: code for code, name in enumerate(manifest['positions'])}
+
+    for kind, PostModel in POST_MODELS.items():
+        posts = manifest['posts'][kind]
+        files = {}
+        for column, dtype in posts['columns'].items():
+            filename = _file(path, generation, kind, column)
+            # drop anything appended by a build that failed before its
+            # manifest was written
+            with open(filename, 'ab') as f:
+                f.truncate(posts['rows'] * np.dtype(dtype).itemsize)
+            files[column] = open(filename, 'ab')
+
+        try:
+            with engine.connect() as conn:
+                result = conn.execution_options(yield_per=batch_size).execute(
+                        _snapshot_query(PostModel, kind, posts['last_id']))
+                for rows in result.partitions():
+                    values = dict(zip(result.keys(), zip(*rows)))
+                    for name in ENUMS:
+                        values[name] = [codes[name].get(label, MISSING) for label in values[name]]
+                    values['position'] = [
+                            positions.setdefault(normalize_name(name), len(positions))
+                            for name in values['position']]
+
+                    for column, dtype in posts['columns'].items():
+                        column_values = [0 if v is None else v for v in values[column]]
+                        np.asarray(column_values, dtype=dtype).tofile(files[column])
+                    posts['rows'] += len(rows)
+                    posts['last_id'] = int(values['id'][-1])
+        finally:
+            for f in files.values():
+                f.close()
+
+    manifest['positions'] = sorted(positions, key=positions.get)
+    manifest['built_at'] = int(time.time())
+    manifest['build_seconds'] = round(time.perf_counter() - start, 3)
+    _write_manifest(path, manifest)
+
+    # files of older generations are no longer in any manifest
+    for filename in glob.glob(os.path.join(path, '*.bin')):
+        if not filename.endswith(f'.{generation}.bin'):
+            os.remove(filename)
+    return manifest
+
+
+def group_stats(keys, values, percentiles=PERCENTILES):
+    """Count, mean and percentiles (linearly interpolated, as np.percentile)
+    of values for each distinct key, computed for every group at once over
+    values sorted within their group."""
+    order = np.lexsort((values, keys))
+    keys = keys[order]
+    values = values[order].astype(np.float64)
+    if not len(keys):
+        return dict(key=keys, count=np.zeros(0, np.int64), mean=np.zeros(0))
+
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    counts = np.diff(np.r_[starts, len(keys)])
+    stats = dict(key=keys[starts], count=counts,
+                 mean=np.add.reduceat(values, starts) / counts)
+    for p in percentiles:
+        position = starts + (counts - 1) * p / 100
+        low = np.floor(position).astype(np.int64)
+        high = np.minimum(low + 1, starts + counts - 1)
+        stats[f'p{p}'] = values[low] + (values[high] - values[low]) * (position - low)
+    return stats
+
+
+class Snapshot:
+    """
+    A snapshot mapped read only. group_by runs vectorized group-bys over it,
+    keyed by any of GROUP_KEYS, with optional equality filters.
+    """
+    GROUP_KEYS = ('industry', 'currency', 'tag', 'position', 'org', 'tenure')
+
+    def __init__(self, path):
+        self.path = path
+        self.manifest = read_manifest(path)
+        if self.manifest is None:
+            raise FileNotFoundError(f'No compensation snapshot in {path}')
+
+        self.columns = {}
+        generation = self.manifest['generation']
+        for kind, posts in self.manifest['posts'].items():
+            self.columns[kind] = {
+                    column: np.memmap(_file(path, generation, kind, column), dtype=dtype,
+                                      mode='r', shape=(posts['rows'],))
+                            if posts['rows'] else np.zeros(0, dtype=dtype)
+                    for column, dtype in posts['columns'].items()}
+        self.positions = {name: code for code, name in enumerate(self.manifest['positions'])}
+
+    def rows(self, kind):
+        return self.manifest['posts'][kind]['rows']
+
+    def _key(self, kind, name):
+        """(codes, labels) of a group key, labels being a function of code."""
+        columns = self.columns[kind]
+        if name in ENUMS:
+            labels = self.manifest['codes'][name]
+            return columns[name], lambda code: labels[code] if code < len(labels) else None
+        if name == 'position':
+            return columns['position'], lambda code: self.manifest['positions'][code]
+        if name == 'org':
+            return columns['org_id'], int
+        if name == 'tenure' and 'duration_years' in columns:
+            bands = np.digitize(columns['duration_years'], TENURE_BANDS).astype(np.uint8)
+            return bands, lambda code: TENURE_LABELS[code]
+        raise ValueError(f'Can not group {kind} by {name}')
+
+    def _mask(self, kind, filters):
+        columns = self.columns[kind]
+        # as in the compensation histograms, posts without a positive
+        # compensation are not counted
+        mask = columns['compensation'] > 0
+        for name, value in filters.items():
+            if value is None:
+                continue
+            if name in ENUMS:
+                labels = self.manifest['codes'][name]
+                code = labels.index(value) if value in labels else MISSING
+                mask &= columns[name] == code
+            elif name == 'org_id':
+                mask &= columns['org_id'] == value
+            elif name == 'position':
+                mask &= columns['position'] == self.positions.get(normalize_name(value), -1)
+            else:
+                raise ValueError(f'Can not filter {kind} by {name}')
+        return mask
+
+    def group_by(self, kind, by, percentiles=PERCENTILES, min_count=1, **filters):
+        """Compensation count, mean and percentiles per group of the `by`
+        keys, e.g. group_by('reviews', ['industry', 'tenure'], currency='GBP').
+        Compensation isn't converted between currencies, so group or filter
+        by currency for meaningful numbers."""
+        mask = self._mask(kind, filters)
+        keys = [self._key(kind, name) for name in by]
+
+        # one int64 key per group: the mixed radix number of its key codes
+        dims = [int(codes.max()) + 1 if len(codes) else 1 for codes, _ in keys]
+        combined = np.zeros(int(mask.sum()), dtype=np.int64)
+        for (codes, _), dim in zip(keys, dims):
+            combined = combined * dim + codes[mask].astype(np.int64)
+
+        stats = group_stats(combined, self.columns[kind]['compensation'][mask], percentiles)
+        groups = []
+        unravelled = np.unravel_index(stats['key'], dims) if by else []
+        for i in np.flatnonzero(stats['count'] >= min_count):
+            group = {name: label(int(codes[i]))
+                     for name, (_, label), codes in zip(by, keys, unravelled)}
+            group.update(count=int(stats['count'][i]), mean=round(float(stats['mean'][i]), 2))
+            for p in percentiles:
+                group[f'p{p}'] = round(float(stats[f'p{p}'][i]))
+            groups.append(group)
+        return groups
@@ -0,0 +1,70 @@
+from sqlalchemy import func, select, text, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from .models import (
+        Review, Interview, ReviewVote, InterviewVote, Vote, EPOCH_QUERY)
+
+
+# vote model and its post id column for each post model
+POST_VOTES = {Review: (ReviewVote, ReviewVote.review_id),
+              Interview: (InterviewVote, InterviewVote.interview_id)}
+
+
+def vote_count_values(PostModel):
+    """Correlated subqueries counting the votes cast on each post, for an
+    UPDATE of PostModel."""
+    VoteModel, post_id_col = POST_VOTES[PostModel]
+
+    def count_of(vote):
+        return (select(func.count(VoteModel.id))
+                .where(post_id_col == PostModel.id, VoteModel.vote == vote)
+                .scalar_subquery())
+
+    score = (select(func.coalesce(func.sum(VoteModel.vote), 0))
+             .where(post_id_col == PostModel.id)
+             .scalar_subquery())
+    return dict(
+            upvote_count=count_of(Vote.UPVOTE.value),
+            downvote_count=count_of(Vote.DOWNVOTE.value),
+            score=score)
+
+
+def recount(conn, PostModel, post_ids=None):
+    """Recompute the stored vote counts of post_ids (every post if None)
+    from the vote table."""
+    statement = update(PostModel).values(**vote_count_values(PostModel))
+    if post_ids is not None:
+        statement = statement.where(PostModel.id.in_(post_ids))
+    conn.execute(statement)
+
+
+def cast_votes(session, PostModel, account_id, votes):
+    """
+    Record an account's votes, a dict of post id to vote, in the caller's
+    transaction. Each vote is an INSERT ... ON CONFLICT DO UPDATE against the
+    unique (account_id, post id) index, so a new vote and a changed vote are
+    the same single statement, then the voted posts are recounted.
+    """
+    if not votes:
+        return
+
+    VoteModel, post_id_col = POST_VOTES[PostModel]
+    upsert = sqlite_insert(VoteModel)
+    upsert = upsert.on_conflict_do_update(
+            index_elements=[VoteModel.account_id, post_id_col],
+            set_=dict(vote=upsert.excluded.vote, updated_at=text(EPOCH_QUERY)))
+    session.execute(upsert, [{'account_id': account_id, post_id_col.key: post_id, 'vote': vote}
+                             for post_id, vote in votes.items()])
+    recount(session, PostModel, list(votes))
+
+
+def dedupe_votes(conn, PostModel):
+    """Delete all but the latest vote of each account on each post and, if
+    any were deleted, recount every post. Returns the number deleted."""
+    VoteModel, post_id_col = POST_VOTES[PostModel]
+    latest = (select(func.max(VoteModel.id))
+              .group_by(VoteModel.account_id, post_id_col))
+    deleted = conn.execute(VoteModel.__table__.delete().where(VoteModel.id.not_in(latest)))
+    if deleted.rowcount:
+        recount(conn, PostModel)
+    return deleted.rowcount
@@ -0,0 +1,122 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+import metrics
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing queue is full; ask the client to retry."""
+
+
+class PasswordHasher:
+    """
+    Password hashing off the request threads. Hashes run on a pool of
+    `workers` threads (hashlib releases the GIL while hashing) and at most
+    `max_pending` hashes may be running or queued; past that new requests
+    are refused with HashingBusy straight away rather than every request
+    thread waiting behind a burst of logins.
+
+    New hashes use `method`. Hashes made with another method, such as the
+    legacy single round sha256, report needs_rehash so they can be replaced
+    on the next successful login.
+    """
+    LOGIN_SAMPLES = 1000
+
+    def __init__(self, app=None):
+        self.method = 'pbkdf2:sha256'
+        self.workers = 2
+        self.max_pending = 16
+        self.retry_after = 1
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self._login_times = deque(maxlen=self.LOGIN_SAMPLES)
+        self.pending = 0
+        self.hashed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.hash_seconds = 0.0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.method = app.config.get('PASSWORD_HASH_METHOD', self.method)
+        self.workers = app.config.get('PASSWORD_HASH_WORKERS', self.workers)
+        self.max_pending = app.config.get('PASSWORD_HASH_MAX_PENDING', self.max_pending)
+        self.retry_after = app.config.get('PASSWORD_HASH_RETRY_AFTER', self.retry_after)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='password-hash')
+            self._slots = threading.BoundedSemaphore(self.max_pending)
+        metrics.register('password_hashing', self.stats)
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, method=self.method)
+
+    def check(self, pwhash, password):
+        return self._run(check_password_hash, str(pwhash), password)
+
+    def needs_rehash(self, pwhash):
+        method = str(pwhash).split('$', 1)[0]
+        return method != self.method and not method.startswith(f'{self.method}:')
+
+    def record_login(self, seconds, rehashed=False):
+        with self._lock:
+            self._login_times.append(seconds)
+            self.rehashed += rehashed
+
+    def _run(self, fn, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HashingBusy()
+
+        with self._lock:
+            self.pending += 1
+
+        def timed():
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.hashed += 1
+                    self.hash_seconds += time.perf_counter() - start
+
+        try:
+            return self._executor.submit(timed).result()
+        finally:
+            with self._lock:
+                self.pending -= 1
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            login_times = sorted(self._login_times)
+            stats = dict(
+                    method=self.method,
+                    workers=self.workers,
+                    max_pending=self.max_pending,
+                    pending=self.pending,
+                    hashed=self.hashed,
+                    rejected=self.rejected,
+                    rehashed=self.rehashed,
+                    mean_hash_ms=round(self.hash_seconds / self.hashed * 1000, 2)
+                            if self.hashed else 0)
+
+        def percentile(p):
+            return round(login_times[int(p / 100 * (len(login_times) - 1))] * 1000, 2)
+
+        stats['login_ms'] = dict(
+                samples=len(login_times),
+                p50=percentile(50) if login_times else 0,
+                p95=percentile(95) if login_times else 0,
+                p99=percentile(99) if login_times else 0)
+        return stats
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,11 @@
+_providers = {}
+
+
+def register(name, provider):
+    """Register a callable returning a json serializable dict of stats. It is
+    reported under name by the /metrics endpoint."""
+    _providers[name] = provider
+
+
+def snapshot():
+    return {name: provider() for name, provider in _providers.items()}
@@ -0,0 +1,116 @@
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+
+from sqlalchemy import bindparam, func, update
+
+import metrics
+from db import database as db
+from db import popularity
+from db.models import Organisation
+
+
+logger = logging.getLogger('server')
+
+
+class PageVisitBuffer:
+    """
+    Write-behind buffer for Organisation.page_visits. Visits are counted in
+    memory and a background thread writes them every `interval` seconds, or
+    sooner once `threshold` visits are pending, as one batched
+    UPDATE ... SET page_visits = page_visits + ? transaction. Whatever is
+    still pending is written when the process exits.
+    """
+    def __init__(self, app=None):
+        self.interval = 5
+        self.threshold = 500
+        self._counts = Counter()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._stopped = False
+        self.flushes = 0
+        self.flushed_visits = 0
+        self.last_flush_seconds = 0.0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.interval = app.config.get('PAGE_VISIT_FLUSH_INTERVAL', self.interval)
+        self.threshold = app.config.get('PAGE_VISIT_FLUSH_THRESHOLD', self.threshold)
+        metrics.register('page_visits', self.stats)
+
+        if self._thread is None:
+            self._thread = threading.Thread(
+                    target=self._run, name='page-visit-flush', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def hit(self, org_id):
+        with self._lock:
+            self._counts[org_id] += 1
+            self._pending += 1
+            pending = self._pending
+
+        if pending >= self.threshold:
+            self._wake.set()
+
+    def flush(self):
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+            self._pending = 0
+        if not counts:
+            return
+
+        start = time.perf_counter()
+        table = Organisation.__table__
+        increment = (update(table)
+                     .where(table.c.id == bindparam('org_id'))
+                     .values(page_visits=func.coalesce(table.c.page_visits, 0)
+                             + bindparam('visits')))
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(increment, [dict(org_id=org_id, visits=visits)
+                                         for org_id, visits in counts.items()])
+                popularity.update_popularity(conn, list(counts))
+        except Exception as e:
+            logger.error(e)
+            # keep the visits for the next attempt
+            with self._lock:
+                self._counts.update(counts)
+                self._pending += sum(counts.values())
+            return
+
+        self.flushes += 1
+        self.flushed_visits += sum(counts.values())
+        self.last_flush_seconds = time.perf_counter() - start
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            pending, pending_orgs = self._pending, len(self._counts)
+        return dict(
+                pending_visits=pending,
+                pending_orgs=pending_orgs,
+                flushes=self.flushes,
+                flushed_visits=self.flushed_visits,
+                last_flush_seconds=self.last_flush_seconds)
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+
+page_visit_buffer = PageVisitBuffer()
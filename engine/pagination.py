@@ -0,0 +1,83 @@
+import base64
+import binascii
+import json
+
+from sqlalchemy import func, tuple_
+
+
+# page sizes are clamped to 1..MAX_LIMIT: sqlite reads a negative LIMIT as no
+# limit, and an empty page would have no cursor to carry on from
+MAX_LIMIT = 100
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    """Pack a list of json serializable values into an opaque url safe token."""
+    raw = json.dumps(values, separators=(',', ':')).encode('utf8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor(token)
+
+    if not isinstance(values, list):
+        raise InvalidCursor(token)
+    return values
+
+
+def sort_key(column):
+    """Nullable columns are sorted as 0 so (key, id) comparisons stay total."""
+    if column.nullable:
+        return func.coalesce(column, 0)
+    return column
+
+
+def paginate(query, column, id_column, limit, descending=True, after=None,
+             offset=0, tag=None):
+    """
+    Page a query ordered by (column, id_column). When an `after` cursor is
+    given the page starts right after the row it points at (keyset
+    pagination), otherwise offset is used so older clients keep working.
+    One extra row is fetched to tell whether more rows exist, so no count
+    query is needed.
+
+    Returns (rows, max_reached, next_cursor). The cursor holds the tag (the
+    sort order it was made for), the last row's sort value and its id.
+    """
+    limit = max(1, min(limit, MAX_LIMIT))
+    key = sort_key(column)
+    order_by = (key.desc(), id_column.desc()) if descending else (key, id_column)
+
+    query = query.order_by(*order_by)
+    if after:
+        values = decode_cursor(after)
+        if len(values) != 3 or values[0] != tag:
+            raise InvalidCursor(after)
+
+        last_key = tuple_(values[1], values[2])
+        if descending:
+            query = query.filter(tuple_(key, id_column) < last_key)
+        else:
+            query = query.filter(tuple_(key, id_column) > last_key)
+    elif offset:
+        query = query.offset(offset)
+
+    rows = query.limit(limit + 1).all()
+    max_reached = len(rows) <= limit
+    rows = rows[:limit]
+
+    next_cursor = None
+    if rows and not max_reached:
+        last = rows[-1]
+        value = getattr(last, column.key)
+        next_cursor = encode_cursor([tag, value if value is not None else 0,
+                                     getattr(last, id_column.key)])
+
+    return rows, max_reached, next_cursor
@@ -0,0 +1,99 @@
+import logging
+import threading
+import time
+
+from flask import g, request
+
+import metrics
+from db import database as db
+
+
+logger = logging.getLogger('server')
+slow_query_logger = logging.getLogger('server.slow_query')
+
+
+class QueryLog:
+    """
+    Per-request SQL instrumentation. Every statement a request runs on the
+    database engine is counted and timed (db.database.instrument); the totals
+    and the slowest statement are sent back as Server-Timing headers.
+    Statements slower than `slow_ms` are written to the slow query log and
+    requests running the same statement shape more than `repeat_threshold`
+    times are flagged as N+1 queries. Streamed response bodies run after the
+    headers are sent, so their statements are not counted.
+    """
+    def __init__(self, app=None):
+        self.enabled = True
+        self.slow_ms = 100
+        self.repeat_threshold = 10
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.statements = 0
+        self.slow_queries = 0
+        self.repeated_queries = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('SQL_INSTRUMENTATION_ENABLED', self.enabled)
+        self.slow_ms = app.config.get('SQL_SLOW_QUERY_MS', self.slow_ms)
+        self.repeat_threshold = app.config.get('SQL_REPEAT_THRESHOLD', self.repeat_threshold)
+
+        log_file = app.config.get('SQL_SLOW_QUERY_LOG')
+        if log_file:
+            handler = logging.FileHandler(log_file)
+            handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            slow_query_logger.addHandler(handler)
+            slow_query_logger.setLevel(logging.INFO)
+
+        metrics.register('sql', self.stats)
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+
+    def before_request(self):
+        if self.enabled:
+            g.query_stats_token = db.query_stats.set(db.QueryStats(self.slow_ms / 1000))
+            g.request_start = time.perf_counter()
+
+    def after_request(self, response):
+        token = g.pop('query_stats_token', None)
+        if token is None:
+            return response
+
+        stats = db.query_stats.get()
+        db.query_stats.reset(token)
+        elapsed = time.perf_counter() - g.pop('request_start')
+
+        response.headers.add('Server-Timing',
+                             f'db;dur={stats.total_time * 1000:.2f};desc="{stats.count} queries"')
+        if stats.count:
+            response.headers.add('Server-Timing', f'db-slowest;dur={stats.slowest[0] * 1000:.2f}')
+        response.headers.add('Server-Timing', f'app;dur={elapsed * 1000:.2f}')
+
+        endpoint = f'{request.method} {request.path}'
+        for duration, statement in stats.slow:
+            slow_query_logger.warning('slow query %.1fms in %s: %s',
+                                      duration * 1000, endpoint, db.statement_shape(statement))
+
+        repeated = stats.repeated(self.repeat_threshold)
+        for shape, count in repeated:
+            logger.warning('possible N+1: %d runs in %s of: %s', count, endpoint, shape)
+
+        with self._lock:
+            self.requests += 1
+            self.statements += stats.count
+            self.slow_queries += len(stats.slow)
+            self.repeated_queries += len(repeated)
+        return response
+
+    def stats(self):
+        return dict(
+                enabled=self.enabled,
+                requests=self.requests,
+                statements=self.statements,
+                slow_queries=self.slow_queries,
+                repeated_queries=self.repeated_queries)
+
+
+query_log = QueryLog()
@@ -0,0 +1,245 @@
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSessionInterface, SessionInterface, SessionMixin
+from flask_session import Session as FlaskSession
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+import metrics
+
+
+def is_permanent(app, session):
+    # flask_session made every session permanent when SESSION_PERMANENT was
+    # set, without storing it in the session
+    return session.permanent or app.config.get('SESSION_PERMANENT', False)
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session whose data is stored server side under `sid`."""
+    def __init__(self, initial=None, sid=None, new=False, expires_at=None):
+        def on_update(self):
+            self.modified = True
+
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.expires_at = expires_at
+        self.modified = False
+
+
+class SqliteSessionStore:
+    """Sessions in their own sqlite file, one connection per thread."""
+    PURGE_EVERY = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, isolation_level=None)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            conn.execute('PRAGMA busy_timeout = 5000')
+            conn.execute('CREATE TABLE IF NOT EXISTS web_session ('
+                         'id TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at INTEGER NOT NULL)')
+            self._local.conn = conn
+        return conn
+
+    def get(self, sid):
+        row = self._connection().execute(
+                'SELECT data, expires_at FROM web_session WHERE id = ? AND expires_at > ?',
+                (sid, int(time.time()))).fetchone()
+        return row
+
+    def set(self, sid, data, expires_at):
+        conn = self._connection()
+        conn.execute('INSERT INTO web_session (id, data, expires_at) VALUES (?, ?, ?) '
+                     'ON CONFLICT (id) DO UPDATE SET data = excluded.data, '
+                     'expires_at = excluded.expires_at', (sid, data, expires_at))
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            conn.execute('DELETE FROM web_session WHERE expires_at <= ?', (int(time.time()),))
+
+    def delete(self, sid):
+        self._connection().execute('DELETE FROM web_session WHERE id = ?', (sid,))
+
+
+class SqliteSessionInterface(SessionInterface):
+    """
+    Server side sessions in a sqlite store behind an in-process LRU cache.
+    The cookie only holds the signed session id. A session is written when
+    its contents change or when less than half its lifetime is left, not on
+    every request. Cached entries are trusted for `cache_ttl` seconds, so a
+    logout seen by another worker process applies there within that time.
+    """
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, path, cache_size=10000, cache_ttl=30):
+        self.store = SqliteSessionStore(path)
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.writes = 0
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='ratrace-session', key_derivation='hmac')
+
+    def _cached(self, sid):
+        with self._lock:
+            entry = self._cache.get(sid)
+            if entry is None or entry[0] < time.monotonic():
+                self.cache_misses += 1
+                return None
+            self._cache.move_to_end(sid)
+            self.cache_hits += 1
+            return entry[1]
+
+    def _cache_set(self, sid, value):
+        with self._lock:
+            if value is None:
+                self._cache.pop(sid, None)
+                return
+            self._cache[sid] = (time.monotonic() + self.cache_ttl, value)
+            self._cache.move_to_end(sid)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode()
+            except BadSignature:
+                sid = None
+
+            if sid:
+                entry = self._cached(sid)
+                if entry is None:
+                    entry = self.store.get(sid)
+                    if entry is not None:
+                        self._cache_set(sid, entry)
+                if entry is not None:
+                    data, expires_at = entry
+                    if expires_at > time.time():
+                        return ServerSession(self.serializer.loads(data), sid=sid,
+                                             expires_at=expires_at)
+
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                self._cache_set(session.sid, None)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        now = time.time()
+        stale = session.expires_at is None or session.expires_at - now < lifetime / 2
+        if not session.modified and not stale:
+            return
+
+        expires_at = int(now + lifetime)
+        data = self.serializer.dumps(dict(session))
+        self.store.set(session.sid, data, expires_at)
+        self._cache_set(session.sid, (data, expires_at))
+        self.writes += 1
+
+        response.set_cookie(
+                name,
+                self._signer(app).sign(session.sid).decode(),
+                expires=datetime.fromtimestamp(expires_at, timezone.utc)
+                        if is_permanent(app, session) else None,
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app))
+
+    def stats(self):
+        with self._lock:
+            cached = len(self._cache)
+        return dict(
+                backend='sqlite',
+                cached=cached,
+                cache_hits=self.cache_hits,
+                cache_misses=self.cache_misses,
+                writes=self.writes)
+
+
+class CookieSessionInterface(SecureCookieSessionInterface):
+    """
+    Stateless sessions: the session data (just the account id) is kept in
+    the signed cookie itself. Like the sqlite backend the cookie is only
+    rewritten when the session changes or is past half its lifetime.
+    """
+    ISSUED_KEY = '_issued'
+
+    def __init__(self):
+        self.writes = 0
+
+    def should_set_cookie(self, app, session):
+        if session.modified:
+            return True
+
+        issued = session.get(self.ISSUED_KEY)
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        return is_permanent(app, session) and (issued is None or time.time() - issued > lifetime / 2)
+
+    def get_expiration_time(self, app, session):
+        if is_permanent(app, session):
+            return datetime.now(timezone.utc) + app.permanent_session_lifetime
+        return None
+
+    def save_session(self, app, session, response):
+        if session and self.should_set_cookie(app, session):
+            session[self.ISSUED_KEY] = int(time.time())
+            self.writes += 1
+        super().save_session(app, session, response)
+
+    def stats(self):
+        return dict(backend='cookie', writes=self.writes)
+
+
+def init_app(app):
+    """Install the session backend named by SESSION_BACKEND: sqlite (default),
+    cookie, or filesystem (flask_session)."""
+    backend = app.config.get('SESSION_BACKEND', 'sqlite')
+    if backend == 'filesystem':
+        FlaskSession(app)
+        metrics.register('sessions', lambda: dict(backend='filesystem'))
+        return
+
+    if backend == 'cookie':
+        interface = CookieSessionInterface()
+    elif backend == 'sqlite':
+        path = app.config.get('SESSION_SQLITE_PATH') or \
+                os.path.join(app.instance_path, 'sessions.sqlite')
+        interface = SqliteSessionInterface(
+                path,
+                cache_size=app.config.get('SESSION_CACHE_SIZE', 10000),
+                cache_ttl=app.config.get('SESSION_CACHE_TTL', 30))
+    else:
+        raise ValueError(f'Unknown SESSION_BACKEND {backend}')
+
+    app.session_interface = interface
+    metrics.register('sessions', interface.stats)
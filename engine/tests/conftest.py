@@ -0,0 +1,71 @@
+import pytest
+
+import config
+from db import database as db, migrations
+from db.models import Account, Organisation, Position, Review, Industry, ReviewTag
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """App on an empty database of its own, with the writer disabled."""
+    overrides = dict(
+            SQLITE_DATABASE=str(tmp_path / 'ratrace.db'),
+            SESSION_SQLITE_PATH=str(tmp_path / 'sessions.sqlite'),
+            SESSION_COOKIE_SECURE=False,
+            COMPENSATION_SNAPSHOT_PATH=str(tmp_path / 'compensation_snapshot'),
+            TYPEAHEAD_ENABLED=False)
+    for key, value in overrides.items():
+        monkeypatch.setattr(config.DevConfig, key, value)
+
+    # the app reads through a read only engine, so the file must exist first
+    db.configure(database=overrides['SQLITE_DATABASE'])
+    migrations.upgrade_db()
+
+    from app import create_app
+    app = create_app('dev')
+    yield app
+    db.Session.remove()
+    db.ReadSession.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def session(app):
+    yield db.Session
+    db.Session.remove()
+
+
+def login(client, account_id):
+    with client.session_transaction() as client_session:
+        client_session['account_id'] = account_id
+
+
+def add_account(session, username='user'):
+    account = Account(username=username, password='')
+    session.add(account)
+    session.commit()
+    return account
+
+
+def add_org(session, name, headquarters='London', industry=Industry.RETAIL, **columns):
+    org = Organisation(name=name, headquarters=headquarters, industry=industry, **columns)
+    session.add(org)
+    session.commit()
+    return org
+
+
+def add_reviews(session, org, account, count, position_name='Engineer', **columns):
+    """Add count reviews of org by account, returns their ids."""
+    position = Position(name=position_name, org_id=org.id)
+    session.add(position)
+    session.flush()
+    reviews = [Review(org_id=org.id, position_id=position.id, account_id=account.id,
+                      location='London', post=f'review {i}', tag=ReviewTag.GOOD, **columns)
+               for i in range(count)]
+    session.add_all(reviews)
+    session.commit()
+    return [review.id for review in reviews]
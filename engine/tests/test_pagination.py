@@ -0,0 +1,54 @@
+import pytest
+
+from pagination import MAX_LIMIT, encode_cursor
+from tests.conftest import add_account, add_org, add_reviews
+
+
+@pytest.fixture
+def org(session):
+    return add_org(session, 'Acme')
+
+
+@pytest.fixture
+def review_ids(session, org):
+    # same created_at for every review, so pages are told apart by id alone
+    return add_reviews(session, org, add_account(session), MAX_LIMIT + 20, created_at=1000)
+
+
+def get_reviews(client, org, **args):
+    return client.get(f'/orgs/{org.id}/reviews', query_string=args).json
+
+
+@pytest.mark.parametrize('limit, expected', [(-1, 1), (0, 1), (5, 5), (10 ** 6, MAX_LIMIT)])
+def test_limit_is_clamped(client, org, review_ids, limit, expected):
+    page = get_reviews(client, org, limit=limit)
+    assert len(page['posts']) == expected
+    assert not page['max_reached']
+    assert page['next_cursor']
+
+
+def test_cursor_walks_every_row_once(client, org, review_ids):
+    ids = []
+    page = get_reviews(client, org, limit=7)
+    while True:
+        ids += [post['id'] for post in page['posts']]
+        if page['max_reached']:
+            assert page['next_cursor'] is None
+            break
+        page = get_reviews(client, org, limit=7, after=page['next_cursor'])
+
+    assert ids == sorted(review_ids, reverse=True)
+
+
+def test_cursor_matches_offset(client, org, review_ids):
+    first = get_reviews(client, org, limit=10, sort_order='COMPENSATION')
+    by_cursor = get_reviews(client, org, limit=10, sort_order='COMPENSATION',
+                            after=first['next_cursor'])
+    by_offset = get_reviews(client, org, limit=10, sort_order='COMPENSATION', offset=10)
+    assert by_cursor['posts'] == by_offset['posts']
+
+
+@pytest.mark.parametrize('after', ['not a cursor', encode_cursor(['TENURE', 0, 1]),
+                                   encode_cursor([None, 0])])
+def test_invalid_cursor(client, org, after):
+    assert get_reviews(client, org, after=after) == dict(error='Invalid cursor')
@@ -0,0 +1,58 @@
+import pytest
+
+from db import search
+from db.models import Industry
+from tests.conftest import add_org
+
+
+@pytest.fixture
+def orgs(session):
+    names = {}
+    for name, popularity, columns in [
+            ('Widgets Aaa', 0.2, {}),
+            ('Widgets Bbb', 0.8, {}),
+            ('Widgetz Ltd', 0.9, {}),
+            ('Gadgets', 1.0, dict(headquarters='Widgetshire')),
+            ('Unrelated', 1.0, {})]:
+        names[name] = add_org(session, name, popularity=popularity, **columns).id
+    return names
+
+
+def search_names(client, org_name, **args):
+    found = client.get('/orgs/search', query_string=dict(org_name=org_name, **args)).json
+    return [org['name'] for org in found]
+
+
+def test_tiers_then_popularity(client, orgs):
+    # names containing the query, ties by popularity, then names sharing
+    # parts of it, then headquarters
+    assert search_names(client, 'widgets') == [
+            'Widgets Bbb', 'Widgets Aaa', 'Widgetz Ltd', 'Gadgets']
+
+
+def test_lower_tiers_skipped_when_page_is_full(client, orgs):
+    assert search_names(client, 'widgets', limit=2) == ['Widgets Bbb', 'Widgets Aaa']
+    assert search_names(client, 'widgets', limit=2, offset=2) == ['Widgetz Ltd', 'Gadgets']
+
+
+def test_typo_matches(client, orgs):
+    assert search_names(client, 'widgetts')[:3] == ['Widgetz Ltd', 'Widgets Bbb', 'Widgets Aaa']
+
+
+def test_short_query_is_a_name_prefix(client, orgs):
+    assert search_names(client, 'wi') == ['Widgetz Ltd', 'Widgets Bbb', 'Widgets Aaa']
+    assert search_names(client, 'WI ') == search_names(client, 'wi')
+    assert search_names(client, 'ts') == []
+
+
+def test_no_query_is_by_popularity(client, orgs):
+    assert search_names(client, '', limit=2) == ['Unrelated', 'Gadgets']
+
+
+def test_filtered_search_grows_candidates(client, session, monkeypatch):
+    monkeypatch.setattr(search, 'MIN_CANDIDATES', 1)
+    for i in range(10):
+        add_org(session, f'Widgets {i}', popularity=0.5)
+    add_org(session, 'Widgets Law', industry=Industry.LAW, popularity=0.1)
+
+    assert search_names(client, 'widgets', limit=1, industry='LAW') == ['Widgets Law']
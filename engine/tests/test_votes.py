@@ -0,0 +1,64 @@
+import pytest
+
+from db.models import Review, ReviewVote
+from tests.conftest import add_account, add_org, add_reviews, login
+
+
+@pytest.fixture
+def review_id(session):
+    org = add_org(session, 'Acme')
+    review_id, = add_reviews(session, org, add_account(session, 'author'), 1)
+    return review_id
+
+
+def vote(client, review_id, value):
+    return client.put('/account/vote', json=dict(
+            post_id=review_id, vote=value, vote_model_type='review')).json
+
+
+def counts(session, review_id):
+    session.expire_all()
+    review = session.get(Review, review_id)
+    votes = session.query(ReviewVote).filter(ReviewVote.review_id == review_id).count()
+    return review.upvote_count, review.downvote_count, review.score, votes
+
+
+def test_vote_needs_login(client, session, review_id):
+    assert vote(client, review_id, 1) == dict(vote_created=False, error='Not authenticated')
+    assert counts(session, review_id) == (0, 0, 0, 0)
+
+
+def test_repeated_vote_is_counted_once(client, session, review_id):
+    login(client, add_account(session, 'voter').id)
+    for _ in range(3):
+        assert vote(client, review_id, 1) == dict(vote_created=True, error=None)
+    assert counts(session, review_id) == (1, 0, 1, 1)
+
+
+def test_changed_vote_moves_counts(client, session, review_id):
+    login(client, add_account(session, 'voter').id)
+    vote(client, review_id, 1)
+    vote(client, review_id, -1)
+    assert counts(session, review_id) == (0, 1, -1, 1)
+
+
+def test_votes_of_many_accounts(client, session, review_id):
+    for i, value in enumerate([1, 1, -1]):
+        login(client, add_account(session, f'voter {i}').id)
+        vote(client, review_id, value)
+    assert counts(session, review_id) == (2, 1, 1, 3)
+
+
+def test_vote_sort_uses_counts(client, session, review_id):
+    org = session.get(Review, review_id).organisation
+    other_id, = add_reviews(session, org, add_account(session, 'other author'), 1,
+                            position_name='Analyst')
+    org_id = org.id
+    login(client, add_account(session, 'voter').id)
+    vote(client, other_id, 1)
+    vote(client, review_id, -1)
+
+    for sort_order, expected in (('UPVOTES', [other_id, review_id]),
+                                 ('DOWNVOTES', [review_id, other_id])):
+        page = client.get(f'/orgs/{org_id}/reviews', query_string=dict(sort_order=sort_order)).json
+        assert [post['id'] for post in page['posts']] == expected
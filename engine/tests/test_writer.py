@@ -0,0 +1,60 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy import event
+
+from db import database as db
+from db.models import Account
+from writer import GroupCommitWriter
+
+
+@pytest.fixture
+def writer(app):
+    app.config.update(WRITER_ENABLED=True, WRITER_MAX_DELAY_MS=200)
+    writer = GroupCommitWriter(app)
+    yield writer
+    writer.stop()
+
+
+def add_account(username):
+    def unit(session):
+        session.add(Account(username=username, password=''))
+    return unit
+
+
+def fail(session):
+    raise ValueError('unit failed')
+
+
+def write_all(writer, units):
+    with ThreadPoolExecutor(len(units)) as pool:
+        return list(pool.map(writer.write, units))
+
+
+def usernames(session):
+    return {username for username, in session.query(Account.username)}
+
+
+def test_group_commit(writer, session):
+    assert write_all(writer, [add_account('a'), fail, add_account('b')]) == [True, False, True]
+    assert usernames(session) == {'a', 'b'}
+    assert writer.stats()['failed_groups'] == 0
+
+
+def test_units_retried_when_group_commit_fails(writer, session):
+    failures = []
+    def fail_first_commit(writer_session):
+        # savepoint releases fire before_commit too, only fail the group's
+        if not failures and not writer_session.in_nested_transaction():
+            failures.append(writer_session)
+            raise RuntimeError('commit failed')
+
+    event.listen(db.WriterSession, 'before_commit', fail_first_commit)
+    try:
+        results = write_all(writer, [add_account('a'), fail, add_account('b')])
+    finally:
+        event.remove(db.WriterSession, 'before_commit', fail_first_commit)
+
+    assert results == [True, False, True]
+    assert usernames(session) == {'a', 'b'}
+    assert writer.stats()['failed_groups'] == 1
@@ -0,0 +1,242 @@
+import atexit
+import bisect
+import heapq
+import logging
+import threading
+import time
+
+from sqlalchemy import select
+
+import metrics
+from db import database as db
+from db.models import Organisation, Position, normalize_name as normalize
+
+
+logger = logging.getLogger('server')
+
+
+class PrefixIndex:
+    """
+    Sorted array of (key, id) pairs searched with bisect. Every word of a
+    name is a key, so 'bank of america' is found by 'ban', 'of a' and 'ame'.
+    """
+    def __init__(self, names=()):
+        pairs = sorted((key, id) for id, name in names for key in self._keys(name))
+        self.keys = [key for key, _ in pairs]
+        self.ids = [id for _, id in pairs]
+
+    @staticmethod
+    def _keys(name):
+        words = name.split(' ')
+        return {' '.join(words[i:]) for i in range(len(words))}
+
+    def add(self, id, name):
+        for key in self._keys(name):
+            i = bisect.bisect_left(self.keys, key)
+            self.keys.insert(i, key)
+            self.ids.insert(i, id)
+
+    def span(self, prefix):
+        """(lo, hi) of the keys starting with prefix."""
+        lo = bisect.bisect_left(self.keys, prefix)
+        return lo, bisect.bisect_left(self.keys, prefix + '\U0010ffff', lo)
+
+    def matches(self, prefix):
+        """Ids of the names with a word starting with prefix."""
+        lo, hi = self.span(prefix)
+        return set(self.ids[lo:hi])
+
+
+def top(ids, rank, limit):
+    """The `limit` highest ranked ids, ties broken by the newest id."""
+    return heapq.nlargest(limit, ids, key=lambda id: (rank.get(id, 0), id))
+
+
+class Typeahead:
+    """
+    Worker resident prefix indexes over organisation names (ranked by
+    popularity) and each organisation's position names (ranked by their
+    post counts), for typeahead lookups without a database round trip.
+
+    The indexes are built on a background thread at startup and rebuilt
+    every `refresh_interval` seconds, which picks up popularity changes and
+    orgs or positions created by other worker processes. Orgs and positions
+    created by this process are added as they are committed. Results for
+    prefixes matching more than MEMO_MIN_MATCHES names (short prefixes) are
+    memoized until the next change.
+    """
+    MEMO_MIN_MATCHES = 256
+    READY_TIMEOUT = 10
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.refresh_interval = 300
+        self.max_limit = 50
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        self._stopped = False
+        self._orgs = PrefixIndex()
+        self._org_names = {}
+        self._popularity = {}
+        self._positions = {}
+        self._position_names = {}
+        self._position_ids = {}
+        self._post_counts = {}
+        self._memo = {}
+        self.builds = 0
+        self.last_build_seconds = 0.0
+        self.lookups = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('TYPEAHEAD_ENABLED', self.enabled)
+        self.refresh_interval = app.config.get('TYPEAHEAD_REFRESH_INTERVAL', self.refresh_interval)
+        self.max_limit = app.config.get('TYPEAHEAD_MAX_LIMIT', self.max_limit)
+        metrics.register('typeahead', self.stats)
+
+        if self.enabled and self._thread is None:
+            self._thread = threading.Thread(
+                    target=self._run, name='typeahead-build', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def build(self):
+        start = time.perf_counter()
+        with db.read_engine.connect() as conn:
+            orgs = conn.execute(select(
+                    Organisation.id, Organisation.name, Organisation.popularity)).all()
+            positions = conn.execute(select(
+                    Position.id, Position.org_id, Position.name,
+                    Position.review_count + Position.interview_count)).all()
+
+        org_names = {id: name for id, name, _ in orgs}
+        popularity = {id: score for id, _, score in orgs}
+        org_index = PrefixIndex((id, normalize(name)) for id, name in org_names.items())
+
+        by_org = {}
+        position_names = {}
+        post_counts = {}
+        position_ids = {}
+        for id, org_id, name, post_count in positions:
+            key = normalize(name)
+            by_org.setdefault(org_id, []).append((id, key))
+            position_names[id] = name
+            post_counts[id] = post_count
+            # exact matches go to the position with the most posts
+            existing = position_ids.get((org_id, key))
+            if existing is None or post_counts[existing] < post_count:
+                position_ids[(org_id, key)] = id
+        position_index = {org_id: PrefixIndex(names) for org_id, names in by_org.items()}
+
+        with self._lock:
+            self._orgs, self._org_names, self._popularity = org_index, org_names, popularity
+            self._positions, self._position_names = position_index, position_names
+            self._position_ids, self._post_counts = position_ids, post_counts
+            self._memo = {}
+            self.builds += 1
+            self.last_build_seconds = time.perf_counter() - start
+
+    def add_org(self, org_id, name, popularity=0):
+        with self._lock:
+            self._orgs.add(org_id, normalize(name))
+            self._org_names[org_id] = name
+            self._popularity[org_id] = popularity or 0
+            self._memo = {}
+
+    def add_position(self, org_id, position_id, name):
+        key = normalize(name)
+        with self._lock:
+            self._positions.setdefault(org_id, PrefixIndex()).add(position_id, key)
+            self._position_names[position_id] = name
+            self._post_counts.setdefault(position_id, 0)
+            self._position_ids.setdefault((org_id, key), position_id)
+
+    def orgs(self, prefix, limit=10):
+        """[(org id, name)] of the most popular orgs with a word starting
+        with prefix."""
+        prefix = normalize(prefix)
+        limit = max(1, min(limit, self.max_limit))
+        if not self._wait():
+            return []
+
+        with self._lock:
+            self.lookups += 1
+            lo, hi = self._orgs.span(prefix)
+            if hi - lo > self.MEMO_MIN_MATCHES:
+                found = self._memo.get(prefix)
+                if found is None:
+                    found = self._memo[prefix] = top(
+                            self._orgs.matches(prefix), self._popularity, self.max_limit)
+                found = found[:limit]
+            else:
+                found = top(self._orgs.matches(prefix), self._popularity, limit)
+            return [(id, self._org_names[id]) for id in found]
+
+    def positions(self, org_id, prefix, limit=10):
+        """[(position id, name)] of an org's positions with a word starting
+        with prefix, most posted about first."""
+        prefix = normalize(prefix)
+        limit = max(1, min(limit, self.max_limit))
+        if not self._wait():
+            return []
+
+        with self._lock:
+            self.lookups += 1
+            index = self._positions.get(org_id)
+            if index is None:
+                return []
+            found = top(index.matches(prefix), self._post_counts, limit)
+            return [(id, self._position_names[id]) for id in found]
+
+    def position_id(self, org_id, name):
+        """Id of the org's position named `name` once normalized, or None.
+        None may also mean the position was made by another worker since the
+        last build, so callers creating positions check the database too."""
+        if not self._wait():
+            return None
+        with self._lock:
+            return self._position_ids.get((org_id, normalize(name)))
+
+    def refresh(self):
+        """Rebuild the indexes on the background thread now, e.g. after a
+        bulk import."""
+        self._wake.set()
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                    enabled=self.enabled,
+                    ready=self.builds > 0,
+                    orgs=len(self._org_names),
+                    positions=len(self._position_names),
+                    builds=self.builds,
+                    last_build_seconds=self.last_build_seconds,
+                    lookups=self.lookups)
+
+    def _wait(self):
+        # lookups made while the first build runs wait for it; if the index
+        # is disabled or hasn't been built they find nothing
+        return self.enabled and self._ready.wait(self.READY_TIMEOUT) and self.builds > 0
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                self.build()
+            except Exception as e:
+                logger.error(e)
+            finally:
+                self._ready.set()
+            # until the first build succeeds, retry sooner than the interval
+            self._wake.wait(self.refresh_interval if self.builds else self.READY_TIMEOUT)
+            self._wake.clear()
+
+
+typeahead = Typeahead()
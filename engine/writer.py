@@ -0,0 +1,204 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import metrics
+from db import database as db
+
+
+logger = logging.getLogger('server')
+
+
+class GroupCommitWriter:
+    """
+    Runs the write endpoints' database changes. A write is a unit: a function
+    taking a session that makes its changes without committing. By default a
+    unit runs on the request's session and is committed straight away.
+
+    With WRITER_ENABLED, units are queued to a single writer thread instead,
+    which commits them in groups of up to `max_batch` units, waiting at most
+    `max_delay` seconds after the first for more to arrive. Each unit runs in
+    its own savepoint so a failing unit is rolled back on its own, and each
+    request still gets its own success or failure. Grouping turns many small
+    transactions (and fsyncs) into one and removes lock contention between
+    concurrent writers.
+    """
+    def __init__(self, app=None):
+        self.enabled = False
+        self.max_batch = 64
+        self.max_delay = 0.005
+        self.timeout = 10
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.groups = 0
+        self.units = 0
+        self.failed_units = 0
+        self.failed_groups = 0
+        self.last_group_seconds = 0.0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('WRITER_ENABLED', self.enabled)
+        self.max_batch = app.config.get('WRITER_MAX_BATCH', self.max_batch)
+        self.max_delay = app.config.get('WRITER_MAX_DELAY_MS', self.max_delay * 1000) / 1000
+        self.timeout = app.config.get('WRITER_TIMEOUT', self.timeout)
+        metrics.register('writer', self.stats)
+
+        if self.enabled and self._thread is None:
+            self._thread = threading.Thread(
+                    target=self._run, name='group-commit-writer', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def write(self, unit):
+        """Run unit(session) and commit it. Returns whether it was committed.
+        Objects a unit adds are usable (detached) after a queued write."""
+        if not self.enabled:
+            return self._write_direct(unit)
+
+        future = Future()
+        self._queue.put((unit, future))
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # a unit still queued is cancelled so it never runs; one the
+            # writer has started is waited for, so the result is its own
+            if future.cancel():
+                logger.error('write not started after %ss, cancelled', self.timeout)
+                return False
+            return future.result()
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=self.timeout)
+            self._thread = None
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                    enabled=self.enabled,
+                    queued=self._queue.qsize(),
+                    groups=self.groups,
+                    units=self.units,
+                    failed_units=self.failed_units,
+                    failed_groups=self.failed_groups,
+                    mean_group_size=round(self.units / self.groups, 2) if self.groups else 0,
+                    last_group_seconds=self.last_group_seconds)
+
+    def _write_direct(self, unit):
+        session = db.Session
+        try:
+            unit(session)
+            session.commit()
+        except Exception as e:
+            logger.error(e)
+            session.rollback()
+            return False
+
+        return True
+
+    def _next_group(self):
+        """Block for a unit, then gather more until the group is full or
+        max_delay has passed. None once stopped."""
+        item = self._queue.get()
+        if item is None:
+            return None
+
+        group = [item]
+        deadline = time.monotonic() + self.max_delay
+        while len(group) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # commit what we have, then stop
+                self._queue.put(None)
+                break
+            group.append(item)
+        return group
+
+    def _run(self):
+        while True:
+            group = self._next_group()
+            if group is None:
+                return
+
+            # units whose requests timed out waiting are dropped
+            group = [(unit, future) for unit, future in group
+                     if future.set_running_or_notify_cancel()]
+            if not group:
+                continue
+
+            start = time.perf_counter()
+            results = self._commit_group(group)
+            with self._lock:
+                self.groups += 1
+                self.units += len(group)
+                self.failed_units += results.count(False)
+                self.last_group_seconds = time.perf_counter() - start
+
+            for (_, future), committed in zip(group, results):
+                future.set_result(committed)
+
+    def _commit_group(self, group):
+        session = db.WriterSession()
+        results = []
+        try:
+            # the write engine begins every transaction itself (see
+            # db.database), without one each savepoint would commit alone
+            if not session.connection().connection.driver_connection.in_transaction:
+                raise RuntimeError('group commit is not in a transaction')
+            for unit, _ in group:
+                savepoint = session.begin_nested()
+                try:
+                    unit(session)
+                    savepoint.commit()
+                    results.append(True)
+                except Exception as e:
+                    logger.error(e)
+                    savepoint.rollback()
+                    results.append(False)
+            session.commit()
+            return results
+        except Exception as e:
+            # the group was rolled back as a whole: commit the units that had
+            # succeeded (or not run yet) on their own so one bad unit can't
+            # fail the others. Units that failed in their savepoint stay failed.
+            logger.error(e)
+            session.rollback()
+            with self._lock:
+                self.failed_groups += 1
+            results += [True] * (len(group) - len(results))
+            return [committed and self._commit_one(unit)
+                    for (unit, _), committed in zip(group, results)]
+        finally:
+            session.expunge_all()
+            session.close()
+
+    def _commit_one(self, unit):
+        session = db.WriterSession()
+        try:
+            unit(session)
+            session.commit()
+            return True
+        except Exception as e:
+            logger.error(e)
+            session.rollback()
+            return False
+        finally:
+            session.expunge_all()
+            session.close()
+
+
+writer = GroupCommitWriter()